@@ -0,0 +1,134 @@
+"""
+LangChain callback handlers used by the FetiiPro chatbot
+"""
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from deadlines import Deadline
+from tracing import QueryTrace
+
+
+class DeadlineCallbackHandler(BaseCallbackHandler):
+    """Aborts an agent run at the next LLM or tool boundary once its deadline is cancelled"""
+
+    # Exceptions from this handler must propagate instead of being logged
+    raise_error: bool = True
+
+    def __init__(self, deadline: Deadline):
+        self.deadline = deadline
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any):
+        self.deadline.check()
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any):
+        self.deadline.check()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], **kwargs: Any):
+        self.deadline.check()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any):
+        self.deadline.check()
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any):
+        self.deadline.check()
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Records LLM calls, tool calls and SQL executions as trace spans"""
+
+    def __init__(self, trace: QueryTrace, parent_span: Optional[int] = None):
+        """
+        Initialize the handler
+
+        Args:
+            trace: The query trace to record into
+            parent_span: Span that encloses the agent run (e.g. a cascade tier)
+        """
+        self.trace = trace
+        self.parent_span = parent_span
+        self._spans: Dict[UUID, int] = {}
+
+    def _parent(self, parent_run_id: Optional[UUID]) -> Optional[int]:
+        return self._spans.get(parent_run_id, self.parent_span) if parent_run_id else self.parent_span
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], *,
+                       run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        # Only the top-level agent run becomes a span; inner chains are noise
+        if parent_run_id is None:
+            self._spans[run_id] = self.trace.start_span("agent", "agent", self.parent_span)
+
+    def on_chain_end(self, outputs: Dict[str, Any], *, run_id: UUID, **kwargs: Any):
+        span_id = self._spans.pop(run_id, None)
+        if span_id is not None:
+            steps = outputs.get("intermediate_steps", []) if isinstance(outputs, dict) else []
+            self.trace.end_span(span_id, steps=len(steps))
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        span_id = self._spans.pop(run_id, None)
+        if span_id is not None:
+            self.trace.end_span(span_id, error=str(error))
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *,
+                     run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        self._start_llm(serialized, run_id, parent_run_id, sum(len(prompt) for prompt in prompts), kwargs)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *,
+                            run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        prompt_chars = sum(len(str(message.content)) for batch in messages for message in batch)
+        self._start_llm(serialized, run_id, parent_run_id, prompt_chars, kwargs)
+
+    def _start_llm(self, serialized, run_id, parent_run_id, prompt_chars, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model_name") or params.get("model") or "llm"
+        self._spans[run_id] = self.trace.start_span(
+            f"llm:{model}", "llm", self._parent(parent_run_id), prompt_chars=prompt_chars
+        )
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        span_id = self._spans.pop(run_id, None)
+        if span_id is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if not usage:
+            # Streamed responses report usage on the message instead
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    if metadata:
+                        usage = {
+                            "prompt_tokens": metadata.get("input_tokens", 0),
+                            "completion_tokens": metadata.get("output_tokens", 0),
+                            "total_tokens": metadata.get("total_tokens", 0)
+                        }
+        self.trace.end_span(
+            span_id,
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            total_tokens=usage.get("total_tokens", 0)
+        )
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        span_id = self._spans.pop(run_id, None)
+        if span_id is not None:
+            self.trace.end_span(span_id, error=str(error))
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *,
+                      run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        category = "sql" if name == "sql_db_query" else "tool"
+        self._spans[run_id] = self.trace.start_span(
+            f"tool:{name}", category, self._parent(parent_run_id), input=input_str[:500]
+        )
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        span_id = self._spans.pop(run_id, None)
+        if span_id is not None:
+            self.trace.end_span(span_id, output_chars=len(str(output)))
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        span_id = self._spans.pop(run_id, None)
+        if span_id is not None:
+            self.trace.end_span(span_id, error=str(error))
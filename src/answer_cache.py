@@ -0,0 +1,92 @@
+"""
+Answer cache for the FetiiPro chatbot
+Caches final answers per normalized question, tied to the database version
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Appended to the cache key of approximate answers
+APPROXIMATE_SUFFIX = "|approximate"
+
+
+def get_db_version(db_path: str) -> Optional[str]:
+    """
+    Get a version string for a database file
+
+    The version changes whenever the file is rebuilt or modified, which is
+    enough to invalidate answers computed against older data.
+    """
+    try:
+        stat = os.stat(db_path)
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+class AnswerCache:
+    """
+    LRU cache of query results keyed by normalized question.
+    Entries remember the database version they were computed against and
+    are treated as misses once the version changes.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        """
+        Initialize the cache
+
+        Args:
+            max_entries: Maximum number of cached answers
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def get(self, key: str, version: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Get a cached result for the current database version"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["version"] != version:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry["result"]
+
+    def contains(self, key: str, version: Optional[str]) -> bool:
+        """Check for a current entry without affecting statistics or recency"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry["version"] == version
+
+    def put(self, key: str, question: str, version: Optional[str], result: Dict[str, Any]):
+        """Store a result computed against the given database version"""
+        with self._lock:
+            self._entries[key] = {"question": question, "version": version, "result": result}
+            self._entries.move_to_end(key)
+            self.stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def get_entries(self) -> List[Tuple[str, str]]:
+        """Get the (key, original question) of all cached entries, most recent last"""
+        with self._lock:
+            return [(key, entry["question"]) for key, entry in self._entries.items()]
+
+    def clear(self):
+        """Remove all cached answers"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics"""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                entries=len(self._entries),
+                hit_rate=self.stats["hits"] / lookups if lookups else 0
+            )
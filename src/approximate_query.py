@@ -0,0 +1,410 @@
+"""
+Approximate query answering for the FetiiPro chatbot
+Stratified trip samples built at setup time, a rewriter that runs aggregate
+queries against them with sampling weights, and confidence intervals from
+random replicate groups
+"""
+import contextvars
+import re
+import sqlite3
+import threading
+from statistics import NormalDist
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from deadlines import get_current_deadline
+from sql_validator import ALIAS_STOPWORDS, connect_readonly
+
+SAMPLE_TABLES = ("trips_sample", "riders_sample", "sample_info")
+
+# Source table -> sample table; other tables may only be joined in unchanged
+SAMPLED_TABLES = {"trips": "trips_sample", "riders": "riders_sample"}
+PASSTHROUGH_TABLES = {"demographics"}
+
+_current_approximation: contextvars.ContextVar = contextvars.ContextVar("fetii_approximation", default=None)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_TABLE_REF = re.compile(
+    r"\b(FROM|JOIN)\s+([A-Za-z_]\w*)\b(?:(\s+(?:AS\s+)?)([A-Za-z_]\w*))?",
+    re.IGNORECASE
+)
+_AGGREGATE = re.compile(r"\b(COUNT|SUM|TOTAL|AVG)\s*\(", re.IGNORECASE)
+_UNSUPPORTED = re.compile(
+    r"\b(WITH|UNION|INTERSECT|EXCEPT|DISTINCT|OVER|MIN|MAX|GROUP_CONCAT)\b",
+    re.IGNORECASE
+)
+# Comma joins hide table references from the rewriter
+_COMMA_JOIN = re.compile(r"\bFROM\s+\w+(?:\s+(?:AS\s+)?\w+)?\s*,", re.IGNORECASE)
+_ORDER_OR_LIMIT = re.compile(r"\s+(ORDER\s+BY|LIMIT)\b.*$", re.IGNORECASE | re.DOTALL)
+
+
+def build_trip_samples(cursor: sqlite3.Cursor, fraction: float = 0.01, replicates: int = 10,
+                       min_per_stratum: Optional[int] = None):
+    """
+    Build stratified samples of trips and riders
+
+    Trips are stratified by (date, hour); each stratum keeps a fixed fraction
+    of its trips (at least min_per_stratum, or all of them if it is smaller),
+    chosen by a deterministic hash of trip_id. Every sampled row carries the
+    inverse sampling rate as sample_weight and a replicate group number used
+    to estimate sampling error. Riders are sampled with their trips.
+
+    Args:
+        cursor: Database cursor
+        fraction: Share of each stratum to keep
+        replicates: Number of random replicate groups
+        min_per_stratum: Minimum rows kept per stratum (default 2 per replicate)
+    """
+    if min_per_stratum is None:
+        min_per_stratum = 2 * replicates
+
+    cursor.execute("DROP TABLE IF EXISTS trips_sample")
+    cursor.execute('''
+        CREATE TABLE trips_sample AS
+        SELECT t.*,
+               s.stratum_rows * 1.0 / s.sample_size AS sample_weight,
+               (s.rn - 1) % :replicates AS replicate
+        FROM (
+            SELECT src_rowid, rn, stratum_rows,
+                   MIN(stratum_rows, MAX(:min_per_stratum,
+                       CAST(stratum_rows * :fraction + 0.999999 AS INTEGER))) AS sample_size
+            FROM (
+                SELECT rowid AS src_rowid,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY date, hour ORDER BY (trip_id * 2654435761) % 4294967296
+                       ) AS rn,
+                       COUNT(*) OVER (PARTITION BY date, hour) AS stratum_rows
+                FROM trips
+            )
+        ) s
+        JOIN trips t ON t.rowid = s.src_rowid
+        WHERE s.rn <= s.sample_size
+    ''', {"replicates": replicates, "min_per_stratum": min_per_stratum, "fraction": fraction})
+    cursor.execute("CREATE INDEX idx_trips_sample_replicate ON trips_sample(replicate)")
+    cursor.execute("CREATE INDEX idx_trips_sample_trip_id ON trips_sample(trip_id)")
+
+    cursor.execute("DROP TABLE IF EXISTS riders_sample")
+    cursor.execute('''
+        CREATE TABLE riders_sample AS
+        SELECT r.*, s.sample_weight, s.replicate
+        FROM riders r
+        JOIN trips_sample s ON s.trip_id = r.trip_id
+    ''')
+    cursor.execute("CREATE INDEX idx_riders_sample_replicate ON riders_sample(replicate)")
+    cursor.execute("CREATE INDEX idx_riders_sample_trip_id ON riders_sample(trip_id)")
+
+    cursor.execute("DROP TABLE IF EXISTS sample_info")
+    cursor.execute('''
+        CREATE TABLE sample_info (
+            table_name TEXT PRIMARY KEY,
+            source_rows INTEGER,
+            sample_rows INTEGER,
+            fraction REAL,
+            replicates INTEGER
+        )
+    ''')
+    for source, sample in SAMPLED_TABLES.items():
+        cursor.execute(
+            f"INSERT INTO sample_info VALUES (?, (SELECT COUNT(*) FROM {source}), "
+            f"(SELECT COUNT(*) FROM {sample}), ?, ?)",
+            (source, fraction, replicates)
+        )
+
+
+class ApproximationContext:
+    """Per-query approximation settings plus the estimates produced while answering"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.estimates: List[Dict[str, Any]] = []
+
+
+def get_current_approximation() -> Optional[ApproximationContext]:
+    """Get the approximation context of the query running in this context"""
+    return _current_approximation.get()
+
+
+def run_with_approximation(fn: Callable[[], Any], context: ApproximationContext) -> Any:
+    """Run fn with the given approximation context active"""
+    token = _current_approximation.set(context)
+    try:
+        return fn()
+    finally:
+        _current_approximation.reset(token)
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split on commas that are not inside parentheses"""
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(text):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _closing_paren(sql: str, open_index: int) -> int:
+    """Find the parenthesis closing the one at open_index"""
+    depth = 0
+    for i in range(open_index, len(sql)):
+        if sql[i] == "(":
+            depth += 1
+        elif sql[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError("Unbalanced parentheses")
+
+
+class ApproximateQueryEngine:
+    """
+    Answers aggregate queries from the stratified samples.
+    Supported queries are single SELECTs over trips and/or riders (optionally
+    joined with demographics) using COUNT, SUM, TOTAL and AVG; anything else,
+    or a trips table below min_rows, is left to exact execution.
+    """
+
+    def __init__(self, db_path: str, min_rows: int = 1000000, confidence: float = 0.95,
+                 connect: Optional[Callable[[], sqlite3.Connection]] = None):
+        """
+        Initialize the engine
+
+        Args:
+            db_path: Path to the SQLite database
+            min_rows: Trips tables smaller than this are always queried exactly
+            confidence: Confidence level of the reported intervals
+            connect: Optional factory returning a sqlite3 connection
+        """
+        self.db_path = db_path
+        self.min_rows = min_rows
+        self.confidence = confidence
+        self._z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self._connect = connect or (lambda: connect_readonly(self.db_path))
+        self._lock = threading.Lock()
+        self.stats = {"approximated": 0, "exact_small_table": 0, "exact_unsupported": 0}
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def rewrite(self, sql: str, replicate: Optional[int] = None,
+                replicates: int = 1) -> Optional[Tuple[str, Dict[int, bool]]]:
+        """
+        Rewrite a query to run against the samples with sampling weights
+
+        Args:
+            sql: The original query
+            replicate: Restrict to one replicate group (weights scaled up to match)
+            replicates: Total number of replicate groups
+
+        Returns:
+            Tuple of (rewritten SQL, {position: is_ratio} for each estimated
+            select column), or None if the query cannot be approximated
+        """
+        # Work on a copy with string literals blanked out so keywords inside
+        # them are ignored; literals are restored at the end
+        literals = _STRING_LITERAL.findall(sql)
+        masked = _STRING_LITERAL.sub("'?'", sql).strip().rstrip(";")
+
+        if (len(re.findall(r"\bSELECT\b", masked, re.IGNORECASE)) != 1
+                or not masked.upper().startswith("SELECT")
+                or _UNSUPPORTED.search(masked)
+                or _COMMA_JOIN.search(masked)
+                or not _AGGREGATE.search(masked)):
+            return None
+
+        refs = _TABLE_REF.findall(masked)
+        tables = {table.lower() for _, table, _, _ in refs}
+        if not tables & set(SAMPLED_TABLES) or tables - set(SAMPLED_TABLES) - PASSTHROUGH_TABLES:
+            return None
+
+        # Riders rows are the finest grain, so their weights apply when joined
+        weighted = "riders" if "riders" in tables else "trips"
+        weight_alias = weighted
+
+        def replace_table(match):
+            nonlocal weight_alias
+            keyword, table, spacing, alias = match.groups()
+            trailing = ""
+            if alias and alias.upper() in ALIAS_STOPWORDS:
+                trailing, spacing, alias = spacing + alias, None, None
+            source = SAMPLED_TABLES.get(table.lower())
+            if source is None:
+                return match.group(0)
+            if replicate is not None:
+                source = f"(SELECT * FROM {source} WHERE replicate = {int(replicate)})"
+            if table.lower() == weighted:
+                weight_alias = alias or table
+            if alias:
+                return f"{keyword} {source}{spacing}{alias}"
+            # Keep the original name usable as a qualifier
+            return f"{keyword} {source} AS {table}{trailing}"
+
+        rewritten = _TABLE_REF.sub(replace_table, masked)
+        weight = f"{weight_alias}.sample_weight"
+        if replicate is not None:
+            weight = f"({weight} * {replicates})"
+
+        # Weight the aggregates, innermost text first so offsets stay valid
+        for match in reversed(list(_AGGREGATE.finditer(rewritten))):
+            function = match.group(1).upper()
+            open_index = match.end() - 1
+            close_index = _closing_paren(rewritten, open_index)
+            argument = rewritten[open_index + 1:close_index].strip()
+            if function == "COUNT":
+                # TOTAL() is 0.0 rather than NULL when no sampled row matches
+                if argument == "*":
+                    replacement = f"TOTAL({weight})"
+                else:
+                    replacement = f"TOTAL(CASE WHEN ({argument}) IS NOT NULL THEN {weight} END)"
+            elif function in ("SUM", "TOTAL"):
+                replacement = f"{function}(({argument}) * {weight})"
+            else:
+                replacement = (
+                    f"(SUM(({argument}) * {weight}) / "
+                    f"SUM(CASE WHEN ({argument}) IS NOT NULL THEN {weight} END))"
+                )
+            rewritten = rewritten[:match.start()] + replacement + rewritten[close_index + 1:]
+
+        # Columns holding estimates (anything built from an aggregate)
+        select_list = re.split(r"\bFROM\b", masked[len("SELECT"):], maxsplit=1, flags=re.IGNORECASE)[0]
+        estimated = {
+            position: bool(re.search(r"\bAVG\s*\(", item, re.IGNORECASE))
+            for position, item in enumerate(_split_top_level(select_list))
+            if _AGGREGATE.search(item)
+        }
+
+        for literal in literals:
+            rewritten = rewritten.replace("'?'", literal, 1)
+        return rewritten, estimated
+
+    def _execute(self, conn: sqlite3.Connection, sql: str) -> Tuple[List[str], List[tuple]]:
+        deadline = get_current_deadline()
+        if deadline is not None:
+            deadline.check()
+            deadline.register_connection(conn)
+        try:
+            cursor = conn.execute(sql)
+            return [column[0] for column in cursor.description], cursor.fetchall()
+        finally:
+            if deadline is not None:
+                deadline.unregister_connection(conn)
+
+    def _sample_info(self, conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+        try:
+            row = conn.execute(
+                "SELECT source_rows, sample_rows, fraction, replicates FROM sample_info "
+                "WHERE table_name = 'trips'"
+            ).fetchone()
+        except sqlite3.OperationalError:
+            return None
+        if row is None:
+            return None
+        return dict(zip(("source_rows", "sample_rows", "fraction", "replicates"), row))
+
+    def estimate(self, sql: str) -> Optional[Dict[str, Any]]:
+        """
+        Answer a query approximately
+
+        Args:
+            sql: Query against the full tables
+
+        Returns:
+            Estimates with confidence intervals, or None if the query should
+            run exactly (unsupported shape, no samples, or a small table)
+        """
+        rewrite = self.rewrite(sql)
+        if rewrite is None:
+            self._count("exact_unsupported")
+            return None
+        rewritten, estimated = rewrite
+
+        conn = self._connect()
+        try:
+            info = self._sample_info(conn)
+            if info is None or info["source_rows"] < self.min_rows:
+                self._count("exact_small_table")
+                return None
+
+            _, rows = self._execute(conn, rewritten)
+            # Report estimates under the original query's column names (the
+            # rewritten expressions would otherwise name unaliased columns)
+            columns, _ = self._execute(conn, f"SELECT * FROM ({sql.strip().rstrip(';')}) LIMIT 0")
+
+            # Replicate estimates of every group, keyed by its non-estimate columns
+            replicates = info["replicates"]
+            key_positions = [i for i in range(len(columns)) if i not in estimated]
+            replicate_values = []
+            for replicate in range(replicates):
+                replicate_sql, _ = self.rewrite(sql, replicate=replicate, replicates=replicates)
+                _, replicate_rows = self._execute(conn, _ORDER_OR_LIMIT.sub("", replicate_sql))
+                replicate_values.append({
+                    tuple(row[i] for i in key_positions): row for row in replicate_rows
+                })
+        finally:
+            conn.close()
+
+        results = []
+        for row in rows:
+            key = tuple(row[i] for i in key_positions)
+            intervals = {}
+            for position, is_ratio in estimated.items():
+                value = row[position]
+                if value is None:
+                    continue
+                samples = []
+                for values in replicate_values:
+                    replicate_row = values.get(key)
+                    if replicate_row is not None and replicate_row[position] is not None:
+                        samples.append(replicate_row[position])
+                    elif not is_ratio:
+                        # A group absent from a replicate contributes zero to totals
+                        samples.append(0)
+                margin = 0.0
+                if len(samples) > 1:
+                    mean = sum(samples) / len(samples)
+                    variance = sum((s - mean) ** 2 for s in samples) / (len(samples) * (len(samples) - 1))
+                    margin = self._z * variance ** 0.5
+                intervals[columns[position]] = [value - margin, value + margin]
+            results.append({"values": list(row), "intervals": intervals})
+
+        self._count("approximated")
+        return {
+            "query": sql,
+            "rewritten_query": rewritten,
+            "columns": columns,
+            "rows": results,
+            "confidence": self.confidence,
+            "sample_rows": info["sample_rows"],
+            "source_rows": info["source_rows"]
+        }
+
+    def format_estimate(self, estimate: Dict[str, Any]) -> str:
+        """Format an estimate as a tool observation for the agent"""
+        level = f"{estimate['confidence']:.0%}"
+        lines = [
+            f"Approximate result from a stratified sample of {estimate['sample_rows']:,} of "
+            f"{estimate['source_rows']:,} trips. Estimated values are shown with their "
+            f"{level} confidence interval; say in the answer that they are estimates."
+        ]
+        rendered = []
+        for row in estimate["rows"]:
+            values = []
+            for column, value in zip(estimate["columns"], row["values"]):
+                interval = row["intervals"].get(column)
+                if interval is None:
+                    values.append(value)
+                else:
+                    values.append(f"~{value:,.2f} ({level} CI {interval[0]:,.2f} to {interval[1]:,.2f})")
+            rendered.append(tuple(values))
+        lines.append(str(rendered))
+        return "\n".join(lines)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get approximation statistics"""
+        with self._lock:
+            return dict(self.stats, min_rows=self.min_rows)
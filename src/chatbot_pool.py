@@ -0,0 +1,310 @@
+"""
+Multi-dataset chatbot pool for the FetiiPro web app
+Keeps one chatbot per dataset (city or client database) warm in a single
+process, bounded by an LRU on instance count and accounted memory
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from memory_watchdog import get_rss_mb
+
+DEFAULT_DATASET = "default"
+
+
+class UnknownDataset(KeyError):
+    """Raised when a request names a dataset that is not configured"""
+
+
+class Dataset:
+    """A named database plus the directory its per-dataset state lives in"""
+
+    def __init__(self, name: str, db_path: str, state_dir: Optional[str] = None):
+        """
+        Args:
+            name: Dataset name used in /d/<name>/ paths and X-Fetii-Dataset
+            db_path: Path to the dataset's SQLite database
+            state_dir: Directory for its answer cache and examples (defaults
+                to <db dir>/<db stem>_state, so datasets never share them)
+        """
+        self.name = name
+        self.db_path = db_path
+        self.state_dir = state_dir or str(Path(db_path).with_name(f"{Path(db_path).stem}_state"))
+
+    def state_path(self, filename: str) -> str:
+        """Path of a per-dataset state file"""
+        return os.path.join(self.state_dir, filename)
+
+
+def parse_datasets(spec: Optional[str], default_db_path: str) -> Dict[str, Dataset]:
+    """
+    Parse FETII_DATASETS ("austin=data/austin.db,dallas=data/dallas.db")
+
+    The default dataset keeps its state in the database directory as before,
+    so a single-dataset deployment is unchanged.
+
+    Args:
+        spec: Comma-separated name=path pairs (None or empty for none)
+        default_db_path: Database of the default dataset, unless spec names one
+
+    Returns:
+        Datasets by name, the default one first
+
+    Raises:
+        ValueError: If an entry is malformed or a name is not URL-safe
+    """
+    datasets = OrderedDict()
+    datasets[DEFAULT_DATASET] = Dataset(DEFAULT_DATASET, default_db_path, os.path.dirname(default_db_path))
+    for entry in filter(None, (part.strip() for part in (spec or "").split(","))):
+        name, separator, path = entry.partition("=")
+        name, path = name.strip(), path.strip()
+        if not separator or not name or not path:
+            raise ValueError(f"Invalid dataset entry (expected name=path): {entry}")
+        if not name.replace("-", "").replace("_", "").isalnum():
+            raise ValueError(f"Dataset names may only contain letters, digits, '-' and '_': {name}")
+        if name == DEFAULT_DATASET:
+            datasets[name] = Dataset(name, path, os.path.dirname(path))
+        else:
+            datasets[name] = Dataset(name, path)
+    return datasets
+
+
+class ChatbotPool:
+    """
+    LRU pool of chatbots, one per dataset.
+    Each chatbot has its own connections, schema cache and answer cache.
+    Builds are serialized so the RSS growth of each build can be attributed
+    to its dataset; that, plus later growth of its in-memory replica, is the
+    dataset's accounted memory. Past max_chatbots or max_memory_mb the least
+    recently used chatbots are evicted; an evicted chatbot is closed once the
+    last request that acquired it releases it.
+    """
+
+    def __init__(self, datasets: Dict[str, Dataset], factory: Callable[[Dataset], Any],
+                 max_chatbots: int = 4, max_memory_mb: Optional[float] = None):
+        """
+        Initialize the pool (no chatbot is built until first use)
+
+        Args:
+            datasets: Configured datasets by name
+            factory: Builds the chatbot of a dataset
+            max_chatbots: Chatbots kept at most
+            max_memory_mb: Accounted memory kept at most (None for no limit);
+                the most recently used chatbot is always kept
+        """
+        self.datasets = datasets
+        self.factory = factory
+        self.max_chatbots = max(1, max_chatbots)
+        self.max_memory_mb = max_memory_mb
+        self.stats = {"builds": 0, "hits": 0, "evictions": 0, "failed_builds": 0, "deferred_closes": 0}
+        # name -> {"chatbot", "built_at", "last_used", "requests", "build_mb",
+        #          "build_seconds", "replica_mb", "in_use", "evicted"}
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # id(chatbot) -> entry, for chatbots acquired and not yet released
+        self._in_use: Dict[int, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def get(self, name: str):
+        """
+        Get the chatbot of a dataset, building it on first use
+
+        Raises:
+            UnknownDataset: If the dataset is not configured
+        """
+        if name not in self.datasets:
+            raise UnknownDataset(name)
+        entry = self._touch(name)
+        if entry is not None:
+            return entry["chatbot"]
+
+        with self._build_lock:
+            # Another request may have built it while we waited
+            entry = self._touch(name)
+            if entry is not None:
+                return entry["chatbot"]
+            start_time = time.time()
+            rss_before = get_rss_mb()
+            try:
+                chatbot = self.factory(self.datasets[name])
+            except Exception:
+                with self._lock:
+                    self.stats["failed_builds"] += 1
+                raise
+            rss_after = get_rss_mb()
+            build_mb = rss_after - rss_before if rss_before is not None and rss_after is not None else 0.0
+            entry = {
+                "chatbot": chatbot,
+                "built_at": time.time(),
+                "last_used": time.time(),
+                "requests": 1,
+                "build_seconds": time.time() - start_time,
+                "build_mb": max(0.0, build_mb),
+                "replica_mb": self._replica_mb(chatbot),
+                "in_use": 0,
+                "evicted": False
+            }
+            with self._lock:
+                self._entries[name] = entry
+                self.stats["builds"] += 1
+            print(f"🗂️ Built chatbot for dataset '{name}' in {entry['build_seconds']:.2f}s "
+                  f"(+{entry['build_mb']:.0f} MB)")
+        self._evict()
+        return chatbot
+
+    def acquire(self, name: str):
+        """
+        Get the chatbot of a dataset and keep it open until release()
+
+        Raises:
+            UnknownDataset: If the dataset is not configured
+        """
+        while True:
+            chatbot = self.get(name)
+            with self._lock:
+                entry = self._entries.get(name)
+                # It may have been evicted between get() and here
+                if entry is not None and entry["chatbot"] is chatbot:
+                    entry["in_use"] += 1
+                    self._in_use[id(chatbot)] = entry
+                    return chatbot
+
+    def release(self, chatbot):
+        """Release a chatbot from acquire(), closing it if it was evicted meanwhile"""
+        with self._lock:
+            entry = self._in_use.get(id(chatbot))
+            if entry is None:
+                return
+            entry["in_use"] -= 1
+            if entry["in_use"]:
+                return
+            del self._in_use[id(chatbot)]
+            close = entry["evicted"]
+        if close:
+            chatbot.close()
+
+    def peek(self, name: str):
+        """Get a dataset's chatbot if it is built, without building or touching it"""
+        with self._lock:
+            entry = self._entries.get(name)
+            return entry["chatbot"] if entry else None
+
+    def _touch(self, name: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                self._entries.move_to_end(name)
+                entry["last_used"] = time.time()
+                entry["requests"] += 1
+                self.stats["hits"] += 1
+            return entry
+
+    @staticmethod
+    def _replica_mb(chatbot) -> float:
+        replica = getattr(chatbot, "replica", None)
+        return replica.get_stats()["size_mb"] if replica is not None else 0.0
+
+    @classmethod
+    def _entry_memory_mb(cls, entry: Dict[str, Any]) -> float:
+        # Build growth, adjusted for replica reloads since the build
+        return max(0.0, entry["build_mb"] + cls._replica_mb(entry["chatbot"]) - entry["replica_mb"])
+
+    def memory_mb(self, name: str) -> float:
+        """Accounted memory of a built dataset (0 if it is not built)"""
+        with self._lock:
+            entry = self._entries.get(name)
+        return self._entry_memory_mb(entry) if entry is not None else 0.0
+
+    def total_memory_mb(self) -> float:
+        """Accounted memory of all built datasets"""
+        with self._lock:
+            entries = list(self._entries.values())
+        return sum(self._entry_memory_mb(entry) for entry in entries)
+
+    def _evict(self):
+        """Evict least recently used chatbots beyond the count and memory limits"""
+        while True:
+            with self._lock:
+                if len(self._entries) <= 1:
+                    return
+                over_count = len(self._entries) > self.max_chatbots
+            over_memory = self.max_memory_mb is not None and self.total_memory_mb() > self.max_memory_mb
+            if not over_count and not over_memory:
+                return
+            self.evict_least_recent("count" if over_count else "memory")
+
+    def evict_least_recent(self, reason: str = "manual") -> Optional[str]:
+        """
+        Evict the least recently used chatbot (the most recent one is kept)
+        and close it, or leave closing to its last release() if it is in use
+
+        Returns:
+            The evicted dataset name, or None if at most one chatbot is built
+        """
+        with self._lock:
+            if len(self._entries) <= 1:
+                return None
+            name, entry = next(iter(self._entries.items()))
+            memory = self._entry_memory_mb(entry)
+            del self._entries[name]
+            entry["evicted"] = True
+            self.stats["evictions"] += 1
+            # Requests still holding the chatbot finish on it; the last
+            # release() closes it
+            deferred = entry["in_use"] > 0
+            if deferred:
+                self.stats["deferred_closes"] += 1
+        if not deferred:
+            entry["chatbot"].close()
+        print(f"🗂️ Evicted dataset '{name}' ({reason} limit, ~{memory:.0f} MB"
+              f"{', closed after in-flight requests' if deferred else ''})")
+        return name
+
+    def release_memory(self) -> Dict[str, Any]:
+        """
+        Soft memory limit: evict all but the most recently used chatbot and
+        release the in-process caches of the one kept
+
+        Returns:
+            Evicted dataset names and what the kept chatbot released
+        """
+        evicted = []
+        while True:
+            name = self.evict_least_recent("soft memory")
+            if name is None:
+                break
+            evicted.append(name)
+        with self._lock:
+            kept = [entry["chatbot"] for entry in self._entries.values()]
+        released = kept[0].release_memory() if kept else {}
+        return {"evicted_datasets": evicted, "released": released}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get pool statistics, with per-dataset usage and accounted memory"""
+        with self._lock:
+            entries = list(self._entries.items())
+            stats = dict(self.stats)
+        datasets: List[Dict[str, Any]] = []
+        for name, entry in reversed(entries):
+            datasets.append({
+                "dataset": name,
+                "db_path": self.datasets[name].db_path,
+                "memory_mb": round(self._entry_memory_mb(entry), 1),
+                "requests": entry["requests"],
+                "in_use": entry["in_use"],
+                "last_used": entry["last_used"],
+                "built_at": entry["built_at"],
+                "build_seconds": round(entry["build_seconds"], 2),
+                "structures": entry["chatbot"].get_memory_structures()
+            })
+        return dict(
+            stats,
+            configured=list(self.datasets),
+            max_chatbots=self.max_chatbots,
+            max_memory_mb=self.max_memory_mb,
+            total_memory_mb=round(sum(item["memory_mb"] for item in datasets), 1),
+            datasets=datasets
+        )
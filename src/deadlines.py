@@ -0,0 +1,199 @@
+"""
+Request deadlines and cancellation for the FetiiPro chatbot
+A Deadline travels with a query into the agent run and into SQLite, so work
+stops as soon as the client goes away or the time budget runs out
+"""
+import contextvars
+import threading
+import time
+from typing import Any, Callable, Optional
+
+_current_deadline: contextvars.ContextVar = contextvars.ContextVar("fetii_deadline", default=None)
+
+
+class QueryCancelled(Exception):
+    """Raised when a query is cancelled or runs past its deadline"""
+
+    def __init__(self, reason: str):
+        self.reason = reason
+        messages = {
+            "deadline": "Query exceeded its time limit and was cancelled.",
+            "client_disconnected": "Client disconnected; query was cancelled."
+        }
+        super().__init__(messages.get(reason, f"Query was cancelled ({reason})."))
+
+
+class Deadline:
+    """A point in time after which a query must stop, plus an explicit cancel flag"""
+
+    def __init__(self, timeout: Optional[float] = None):
+        """
+        Initialize the deadline
+
+        Args:
+            timeout: Seconds from now until the deadline (None for no time limit)
+        """
+        self.expires_at = time.time() + timeout if timeout else None
+        self.reason = None
+        self._cancelled = threading.Event()
+        self._connections = set()
+        self._workers = 0
+        self._on_finished = []
+        self._lock = threading.Lock()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline (None if unlimited)"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.time())
+
+    def expired(self) -> bool:
+        """Whether the deadline has passed"""
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the query has been cancelled or has expired"""
+        if not self._cancelled.is_set() and self.expired():
+            self.cancel("deadline")
+        return self._cancelled.is_set()
+
+    def cancel(self, reason: str = "cancelled"):
+        """Cancel the query and interrupt any SQLite statement it is running"""
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self.reason = reason
+            self._cancelled.set()
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.interrupt()
+            except Exception:
+                pass
+
+    def check(self):
+        """Raise QueryCancelled if the query should stop"""
+        if self.cancelled:
+            raise QueryCancelled(self.reason)
+
+    def register_connection(self, connection):
+        """Track a sqlite3 connection so cancel() can interrupt it"""
+        with self._lock:
+            self._connections.add(connection)
+
+    def unregister_connection(self, connection):
+        """Stop tracking a sqlite3 connection"""
+        with self._lock:
+            self._connections.discard(connection)
+
+    def worker_started(self):
+        """Record that a helper thread is running work under this deadline"""
+        with self._lock:
+            self._workers += 1
+
+    def worker_finished(self):
+        """Record that a helper thread has finished, running when_finished callbacks if it was the last"""
+        with self._lock:
+            self._workers -= 1
+            callbacks = [] if self._workers else self._on_finished
+            if not self._workers:
+                self._on_finished = []
+        for callback in callbacks:
+            callback()
+
+    def when_finished(self, callback: Callable[[], Any]):
+        """
+        Call callback once no helper thread is running under this deadline
+
+        A cancelled query frees its caller immediately while its helper thread
+        winds down; resources that thread still uses (e.g. a scheduler slot)
+        should be released through this instead of by the caller.
+        """
+        with self._lock:
+            if self._workers:
+                self._on_finished.append(callback)
+                return
+        callback()
+
+
+def get_current_deadline() -> Optional[Deadline]:
+    """Get the deadline of the query running in this context"""
+    return _current_deadline.get()
+
+
+def run_with_deadline(fn: Callable[[], Any], deadline: Deadline, poll_interval: float = 0.1) -> Any:
+    """
+    Run fn in a helper thread and stop waiting as soon as the deadline is cancelled
+
+    The calling thread is freed immediately on cancellation. The helper thread
+    sees the same deadline through get_current_deadline(): a streamed LLM
+    response is aborted at its next token, LLM requests time out when the
+    deadline does, and its SQLite statement is interrupted.
+
+    Raises:
+        QueryCancelled: If the deadline expires or is cancelled first
+    """
+    outcome = {}
+    done = threading.Event()
+
+    def target():
+        token = _current_deadline.set(deadline)
+        try:
+            outcome["result"] = fn()
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            _current_deadline.reset(token)
+            done.set()
+            deadline.worker_finished()
+
+    deadline.worker_started()
+    threading.Thread(target=target, name="query-runner", daemon=True).start()
+    while not done.wait(poll_interval):
+        deadline.check()
+
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+def _progress_handler() -> int:
+    """SQLite progress handler: a non-zero return aborts the running statement"""
+    deadline = _current_deadline.get()
+    return 1 if deadline is not None and deadline.cancelled else 0
+
+
+def attach_deadlines_to_engine(engine, progress_steps: int = 10000):
+    """
+    Make SQLite statements run through a SQLAlchemy engine honour query deadlines
+
+    Every connection gets a progress handler that aborts statements whose
+    deadline has passed, and connections are registered with the current
+    deadline while a statement runs so cancel() can interrupt() them.
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.set_progress_handler(_progress_handler, progress_steps)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        deadline = _current_deadline.get()
+        if deadline is not None:
+            deadline.check()
+            deadline.register_connection(conn.connection.dbapi_connection)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        deadline = _current_deadline.get()
+        if deadline is not None:
+            deadline.unregister_connection(conn.connection.dbapi_connection)
+
+    @event.listens_for(engine, "handle_error")
+    def _on_error(exception_context):
+        deadline = _current_deadline.get()
+        connection = exception_context.connection
+        if deadline is not None and connection is not None:
+            deadline.unregister_connection(connection.connection.dbapi_connection)
@@ -0,0 +1,333 @@
+"""
+Offline evaluation runner for the FetiiPro chatbot
+Runs a JSONL set of questions with expected SQL through process_query in
+parallel, compares result sets and reports accuracy, latency, iterations and
+tokens against a stored baseline
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import SimpleChatModel
+
+from example_store import ExampleStore
+from langchain_chatbot import FetiiProLangChainChatbot
+
+
+class ScriptedChatModel(SimpleChatModel):
+    """
+    Stub LLM that answers each question by running its scripted SQL (the
+    question's stub_sql, else its expected SQL).
+    Replaces the network model so the rest of the pipeline (agent loop,
+    tools, validation, caching, formatting) and the scorer can be timed and
+    checked offline; its accuracy says nothing about the real models.
+    """
+
+    scripts: Dict[str, str] = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "fetii-scripted"
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs) -> str:
+        prompt = "\n".join(str(message.content) for message in messages)
+        # The current question follows the last "Question:" (earlier ones are examples)
+        question, _, scratchpad = prompt.rpartition("\nQuestion: ")[2].partition("\n")
+        sql = self.scripts.get(question.strip())
+        if sql is None:
+            return "Thought: I do not have a scripted answer.\nFinal Answer: I don't know."
+        if "Observation:" not in scratchpad:
+            return f"Thought: I should query the database.\nAction: sql_db_query\nAction Input: {sql}"
+        observation = scratchpad.rsplit("Observation:", 1)[1].split("\nThought:", 1)[0].strip()
+        return f"Thought: I now know the final answer\nFinal Answer: {observation}"
+
+
+def load_questions(path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Load evaluation questions
+
+    Each line is a JSON object with "question" and "expected_sql" (and an
+    optional "id"); lines without both fields are skipped. "stub_sql" is what
+    the scripted LLM runs instead of the expected SQL, and "stub_correct":
+    false marks a stub_sql the scorer must reject.
+    """
+    questions = []
+    with open(path, "r", encoding="utf-8") as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if not item.get("question") or not item.get("expected_sql"):
+                print(f"⚠️ Skipping line {number}: needs question and expected_sql")
+                continue
+            item.setdefault("id", f"q{number}")
+            questions.append(item)
+    return questions[:limit] if limit else questions
+
+
+def normalize_rows(rows: List[Any]) -> Counter:
+    """
+    Normalize a result set for comparison
+
+    Row and column order are ignored and numbers are compared to 2 decimal
+    places, so equivalent queries with different aliases, orderings or
+    rounding still match.
+    """
+    normalized = Counter()
+    for row in rows:
+        values = []
+        for value in row:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = round(float(value), 2)
+            values.append(repr(value))
+        normalized[tuple(sorted(values))] += 1
+    return normalized
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of a list of values"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    position = (len(values) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class EvalRunner:
+    """Runs evaluation questions against a chatbot and scores the answers"""
+
+    def __init__(self, chatbot: FetiiProLangChainChatbot, parallel: int = 4, timeout: Optional[float] = None):
+        """
+        Initialize the runner
+
+        Args:
+            chatbot: The chatbot under test
+            parallel: Number of questions run concurrently
+            timeout: Per-question deadline in seconds (default FETII_QUERY_TIMEOUT)
+        """
+        self.chatbot = chatbot
+        self.parallel = parallel
+        self.timeout = timeout
+
+    def execute(self, sql: str) -> List[tuple]:
+        """Run SQL through the chatbot's engine (so partitions are routed too)"""
+        with self.chatbot.engine.connect() as connection:
+            return [tuple(row) for row in connection.exec_driver_sql(sql).fetchall()]
+
+    def run_question(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Ask one question and score the executed SQL against the expected SQL"""
+        from deadlines import Deadline
+
+        deadline = Deadline(self.timeout) if self.timeout else None
+        start_time = time.time()
+        result = self.chatbot.process_query(item["question"], use_cache=False, deadline=deadline)
+        latency = time.time() - start_time
+
+        outcome = {
+            "id": item["id"],
+            "question": item["question"],
+            "success": result.get("success", False),
+            "correct": False,
+            "latency": latency,
+            "iterations": result.get("iterations", 0),
+            "tokens": result.get("token_usage", {}).get("total_tokens", 0),
+            "cost": result.get("token_usage", {}).get("total_cost", 0.0),
+            "model": result.get("model"),
+            "sql": result.get("sql"),
+            "error": result.get("error")
+        }
+        if not outcome["success"] or not outcome["sql"]:
+            return outcome
+
+        try:
+            expected = normalize_rows(self.execute(item["expected_sql"]))
+        except Exception as e:
+            outcome["error"] = f"expected_sql failed: {e}"
+            return outcome
+        try:
+            actual = normalize_rows(self.execute(outcome["sql"]))
+        except Exception as e:
+            outcome["error"] = f"agent SQL failed: {e}"
+            return outcome
+        outcome["correct"] = expected == actual
+        return outcome
+
+    def run(self, questions: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Run all questions and build the report
+
+        Returns:
+            Report with a summary and per-question results
+        """
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            results = list(executor.map(self.run_question, questions))
+        wall_time = time.time() - start_time
+
+        latencies = [result["latency"] for result in results]
+        count = len(results) or 1
+        summary = {
+            "questions": len(results),
+            "correct": sum(1 for result in results if result["correct"]),
+            "accuracy": sum(1 for result in results if result["correct"]) / count,
+            "failed": sum(1 for result in results if not result["success"]),
+            "latency_p50": percentile(latencies, 50),
+            "latency_p90": percentile(latencies, 90),
+            "latency_p99": percentile(latencies, 99),
+            "latency_max": max(latencies) if latencies else 0.0,
+            "avg_iterations": sum(result["iterations"] for result in results) / count,
+            "avg_tokens": sum(result["tokens"] for result in results) / count,
+            "total_cost": sum(result["cost"] for result in results),
+            "wall_time": wall_time,
+            "parallel": self.parallel
+        }
+        return {"summary": summary, "results": results}
+
+
+def diff_reports(report: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compare a report with a baseline report
+
+    Returns:
+        Summary deltas plus questions that regressed (correct before, wrong
+        now) or were fixed
+    """
+    deltas = {
+        key: report["summary"][key] - baseline["summary"].get(key, 0)
+        for key in ("accuracy", "latency_p50", "latency_p90", "latency_p99", "avg_iterations", "avg_tokens")
+    }
+    before = {result["id"]: result for result in baseline.get("results", [])}
+    regressions, fixes = [], []
+    for result in report["results"]:
+        previous = before.get(result["id"])
+        if previous is None:
+            continue
+        if previous["correct"] and not result["correct"]:
+            regressions.append(result["id"])
+        elif not previous["correct"] and result["correct"]:
+            fixes.append(result["id"])
+    return {"deltas": deltas, "regressions": regressions, "fixes": fixes}
+
+
+def check_scorer(report: Dict[str, Any], questions: List[Dict[str, Any]]) -> List[str]:
+    """
+    Compare a scripted run with what the scorer should have decided
+
+    Returns:
+        Ids of questions scored differently from their stub_correct flag
+    """
+    expected = {item["id"]: item.get("stub_correct", True) for item in questions}
+    return [result["id"] for result in report["results"] if result["correct"] != expected[result["id"]]]
+
+
+def print_report(report: Dict[str, Any], diff: Optional[Dict[str, Any]] = None):
+    """Print a report, with baseline deltas if given"""
+    summary = report["summary"]
+    deltas = diff["deltas"] if diff else {}
+
+    def line(label, key, fmt):
+        text = f"{label:<16}{format(summary[key], fmt)}"
+        if key in deltas:
+            text += f"  ({deltas[key]:+{fmt}})"
+        print(text)
+
+    print("\n📊 Evaluation report")
+    print("=" * 50)
+    for result in report["results"]:
+        mark = "✅" if result["correct"] else "❌"
+        detail = f" - {result['error']}" if result["error"] else ""
+        print(f"{mark} {result['id']:<24}{result['latency']:6.2f}s  "
+              f"{result['iterations']} steps  {result['tokens']} tokens{detail}")
+    print("=" * 50)
+    print(f"{'accuracy':<16}{summary['correct']}/{summary['questions']} = {summary['accuracy']:.1%}"
+          + (f"  ({deltas['accuracy']:+.1%})" if "accuracy" in deltas else ""))
+    line("latency p50", "latency_p50", ".2f")
+    line("latency p90", "latency_p90", ".2f")
+    line("latency p99", "latency_p99", ".2f")
+    line("avg iterations", "avg_iterations", ".2f")
+    line("avg tokens", "avg_tokens", ".1f")
+    print(f"{'total cost':<16}${summary['total_cost']:.4f}")
+    print(f"{'wall time':<16}{summary['wall_time']:.2f}s with {summary['parallel']} in parallel")
+    if diff:
+        if diff["regressions"]:
+            print(f"🔻 Regressions: {', '.join(diff['regressions'])}")
+        if diff["fixes"]:
+            print(f"🔺 Fixed: {', '.join(diff['fixes'])}")
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Evaluate the FetiiPro chatbot on a question set")
+    parser.add_argument("--questions", default="eval/questions.jsonl",
+                        help="JSONL with question and expected_sql per line")
+    parser.add_argument("--db", default="data/database/fetiipro.db", help="Database path")
+    parser.add_argument("--parallel", type=int, default=4, help="Questions run concurrently")
+    parser.add_argument("--limit", type=int, help="Only run the first N questions")
+    parser.add_argument("--timeout", type=float, help="Per-question time limit in seconds")
+    parser.add_argument("--stub", action="store_true",
+                        help="Use a scripted LLM that replays each question's stub_sql or expected SQL "
+                             "(no API calls) and check the scorer's verdicts")
+    parser.add_argument("--baseline", default="eval/baseline.json", help="Baseline report to diff against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--output", help="Write the full report as JSON")
+    parser.add_argument("--min-accuracy", type=float, help="Exit non-zero below this accuracy (0-1)")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions, args.limit)
+    if not questions:
+        print(f"❌ No questions with expected_sql found in {args.questions}")
+        sys.exit(1)
+
+    llm_factory = None
+    if args.stub:
+        scripts = {item["question"].strip(): item.get("stub_sql", item["expected_sql"]) for item in questions}
+        llm_factory = lambda model, request_timeout: ScriptedChatModel(scripts=scripts)
+
+    chatbot = FetiiProLangChainChatbot(args.db, llm_factory=llm_factory)
+    # Keep evaluation runs from teaching the persistent example store
+    chatbot.example_store = ExampleStore(path=None)
+
+    print(f"🧪 Running {len(questions)} questions with {args.parallel} in parallel"
+          + (" (scripted LLM)" if args.stub else ""))
+    report = EvalRunner(chatbot, parallel=args.parallel, timeout=args.timeout).run(questions)
+    report["summary"]["stub"] = args.stub
+
+    diff = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            diff = diff_reports(report, json.load(file))
+        report["baseline_diff"] = diff
+    print_report(report, diff)
+    scorer_errors = []
+    if args.stub:
+        # Some scripted answers are wrong on purpose; accuracy here only
+        # shows that the pipeline ran and the scorer judged every answer
+        scorer_errors = check_scorer(report, questions)
+        report["summary"]["scorer_errors"] = scorer_errors
+        if scorer_errors:
+            print(f"❌ Scorer misjudged scripted answers: {', '.join(scorer_errors)}")
+        else:
+            print("✅ Scorer judged all scripted answers as expected (not a measure of model accuracy)")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+        print(f"📝 Report written to {args.output}")
+    if args.save_baseline:
+        Path(args.baseline).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.baseline).write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+        print(f"📌 Baseline saved to {args.baseline}")
+
+    if scorer_errors or (args.min_accuracy is not None and report["summary"]["accuracy"] < args.min_accuracy):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
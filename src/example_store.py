@@ -0,0 +1,227 @@
+"""
+Few-shot example store for the FetiiPro chatbot
+Keeps (question, SQL, answer) triples from successful runs plus curated seeds
+and retrieves the most similar ones with a small local TF-IDF index
+"""
+import json
+import math
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from query_coalescer import normalize_question
+
+# Curated examples that are always available, even on a fresh install; they
+# carry no answer, since their values depend on the loaded data
+SEED_EXAMPLES = [
+    {
+        "question": "How many total trips are there?",
+        "sql": "SELECT COUNT(*) AS total_trips FROM trips"
+    },
+    {
+        "question": "What is the average passenger count?",
+        "sql": "SELECT ROUND(AVG(passenger_count), 2) AS avg_passengers FROM trips"
+    },
+    {
+        "question": "How many trips happened on weekends?",
+        "sql": "SELECT COUNT(*) AS weekend_trips FROM trips WHERE is_weekend = 'True'"
+    },
+    {
+        "question": "What are the busiest hours for trips?",
+        "sql": "SELECT hour, COUNT(*) AS trip_count FROM trips GROUP BY hour ORDER BY trip_count DESC LIMIT 5"
+    },
+    {
+        "question": "How many large group trips are there?",
+        "sql": "SELECT COUNT(*) AS large_group_trips FROM trips WHERE passenger_count >= 6"
+    },
+    {
+        "question": "What are the top drop-off spots for 18-24 year-olds on Saturday nights?",
+        "sql": (
+            "SELECT t.drop_off_address, COUNT(DISTINCT t.trip_id) AS trips "
+            "FROM trips t JOIN riders r ON r.trip_id = t.trip_id "
+            "WHERE r.age BETWEEN 18 AND 24 AND t.day_of_week = 'Saturday' AND t.hour >= 18 "
+            "GROUP BY t.drop_off_address ORDER BY trips DESC LIMIT 10"
+        )
+    },
+    {
+        "question": "How many groups went to Moody Center last month?",
+        "sql": (
+            "SELECT COUNT(*) AS trips FROM trips "
+            "WHERE drop_off_address LIKE '%moody center%' "
+            "AND date >= date('now', 'start of month', '-1 month') "
+            "AND date < date('now', 'start of month')"
+        )
+    }
+]
+
+_STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "of", "for", "to", "in", "on",
+    "at", "by", "and", "or", "what", "which", "who", "how", "many", "much", "do",
+    "does", "did", "there", "me", "show", "give", "list", "with", "from"
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into normalized terms for the similarity index"""
+    terms = []
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if word in _STOPWORDS:
+            continue
+        # Crude plural stemming is enough to match "trip"/"trips"
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+class ExampleStore:
+    """
+    Store of few-shot examples with an incremental TF-IDF similarity index.
+    Successful examples are appended to a JSONL file so the store survives
+    restarts; curated seeds are loaded first.
+    """
+
+    def __init__(self, path: Optional[str] = "data/database/examples.jsonl",
+                 seeds: Optional[List[Dict[str, Any]]] = None):
+        """
+        Initialize the example store
+
+        Args:
+            path: JSONL file for learned examples (None keeps them in memory only)
+            seeds: Curated examples (defaults to SEED_EXAMPLES)
+        """
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self.examples: List[Dict[str, Any]] = []
+        self._keys: Dict[str, int] = {}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._doc_terms: List[Counter] = []
+
+        for seed in (SEED_EXAMPLES if seeds is None else seeds):
+            self._index(dict(seed, source="seed", uses=0))
+
+        if self.path and self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as file:
+                for line in file:
+                    line = line.strip()
+                    if line:
+                        self._index(json.loads(line))
+
+    def _index(self, example: Dict[str, Any]) -> int:
+        """Add or replace an example in the index, returning its id"""
+        key = normalize_question(example["question"])
+        doc_id = self._keys.get(key)
+        if doc_id is not None:
+            # Newer runs of the same question replace the older example
+            example["uses"] = self.examples[doc_id].get("uses", 0) + example.get("uses", 0)
+            self._unindex(doc_id)
+            self.examples[doc_id] = example
+        else:
+            doc_id = len(self.examples)
+            self.examples.append(example)
+            self._doc_terms.append(Counter())
+            self._keys[key] = doc_id
+
+        counts = Counter(tokenize(example["question"]))
+        for term, count in counts.items():
+            self._postings.setdefault(term, {})[doc_id] = count
+        self._doc_terms[doc_id] = counts
+        return doc_id
+
+    def _unindex(self, doc_id: int):
+        """Remove an example's terms from the postings"""
+        for term in self._doc_terms[doc_id]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def add(self, question: str, sql: str, answer: str):
+        """
+        Record a successful (question, SQL, answer) triple
+
+        Args:
+            question: The user's question
+            sql: The SQL that produced the answer
+            answer: The final answer text
+        """
+        example = {"question": question, "sql": sql, "answer": answer, "source": "history", "uses": 1}
+        with self._lock:
+            if self.path:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(example) + "\n")
+            self._index(example)
+
+    def search(self, question: str, k: int = 3, min_score: float = 0.2) -> List[Dict[str, Any]]:
+        """
+        Find the examples most similar to a question
+
+        Args:
+            question: The new question
+            k: Maximum number of examples to return
+            min_score: Minimum cosine similarity
+
+        Returns:
+            List of examples with a "score" key, best first
+        """
+        with self._lock:
+            total = len(self.examples)
+            if not total:
+                return []
+
+            def idf(term: str) -> float:
+                return math.log(1 + total / len(self._postings[term]))
+
+            query_counts = Counter(tokenize(question))
+            scores: Dict[int, float] = {}
+            query_norm = 0.0
+            for term, count in query_counts.items():
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                term_idf = idf(term)
+                query_weight = count * term_idf
+                query_norm += query_weight * query_weight
+                # Only documents sharing a term with the question are scored
+                for doc_id, doc_count in postings.items():
+                    scores[doc_id] = scores.get(doc_id, 0.0) + query_weight * doc_count * term_idf
+
+            if not scores:
+                return []
+
+            query_norm = math.sqrt(query_norm)
+            ranked = []
+            for doc_id, score in scores.items():
+                doc_norm = math.sqrt(sum(
+                    (count * idf(term)) ** 2 for term, count in self._doc_terms[doc_id].items()
+                ))
+                similarity = score / (query_norm * doc_norm)
+                if similarity >= min_score:
+                    ranked.append((similarity, doc_id))
+            ranked.sort(reverse=True)
+
+            return [dict(self.examples[doc_id], score=round(similarity, 3)) for similarity, doc_id in ranked[:k]]
+
+    def get_top_questions(self, n: int = 10) -> List[str]:
+        """Get the most frequently answered questions from history"""
+        with self._lock:
+            history = [example for example in self.examples if example.get("source") == "history"]
+            history.sort(key=lambda example: example.get("uses", 0), reverse=True)
+            return [example["question"] for example in history[:n]]
+
+    @staticmethod
+    def format_examples(examples: List[Dict[str, Any]]) -> str:
+        """Format examples as a prompt block"""
+        if not examples:
+            return "No similar examples available."
+        blocks = []
+        for example in examples:
+            block = f"Question: {example['question']}\nSQL: {example['sql']}"
+            if example.get("answer"):
+                block += f"\nAnswer: {example['answer']}"
+            blocks.append(block)
+        return "\n\n".join(blocks)
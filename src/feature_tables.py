@@ -0,0 +1,257 @@
+"""
+Precomputed feature tables for the FetiiPro database
+Built once at setup time so the agent can answer rider-relationship
+questions with compact indexed lookups instead of self-joins
+"""
+import math
+import sqlite3
+from typing import Optional
+
+
+def build_rider_pairs(cursor: sqlite3.Cursor):
+    """Build the co-rider edge table: one row per pair of users who rode together"""
+    cursor.execute("DROP TABLE IF EXISTS rider_pairs")
+    cursor.execute('''
+        CREATE TABLE rider_pairs AS
+        WITH trip_riders AS (
+            SELECT DISTINCT trip_id, user_id FROM riders WHERE user_id IS NOT NULL
+        )
+        SELECT
+            a.user_id AS user_a,
+            b.user_id AS user_b,
+            COUNT(*) AS co_rides,
+            MIN(t.date) AS first_co_ride_date,
+            MAX(t.date) AS last_co_ride_date
+        FROM trip_riders a
+        JOIN trip_riders b ON a.trip_id = b.trip_id AND a.user_id < b.user_id
+        LEFT JOIN trips t ON t.trip_id = a.trip_id
+        GROUP BY a.user_id, b.user_id
+    ''')
+    cursor.execute("CREATE INDEX idx_rider_pairs_user_a ON rider_pairs(user_a, co_rides)")
+    cursor.execute("CREATE INDEX idx_rider_pairs_user_b ON rider_pairs(user_b, co_rides)")
+    cursor.execute("CREATE INDEX idx_rider_pairs_co_rides ON rider_pairs(co_rides)")
+
+
+def build_rider_features(cursor: sqlite3.Cursor):
+    """Build one row of summary features per rider"""
+    # Per-rider trip list, materialized and indexed so each aggregate below
+    # is a single pass instead of a correlated scan
+    cursor.execute("DROP TABLE IF EXISTS temp.rider_trips")
+    cursor.execute('''
+        CREATE TEMP TABLE rider_trips AS
+        SELECT r.user_id, t.trip_id, t.date, t.hour, t.group_size
+        FROM (SELECT DISTINCT trip_id, user_id FROM riders WHERE user_id IS NOT NULL) r
+        JOIN trips t ON t.trip_id = r.trip_id
+    ''')
+    cursor.execute("CREATE INDEX temp.idx_rider_trips_user_id ON rider_trips(user_id, hour)")
+
+    cursor.execute("DROP TABLE IF EXISTS temp.rider_typical_hour")
+    cursor.execute('''
+        CREATE TEMP TABLE rider_typical_hour AS
+        SELECT user_id, hour FROM (
+            SELECT user_id, hour,
+                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY COUNT(*) DESC, hour) AS hour_rank
+            FROM rider_trips
+            GROUP BY user_id, hour
+        ) WHERE hour_rank = 1
+    ''')
+    cursor.execute("CREATE UNIQUE INDEX temp.idx_rider_typical_hour ON rider_typical_hour(user_id)")
+
+    cursor.execute("DROP TABLE IF EXISTS temp.rider_partners")
+    cursor.execute('''
+        CREATE TEMP TABLE rider_partners AS
+        SELECT user_id, COUNT(*) AS distinct_co_riders FROM (
+            SELECT user_a AS user_id FROM rider_pairs
+            UNION ALL
+            SELECT user_b AS user_id FROM rider_pairs
+        ) GROUP BY user_id
+    ''')
+    cursor.execute("CREATE UNIQUE INDEX temp.idx_rider_partners ON rider_partners(user_id)")
+
+    cursor.execute("DROP TABLE IF EXISTS rider_features")
+    cursor.execute('''
+        CREATE TABLE rider_features AS
+        SELECT
+            rt.user_id,
+            rt.trips_taken,
+            (SELECT COUNT(*) FROM trips b WHERE b.booking_user_id = rt.user_id) AS trips_booked,
+            h.hour AS typical_hour,
+            rt.avg_group_size,
+            rt.max_group_size,
+            rt.first_trip_date,
+            rt.last_trip_date,
+            COALESCE(p.distinct_co_riders, 0) AS distinct_co_riders,
+            (SELECT d.age FROM demographics d WHERE d.user_id = rt.user_id) AS age
+        FROM (
+            SELECT user_id,
+                   COUNT(*) AS trips_taken,
+                   ROUND(AVG(group_size), 2) AS avg_group_size,
+                   MAX(group_size) AS max_group_size,
+                   MIN(date) AS first_trip_date,
+                   MAX(date) AS last_trip_date
+            FROM rider_trips
+            GROUP BY user_id
+        ) rt
+        LEFT JOIN rider_typical_hour h ON h.user_id = rt.user_id
+        LEFT JOIN rider_partners p ON p.user_id = rt.user_id
+    ''')
+    cursor.execute("CREATE UNIQUE INDEX idx_rider_features_user_id ON rider_features(user_id)")
+    cursor.execute("CREATE INDEX idx_rider_features_trips_taken ON rider_features(trips_taken)")
+    cursor.execute("CREATE INDEX idx_rider_features_age ON rider_features(age)")
+
+    for table in ("rider_trips", "rider_typical_hour", "rider_partners"):
+        cursor.execute(f"DROP TABLE temp.{table}")
+
+
+def build_rider_clusters(cursor: sqlite3.Cursor, min_co_rides: int = 2):
+    """
+    Build connected groups of riders who repeatedly ride together
+
+    Args:
+        cursor: Database cursor
+        min_co_rides: Minimum shared trips for a pair to link two riders;
+            single shared rides would merge almost everyone into one group
+    """
+    parent = {}
+
+    def find(user):
+        root = user
+        while parent[root] != root:
+            root = parent[root]
+        # Path compression keeps later lookups short
+        while parent[user] != root:
+            parent[user], user = root, parent[user]
+        return root
+
+    for user_a, user_b in cursor.execute(
+        "SELECT user_a, user_b FROM rider_pairs WHERE co_rides >= ?", (min_co_rides,)
+    ).fetchall():
+        parent.setdefault(user_a, user_a)
+        parent.setdefault(user_b, user_b)
+        root_a, root_b = find(user_a), find(user_b)
+        if root_a != root_b:
+            # The smallest user id becomes the cluster id
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    members = {}
+    for user in parent:
+        members.setdefault(find(user), []).append(user)
+
+    cursor.execute("DROP TABLE IF EXISTS rider_clusters")
+    cursor.execute('''
+        CREATE TABLE rider_clusters (
+            user_id INTEGER,
+            cluster_id INTEGER,
+            cluster_size INTEGER
+        )
+    ''')
+    cursor.executemany(
+        "INSERT INTO rider_clusters (user_id, cluster_id, cluster_size) VALUES (?, ?, ?)",
+        (
+            (user, cluster_id, len(users))
+            for cluster_id, users in members.items()
+            for user in users
+        )
+    )
+    cursor.execute("CREATE UNIQUE INDEX idx_rider_clusters_user_id ON rider_clusters(user_id)")
+    cursor.execute("CREATE INDEX idx_rider_clusters_cluster_id ON rider_clusters(cluster_id)")
+
+
+def distance_m(lat_a: Optional[float], lon_a: Optional[float],
+               lat_b: Optional[float], lon_b: Optional[float]) -> Optional[float]:
+    """Great-circle distance in metres between two points (null if any is missing)"""
+    if None in (lat_a, lon_a, lat_b, lon_b):
+        return None
+    lat_a, lon_a, lat_b, lon_b = map(math.radians, (lat_a, lon_a, lat_b, lon_b))
+    h = (math.sin((lat_b - lat_a) / 2) ** 2
+         + math.cos(lat_a) * math.cos(lat_b) * math.sin((lon_b - lon_a) / 2) ** 2)
+    return 2 * 6371000 * math.asin(math.sqrt(min(1.0, h)))
+
+
+def build_trip_chains(cursor: sqlite3.Cursor, match_radius_m: float = 250):
+    """
+    Build the trip-chain table: each booked trip linked to the same booker's
+    previous and next trip
+
+    Args:
+        cursor: Database cursor
+        match_radius_m: A drop-off counts as the next pick-up (or the next
+            drop-off as a return to this pick-up) within this distance; pick-up
+            and drop-off addresses are written differently, so coordinates
+            decide most matches
+    """
+    # SQLite's own math functions are optional at compile time
+    cursor.connection.create_function("distance_m", 4, distance_m, deterministic=True)
+    cursor.execute("DROP TABLE IF EXISTS trip_chains")
+    cursor.execute('''
+        CREATE TABLE trip_chains AS
+        WITH ordered AS (
+            SELECT
+                trip_id, booking_user_id, trip_datetime, date, hour,
+                pick_up_address, drop_off_address,
+                pick_up_latitude, pick_up_longitude, drop_off_latitude, drop_off_longitude,
+                ROW_NUMBER() OVER w AS chain_position,
+                LAG(trip_id) OVER w AS prev_trip_id,
+                LAG(trip_datetime) OVER w AS prev_trip_datetime,
+                LAG(drop_off_address) OVER w AS prev_drop_off_address,
+                LEAD(trip_id) OVER w AS next_trip_id,
+                LEAD(trip_datetime) OVER w AS next_trip_datetime,
+                LEAD(pick_up_address) OVER w AS next_pick_up_address,
+                LEAD(drop_off_address) OVER w AS next_drop_off_address,
+                LEAD(pick_up_latitude) OVER w AS next_pick_up_latitude,
+                LEAD(pick_up_longitude) OVER w AS next_pick_up_longitude,
+                LEAD(drop_off_latitude) OVER w AS next_drop_off_latitude,
+                LEAD(drop_off_longitude) OVER w AS next_drop_off_longitude
+            FROM trips
+            WHERE booking_user_id IS NOT NULL AND trip_datetime IS NOT NULL
+            WINDOW w AS (PARTITION BY booking_user_id ORDER BY trip_datetime, trip_id)
+        )
+        SELECT
+            trip_id, booking_user_id, trip_datetime, date, hour,
+            pick_up_address, drop_off_address,
+            chain_position,
+            prev_trip_id,
+            prev_drop_off_address,
+            ROUND((julianday(trip_datetime) - julianday(prev_trip_datetime)) * 1440, 1) AS minutes_since_prev,
+            next_trip_id,
+            next_trip_datetime,
+            next_pick_up_address,
+            next_drop_off_address,
+            ROUND((julianday(next_trip_datetime) - julianday(trip_datetime)) * 1440, 1) AS minutes_to_next,
+            ROUND(distance_m(drop_off_latitude, drop_off_longitude,
+                             next_pick_up_latitude, next_pick_up_longitude)) AS next_pick_up_distance_m,
+            CASE
+                WHEN next_trip_id IS NULL THEN NULL
+                WHEN drop_off_address = next_pick_up_address
+                     OR distance_m(drop_off_latitude, drop_off_longitude,
+                                   next_pick_up_latitude, next_pick_up_longitude) <= :radius THEN 1
+                ELSE 0
+            END AS drop_off_matches_next_pick_up,
+            CASE
+                WHEN next_trip_id IS NULL THEN NULL
+                WHEN pick_up_address = next_drop_off_address
+                     OR distance_m(pick_up_latitude, pick_up_longitude,
+                                   next_drop_off_latitude, next_drop_off_longitude) <= :radius THEN 1
+                ELSE 0
+            END AS next_is_return
+        FROM ordered
+    ''', {"radius": match_radius_m})
+    cursor.execute("CREATE UNIQUE INDEX idx_trip_chains_trip_id ON trip_chains(trip_id)")
+    cursor.execute("CREATE UNIQUE INDEX idx_trip_chains_user ON trip_chains(booking_user_id, chain_position)")
+    cursor.execute("CREATE INDEX idx_trip_chains_next_trip_id ON trip_chains(next_trip_id)")
+    cursor.execute("CREATE INDEX idx_trip_chains_return ON trip_chains(next_is_return, minutes_to_next)")
+    cursor.execute("CREATE INDEX idx_trip_chains_drop_off ON trip_chains(drop_off_address)")
+
+
+def build_feature_tables(conn: sqlite3.Connection):
+    """Build all precomputed feature tables"""
+    cursor = conn.cursor()
+    print("Building co-rider graph...")
+    build_rider_pairs(cursor)
+    print("Building rider features...")
+    build_rider_features(cursor)
+    print("Building rider clusters...")
+    build_rider_clusters(cursor)
+    print("Building trip chains...")
+    build_trip_chains(cursor)
+    print("Feature tables built successfully")
@@ -0,0 +1,409 @@
+"""
+Pickup and dropoff density tiles for the FetiiPro web app
+Aggregates trip coordinates into slippy-map z/x/y tiles of grid x grid
+counts, a whole zoom level per pass, and caches the tiles in a SQLite file
+until the database changes
+"""
+import json
+import math
+import os
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from answer_cache import get_db_version
+from partitions import PartitionRouter
+from sql_validator import connect_readonly
+
+# numpy is optional; tiles are computed in pure Python without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS levels (
+    kind TEXT NOT NULL,
+    filters TEXT NOT NULL,
+    z INTEGER NOT NULL,
+    version TEXT NOT NULL,
+    tiles INTEGER NOT NULL,
+    computed_at REAL NOT NULL,
+    PRIMARY KEY (kind, filters, z)
+);
+CREATE TABLE IF NOT EXISTS tiles (
+    kind TEXT NOT NULL,
+    filters TEXT NOT NULL,
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (kind, filters, z, x, y)
+);
+"""
+
+# Coordinate columns per tile kind
+TILE_KINDS = {
+    "pickup": ("pick_up_latitude", "pick_up_longitude"),
+    "dropoff": ("drop_off_latitude", "drop_off_longitude")
+}
+
+TILE_FORMATS = {
+    "bin": "application/octet-stream",
+    "json": "application/json"
+}
+
+DAYS_OF_WEEK = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+# Web Mercator is undefined at the poles
+MAX_LATITUDE = 85.05112878
+MAX_ZOOM = 20
+
+# Binary tile: magic, grid size, non-empty cell count and total count, then
+# the cell indexes (row * grid + column, uint16) and their counts (uint32),
+# all little-endian
+TILE_MAGIC = b"FTIL"
+TILE_HEADER = struct.Struct("<4sHII")
+
+
+def parse_filters(params: Dict[str, List[str]]) -> Dict[str, Any]:
+    """
+    Parse tile filters from query parameters
+
+    Args:
+        params: Parsed query string (hour, day_of_week, is_weekend)
+
+    Returns:
+        Filters with values as stored in trips
+
+    Raises:
+        ValueError: If a filter value is invalid
+    """
+    filters = {}
+    if params.get("hour", [""])[0] != "":
+        hour = int(params["hour"][0])
+        if not 0 <= hour <= 23:
+            raise ValueError("hour must be between 0 and 23")
+        filters["hour"] = hour
+    if params.get("day_of_week", [""])[0] != "":
+        day = params["day_of_week"][0].strip().capitalize()
+        if day not in DAYS_OF_WEEK:
+            raise ValueError(f"day_of_week must be one of {', '.join(DAYS_OF_WEEK)}")
+        filters["day_of_week"] = day
+    if params.get("is_weekend", [""])[0] != "":
+        value = params["is_weekend"][0].strip().lower()
+        if value not in ("1", "0", "true", "false"):
+            raise ValueError("is_weekend must be true or false")
+        # Stored as text by the loaders
+        filters["is_weekend"] = "True" if value in ("1", "true") else "False"
+    return filters
+
+
+def filter_key(filters: Dict[str, Any]) -> str:
+    """Canonical cache key of a set of filters"""
+    return "&".join(f"{name}={filters[name]}" for name in sorted(filters))
+
+
+def encode_tile(grid: int, cells: Iterable[int], counts: Iterable[int]) -> bytes:
+    """Encode the non-empty cells of a tile (cells in ascending order)"""
+    if np is not None:
+        cells = np.asarray(cells, dtype="<u2")
+        counts = np.asarray(counts, dtype="<u4")
+        return TILE_HEADER.pack(TILE_MAGIC, grid, len(cells), int(counts.sum())) + cells.tobytes() + counts.tobytes()
+    cells, counts = list(cells), list(counts)
+    return (TILE_HEADER.pack(TILE_MAGIC, grid, len(cells), sum(counts))
+            + struct.pack(f"<{len(cells)}H", *cells) + struct.pack(f"<{len(counts)}I", *counts))
+
+
+def decode_tile(data: bytes) -> Dict[str, Any]:
+    """Decode a binary tile into grid, total and (column, row, count) cells"""
+    magic, grid, size, total = TILE_HEADER.unpack_from(data)
+    if magic != TILE_MAGIC:
+        raise ValueError("Not a density tile")
+    cells = struct.unpack_from(f"<{size}H", data, TILE_HEADER.size)
+    counts = struct.unpack_from(f"<{size}I", data, TILE_HEADER.size + 2 * size)
+    return {
+        "grid": grid,
+        "total": total,
+        "max": max(counts, default=0),
+        "cells": [[cell % grid, cell // grid, count] for cell, count in zip(cells, counts)]
+    }
+
+
+def compute_level(points: Any, z: int, grid: int) -> Dict[Tuple[int, int], bytes]:
+    """
+    Aggregate points into every non-empty tile of a zoom level
+
+    Args:
+        points: (latitudes, longitudes) arrays, or a list of (lat, lon) pairs
+            when numpy is not installed
+        z: Zoom level
+        grid: Cells per tile side (at most 256)
+
+    Returns:
+        Encoded tiles by (x, y)
+    """
+    tiles_per_side = 1 << z
+    cells_per_side = tiles_per_side * grid
+    cells_per_tile = grid * grid
+    if np is not None:
+        latitudes, longitudes = points
+        if not len(latitudes):
+            return {}
+        lat = np.radians(np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE))
+        column = np.floor((longitudes + 180.0) / 360.0 * cells_per_side).astype(np.int64)
+        row = np.floor((1.0 - np.arcsinh(np.tan(lat)) / math.pi) / 2.0 * cells_per_side).astype(np.int64)
+        np.clip(column, 0, cells_per_side - 1, out=column)
+        np.clip(row, 0, cells_per_side - 1, out=row)
+        # One sortable key per (tile, cell), so a single unique() groups
+        # points into cells and cells into tiles
+        tile = (column // grid) * tiles_per_side + row // grid
+        keys = tile * cells_per_tile + (row % grid) * grid + column % grid
+        keys, counts = np.unique(keys, return_counts=True)
+        tile_ids = keys // cells_per_tile
+        cells = keys % cells_per_tile
+        starts = np.flatnonzero(np.diff(tile_ids, prepend=-1))
+        ends = np.append(starts[1:], len(keys))
+        return {
+            (int(tile_ids[start]) // tiles_per_side, int(tile_ids[start]) % tiles_per_side):
+                encode_tile(grid, cells[start:end], counts[start:end])
+            for start, end in zip(starts, ends)
+        }
+
+    counted: Dict[Tuple[int, int], Dict[int, int]] = {}
+    for latitude, longitude in points:
+        lat = math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude)))
+        column = min(max(int(math.floor((longitude + 180.0) / 360.0 * cells_per_side)), 0), cells_per_side - 1)
+        row = min(max(int(math.floor((1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * cells_per_side)), 0),
+                  cells_per_side - 1)
+        cells = counted.setdefault((column // grid, row // grid), {})
+        cell = (row % grid) * grid + column % grid
+        cells[cell] = cells.get(cell, 0) + 1
+    return {
+        tile: encode_tile(grid, sorted(cells), [cells[cell] for cell in sorted(cells)])
+        for tile, cells in counted.items()
+    }
+
+
+class GeoTileStore:
+    """
+    Density tiles of one database, cached in a scratch SQLite file.
+    A missing tile computes its whole zoom level in one pass over the
+    (filtered) coordinates, so panning afterwards only reads the cache.
+    Cached levels carry the database version and are recomputed after a
+    rebuild; the file is shared by all worker processes.
+    """
+
+    def __init__(self, db_path: str, path: str = "data/database/tiles.db", grid: int = 64,
+                 max_levels: int = 500, point_sets: int = 8):
+        """
+        Initialize the store and create its tables
+
+        Args:
+            db_path: Path to the database (partitioned databases are read
+                partition by partition)
+            path: Path to the tile cache file
+            grid: Cells per tile side (at most 256)
+            max_levels: Cached (kind, filters, zoom) levels kept at most
+            point_sets: Filtered coordinate sets kept in memory for
+                computing further zoom levels
+        """
+        if not 1 <= grid <= 256:
+            raise ValueError("grid must be between 1 and 256")
+        self.db_path = db_path
+        self.path = path
+        self.grid = grid
+        self.max_levels = max_levels
+        self.point_sets = point_sets
+        self.version = None
+        self.stats = {"hits": 0, "misses": 0, "levels_computed": 0, "tiles_written": 0, "compute_seconds": 0.0}
+        self._points: "OrderedDict[Tuple[str, str, str], Any]" = OrderedDict()
+        self._stats_lock = threading.Lock()
+        self._compute_lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Get this thread's connection, reopening it after a fork"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name: str, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def get_tile(self, kind: str, z: int, x: int, y: int, filters: Optional[Dict[str, Any]] = None) -> bytes:
+        """
+        Get an encoded tile, computing its zoom level on a cache miss
+
+        Args:
+            kind: "pickup" or "dropoff"
+            z, x, y: Slippy-map tile coordinates
+            filters: From parse_filters
+
+        Returns:
+            The binary tile (see decode_tile); empty tiles have no cells
+
+        Raises:
+            ValueError: If the kind or tile coordinates are invalid
+            FileNotFoundError: If the database does not exist
+        """
+        if kind not in TILE_KINDS:
+            raise ValueError(f"kind must be one of {', '.join(TILE_KINDS)}")
+        if not 0 <= z <= MAX_ZOOM or not 0 <= x < (1 << z) or not 0 <= y < (1 << z):
+            raise ValueError(f"Invalid tile {z}/{x}/{y}")
+        version = self._check_version()
+        key = filter_key(filters or {})
+
+        data = self._cached_tile(kind, key, z, x, y, version)
+        if data is not None:
+            self._count("hits")
+            return data
+        self._count("misses")
+        with self._compute_lock:
+            # Another request may have computed the level while we waited
+            data = self._cached_tile(kind, key, z, x, y, version)
+            if data is None:
+                tiles = self._compute(kind, key, filters or {}, z, version)
+                data = tiles.get((x, y))
+        return data if data is not None else encode_tile(self.grid, [], [])
+
+    def _check_version(self) -> str:
+        """Drop everything cached for an older version of the database"""
+        version = get_db_version(self.db_path)
+        if version is None:
+            raise FileNotFoundError(f"Database not found: {self.db_path}")
+        if version != self.version:
+            with self._compute_lock:
+                if version != self.version:
+                    conn = self._conn()
+                    conn.execute("BEGIN")
+                    conn.execute(
+                        "DELETE FROM tiles WHERE (kind, filters, z) NOT IN "
+                        "(SELECT kind, filters, z FROM levels WHERE version = ?)", (version,)
+                    )
+                    conn.execute("DELETE FROM levels WHERE version != ?", (version,))
+                    conn.execute("COMMIT")
+                    self._points.clear()
+                    self.version = version
+        return version
+
+    def _cached_tile(self, kind: str, key: str, z: int, x: int, y: int, version: str) -> Optional[bytes]:
+        """The cached tile; an empty tile if its level is cached without it; None if not cached"""
+        conn = self._conn()
+        level = conn.execute(
+            "SELECT version FROM levels WHERE kind = ? AND filters = ? AND z = ?", (kind, key, z)
+        ).fetchone()
+        if level is None or level[0] != version:
+            return None
+        row = conn.execute(
+            "SELECT data FROM tiles WHERE kind = ? AND filters = ? AND z = ? AND x = ? AND y = ?",
+            (kind, key, z, x, y)
+        ).fetchone()
+        return row[0] if row else encode_tile(self.grid, [], [])
+
+    def _compute(self, kind: str, key: str, filters: Dict[str, Any], z: int,
+                 version: str) -> Dict[Tuple[int, int], bytes]:
+        """Compute and cache every tile of a zoom level"""
+        start_time = time.time()
+        tiles = compute_level(self._load_points(kind, key, filters, version), z, self.grid)
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DELETE FROM tiles WHERE kind = ? AND filters = ? AND z = ?", (kind, key, z))
+            conn.executemany(
+                "INSERT INTO tiles (kind, filters, z, x, y, data) VALUES (?, ?, ?, ?, ?, ?)",
+                ((kind, key, z, x, y, data) for (x, y), data in tiles.items())
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO levels (kind, filters, z, version, tiles, computed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, key, z, version, len(tiles), time.time())
+            )
+            # Drop the oldest levels beyond the limit
+            conn.execute(
+                "DELETE FROM tiles WHERE (kind, filters, z) IN (SELECT kind, filters, z FROM levels "
+                "ORDER BY computed_at DESC LIMIT -1 OFFSET ?)", (self.max_levels,)
+            )
+            conn.execute(
+                "DELETE FROM levels WHERE (kind, filters, z) IN (SELECT kind, filters, z FROM levels "
+                "ORDER BY computed_at DESC LIMIT -1 OFFSET ?)", (self.max_levels,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("levels_computed")
+        self._count("tiles_written", len(tiles))
+        self._count("compute_seconds", time.time() - start_time)
+        return tiles
+
+    def _load_points(self, kind: str, key: str, filters: Dict[str, Any], version: str) -> Any:
+        """Filtered coordinates of one kind, kept in memory for further zoom levels"""
+        cache_key = (version, kind, key)
+        points = self._points.get(cache_key)
+        if points is not None:
+            self._points.move_to_end(cache_key)
+            return points
+
+        latitude, longitude = TILE_KINDS[kind]
+        conditions = [f"{latitude} IS NOT NULL", f"{longitude} IS NOT NULL"]
+        conditions += [f"{name} = ?" for name in sorted(filters)]
+        sql = f"SELECT {latitude}, {longitude} FROM trips WHERE " + " AND ".join(conditions)
+        params = [filters[name] for name in sorted(filters)]
+
+        rows = []
+        for path in self._trip_files():
+            conn = connect_readonly(path)
+            try:
+                rows.extend(conn.execute(sql, params).fetchall())
+            finally:
+                conn.close()
+        if np is not None:
+            coordinates = np.array(rows, dtype=np.float64).reshape(-1, 2)
+            points = (coordinates[:, 0], coordinates[:, 1])
+        else:
+            points = rows
+
+        self._points[cache_key] = points
+        while len(self._points) > self.point_sets:
+            self._points.popitem(last=False)
+        return points
+
+    def _trip_files(self) -> List[str]:
+        """Database files holding trips: the partitions, or the database itself"""
+        if PartitionRouter.is_partitioned(self.db_path):
+            return [partition["file"] for partition in PartitionRouter(self.db_path).get_partitions("")]
+        return [self.db_path]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get tile cache statistics"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        conn = self._conn()
+        stats["cached_levels"] = conn.execute("SELECT COUNT(*) FROM levels").fetchone()[0]
+        stats["cached_tiles"] = conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+        stats["numpy"] = np is not None
+        return dict(stats, version=self.version, grid=self.grid)
+
+
+def tile_to_json(data: bytes, kind: str, z: int, x: int, y: int, filters: Dict[str, Any]) -> bytes:
+    """Render a binary tile as JSON"""
+    return json.dumps(dict(decode_tile(data), kind=kind, z=z, x=x, y=y, filters=filters)).encode("utf-8")
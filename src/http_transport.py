@@ -0,0 +1,183 @@
+"""
+HTTP transport helpers for the FetiiPro web app
+Pre-compressed static assets with ETags, compressed JSON responses,
+ETag-validated computed responses and chunked streaming responses
+"""
+import gzip
+import hashlib
+import json
+from typing import Any, Dict, Iterable, Optional
+
+# Brotli is optional; gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# JSON bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """Parse an Accept-Encoding header into {encoding: quality}"""
+    encodings = {}
+    for part in (header or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[name.strip().lower()] = quality
+    return encodings
+
+
+def choose_encoding(header: Optional[str], available) -> Optional[str]:
+    """Pick the best content encoding the client accepts, preferring br over gzip"""
+    accepted = parse_accept_encoding(header)
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """Compress a body with the given encoding"""
+    if encoding == "br":
+        return brotli.compress(body)
+    return gzip.compress(body, compresslevel=6)
+
+
+class StaticAsset:
+    """A static response rendered and compressed once at startup"""
+
+    def __init__(self, body: bytes, content_type: str, cache_control: str = "no-cache"):
+        """
+        Initialize the asset
+
+        Args:
+            body: The uncompressed response body
+            content_type: Content-Type header value
+            cache_control: Cache-Control header value; "no-cache" lets browsers
+                keep the asset but revalidate it with the ETag
+        """
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        self.bodies = {None: body, "gzip": compress(body, "gzip")}
+        if brotli is not None:
+            self.bodies["br"] = compress(body, "br")
+
+
+def send_static(handler, asset: StaticAsset, headers: Optional[Dict[str, str]] = None):
+    """Send a static asset, answering 304 if the client's copy is current"""
+    if_none_match = handler.headers.get("If-None-Match", "")
+    if asset.etag in [tag.strip() for tag in if_none_match.split(",")]:
+        handler.send_response(304)
+        handler.send_header("ETag", asset.etag)
+        handler.send_header("Cache-Control", asset.cache_control)
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        return
+
+    encoding = choose_encoding(handler.headers.get("Accept-Encoding"), asset.bodies)
+    body = asset.bodies[encoding]
+    handler.send_response(200)
+    handler.send_header("Content-Type", asset.content_type)
+    handler.send_header("Content-Length", str(len(body)))
+    handler.send_header("ETag", asset.etag)
+    handler.send_header("Cache-Control", asset.cache_control)
+    handler.send_header("Vary", "Accept-Encoding")
+    if encoding:
+        handler.send_header("Content-Encoding", encoding)
+    for name, value in (headers or {}).items():
+        handler.send_header(name, value)
+    handler.end_headers()
+    if handler.command != "HEAD":
+        handler.wfile.write(body)
+
+
+def send_json(handler, data: Any, status: int = 200, headers: Optional[Dict[str, str]] = None):
+    """Send a JSON response with Content-Length, compressing larger bodies"""
+    body = json.dumps(data).encode("utf-8")
+    encoding = None
+    if len(body) >= MIN_COMPRESS_SIZE:
+        available = ("br", "gzip") if brotli is not None else ("gzip",)
+        encoding = choose_encoding(handler.headers.get("Accept-Encoding"), available)
+        if encoding:
+            body = compress(body, encoding)
+
+    handler.send_response(status)
+    handler.send_header("Content-Type", "application/json")
+    handler.send_header("Content-Length", str(len(body)))
+    handler.send_header("Cache-Control", "no-store")
+    handler.send_header("Vary", "Accept-Encoding")
+    if encoding:
+        handler.send_header("Content-Encoding", encoding)
+    for name, value in (headers or {}).items():
+        handler.send_header(name, value)
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def send_chunked(handler, chunks: Iterable[bytes], content_type: str,
+                 headers: Optional[Dict[str, str]] = None):
+    """
+    Stream a response with chunked transfer encoding
+
+    Used when the body is produced incrementally and its length is not known
+    up front; chunks are written as they are produced, so memory stays flat.
+    """
+    handler.send_response(200)
+    handler.send_header("Content-Type", content_type)
+    handler.send_header("Transfer-Encoding", "chunked")
+    handler.send_header("Cache-Control", "no-store")
+    for name, value in (headers or {}).items():
+        handler.send_header(name, value)
+    handler.end_headers()
+    for chunk in chunks:
+        if chunk:
+            handler.wfile.write(f"{len(chunk):X}\r\n".encode("ascii") + chunk + b"\r\n")
+    handler.wfile.write(b"0\r\n\r\n")
+
+
+def send_cacheable(handler, body: bytes, content_type: str, cache_control: str = "no-cache",
+                   headers: Optional[Dict[str, str]] = None):
+    """
+    Send a computed response with an ETag, answering 304 if the client's copy
+    is current and compressing larger bodies
+    """
+    etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+    if_none_match = handler.headers.get("If-None-Match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        handler.send_response(304)
+        handler.send_header("ETag", etag)
+        handler.send_header("Cache-Control", cache_control)
+        handler.end_headers()
+        return
+
+    encoding = None
+    if len(body) >= MIN_COMPRESS_SIZE:
+        available = ("br", "gzip") if brotli is not None else ("gzip",)
+        encoding = choose_encoding(handler.headers.get("Accept-Encoding"), available)
+        if encoding:
+            body = compress(body, encoding)
+
+    handler.send_response(200)
+    handler.send_header("Content-Type", content_type)
+    handler.send_header("Content-Length", str(len(body)))
+    handler.send_header("ETag", etag)
+    handler.send_header("Cache-Control", cache_control)
+    handler.send_header("Vary", "Accept-Encoding")
+    if encoding:
+        handler.send_header("Content-Encoding", encoding)
+    for name, value in (headers or {}).items():
+        handler.send_header(name, value)
+    handler.end_headers()
+    handler.wfile.write(body)
@@ -4,7 +4,11 @@ Uses OpenAI's language model to convert natural language to SQL queries
 """
 import os
 import sqlite3
-from typing import Dict, Any, List
+import gc
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional
 from pathlib import Path
 
 # LangChain imports
@@ -17,6 +21,75 @@ from langchain.agents import AgentType
 from langchain.memory import ConversationBufferMemory
 from langchain_core.messages import BaseMessage
 from langchain_core.prompts import PromptTemplate
+from sqlalchemy import create_engine
+
+from agent_callbacks import DeadlineCallbackHandler
+from answer_cache import APPROXIMATE_SUFFIX, AnswerCache, get_db_version
+from approximate_query import (
+    SAMPLE_TABLES, ApproximateQueryEngine, ApproximationContext, run_with_approximation
+)
+from deadlines import (
+    Deadline, QueryCancelled, attach_deadlines_to_engine, get_current_deadline, run_with_deadline
+)
+from example_store import ExampleStore
+from memory_replica import MemoryReplica
+from model_cascade import ModelCascade, get_executed_sql
+from partitions import CATALOG_TABLE, PartitionRouter
+from query_coalescer import QueryCoalescer, normalize_question
+from result_store import ResultStore
+from sample_questions import SAMPLE_QUESTIONS
+from sql_tools import LocalSQLDatabaseToolkit
+from shared_store import SharedAnswerCache, SharedTraceStore
+from sql_validator import SQLValidator
+from tracing import TraceStore
+
+# Tables described to the agent, in prompt order (derived tables are only
+# present in databases built by the current simple_setup.py)
+TABLE_DESCRIPTIONS = (
+    ("demographics", "- demographics: user_id, age"),
+    ("riders", "- riders: trip_id, user_id, age"),
+    ("trips", "- trips: trip_id, booking_user_id, pick_up_address, drop_off_address, passenger_count, date, hour, day_of_week, is_weekend, time_of_day"),
+    ("rider_pairs", "- rider_pairs: user_a, user_b, co_rides, first_co_ride_date, last_co_ride_date (one row per pair of riders who shared trips, user_a < user_b)"),
+    ("rider_features", "- rider_features: user_id, trips_taken, trips_booked, typical_hour, avg_group_size, max_group_size, first_trip_date, last_trip_date, distinct_co_riders, age"),
+    ("rider_clusters", "- rider_clusters: user_id, cluster_id, cluster_size (groups of riders linked by 2+ shared trips)"),
+    ("trip_chains", "- trip_chains: trip_id, booking_user_id, trip_datetime, date, hour, pick_up_address, drop_off_address, chain_position, prev_trip_id, prev_drop_off_address, minutes_since_prev, next_trip_id, next_trip_datetime, next_pick_up_address, next_drop_off_address, minutes_to_next, next_pick_up_distance_m, drop_off_matches_next_pick_up, next_is_return (one row per booked trip linked to the same booker's previous and next trip; the flags are 1/0)")
+)
+
+# Guidelines that only apply when all of their tables exist
+TABLE_GUIDELINES = (
+    (("rider_pairs", "rider_features", "rider_clusters"),
+     "For who-rides-with-whom, repeat group and rider frequency questions use rider_pairs, rider_features and rider_clusters instead of self-joining riders"),
+    (("trip_chains",),
+     "For trip sequence questions (return rides, where groups go next, time between trips) use trip_chains instead of self-joining trips")
+)
+
+
+class DeadlineChatOpenAI(ChatOpenAI):
+    """
+    ChatOpenAI whose requests never outlive the query that issued them
+
+    Each request's timeout is capped by the time left on the current query's
+    deadline, and responses are streamed so DeadlineCallbackHandler can abort
+    the HTTP stream at the next token once the query is cancelled.
+    """
+
+    def _deadline_kwargs(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        deadline = get_current_deadline()
+        remaining = deadline.remaining() if deadline is not None else None
+        if remaining is not None:
+            deadline.check()
+            timeout = self.request_timeout
+            if isinstance(timeout, (int, float)):
+                remaining = min(timeout, remaining)
+            kwargs["timeout"] = max(remaining, 0.1)
+        return kwargs
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return super()._generate(messages, stop=stop, run_manager=run_manager, **self._deadline_kwargs(kwargs))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        return super()._stream(messages, stop=stop, run_manager=run_manager, **self._deadline_kwargs(kwargs))
+
 
 class FetiiProLangChainChatbot:
     """
@@ -24,37 +97,83 @@ class FetiiProLangChainChatbot:
     queries to SQL and execute them on the FetiiPro database.
     """
     
-    def __init__(self, db_path: str, openai_api_key: str = None):
+    def __init__(self, db_path: str, openai_api_key: str = None, shared_store=None, llm_factory=None,
+                 example_store: Optional[ExampleStore] = None, results_path: Optional[str] = None):
         """
         Initialize the LangChain SQL chatbot
         
         Args:
             db_path: Path to the SQLite database
             openai_api_key: OpenAI API key (if None, will use environment variable)
+            shared_store: Optional SharedStore so caches and analytics are shared across processes
+            llm_factory: Optional callable (model, request_timeout) -> chat model used
+                instead of ChatOpenAI, e.g. a scripted stub for offline evaluation
+            example_store: Optional ExampleStore (defaults to the shared examples file)
+            results_path: Optional result store file (defaults to FETII_RESULTS_DB);
+                each dataset needs its own so result ids never resolve across datasets
         """
         self.db_path = db_path
+        self.shared_store = shared_store
+        self.llm_factory = llm_factory
         self.openai_api_key = openai_api_key or os.getenv("OPENAI_API_KEY")
         
-        if not self.openai_api_key:
+        if not self.openai_api_key and llm_factory is None:
             raise ValueError("OpenAI API key is required. Set OPENAI_API_KEY environment variable or pass it directly.")
         
         # Set the API key
-        os.environ["OPENAI_API_KEY"] = self.openai_api_key
+        if self.openai_api_key:
+            os.environ["OPENAI_API_KEY"] = self.openai_api_key
         
         # Initialize components
+        self.engine = None
         self.db = None
+        self.validator = None
         self.toolkit = None
         self.agent_executor = None
+        self.cascade = None
         self.memory = None
+        self.approximator = None
+        self.partition_router = None
+        self.replica = None
+        # Seconds spent in each setup phase, reported at server startup
+        self.startup_timings = {}
         
-        # Query analytics
-        self.query_history = []
+        # Query analytics; the history is bounded so long-lived servers don't grow
+        self.query_history = deque(maxlen=int(os.getenv("FETII_QUERY_HISTORY", 1000)))
+        self.max_memory_messages = int(os.getenv("FETII_MEMORY_MESSAGES", 20))
         self.query_stats = {
             "total_queries": 0,
             "successful_queries": 0,
             "failed_queries": 0,
-            "avg_response_time": 0
+            "avg_response_time": 0,
+            "cancelled_queries": 0
         }
+        self.cancellations = {}
+        self._stats_lock = threading.Lock()
+        
+        # Identical concurrent questions share a single agent run
+        self.coalescer = QueryCoalescer()
+        
+        # Few-shot examples from successful runs, injected into the prompt
+        self.example_store = example_store or ExampleStore()
+        
+        # Per-query span timelines, viewable through /api/trace/<id>
+        if shared_store is not None:
+            self.trace_store = SharedTraceStore(shared_store)
+        else:
+            self.trace_store = TraceStore()
+        
+        # Final answers per normalized question, tied to the database version
+        if shared_store is not None:
+            self.answer_cache = SharedAnswerCache(shared_store)
+        else:
+            self.answer_cache = AnswerCache()
+        
+        # Full result sets of executed SQL, paged through /api/results/<id>
+        self.result_store = ResultStore(
+            results_path or os.getenv("FETII_RESULTS_DB", "data/database/results.db"),
+            ttl=float(os.getenv("FETII_RESULTS_TTL", 3600))
+        )
         
         self._setup_database()
         self._setup_agent()
@@ -62,52 +181,159 @@ class FetiiProLangChainChatbot:
     def _setup_database(self):
         """Set up the SQL database connection"""
         try:
-            self.db = SQLDatabase.from_uri(f"sqlite:///{self.db_path}")
+            start_time = time.time()
+            # Deadlines are attached before the first connection is opened so
+            # every pooled connection can be interrupted
+            if PartitionRouter.is_partitioned(self.db_path):
+                # trips and riders live in monthly files read through views
+                self.partition_router = PartitionRouter(self.db_path)
+                engine = create_engine(f"sqlite:///{self.db_path}", creator=self.partition_router.connect)
+                self.partition_router.attach_to_engine(engine)
+            elif self._use_replica():
+                # Queries read an in-memory copy that is reloaded and swapped
+                # in when the file is rebuilt, so a rebuild never breaks them
+                self.replica = MemoryReplica(
+                    self.db_path, poll_interval=float(os.getenv("FETII_REPLICA_POLL", 5))
+                )
+                engine = create_engine(f"sqlite:///{self.db_path}", creator=self.replica.connect)
+                self.replica.attach_to_engine(engine)
+            else:
+                engine = create_engine(f"sqlite:///{self.db_path}")
+            attach_deadlines_to_engine(engine)
+            self.engine = engine
+            # Every reader goes through the same connections, so partitioned
+            # trips and riders are never read from the (empty) main tables
+            if self.partition_router:
+                connect = self.partition_router.connect
+            else:
+                connect = self.replica.connect if self.replica else None
+            # Local validator replaces the LLM-based query checker tool
+            schema_start = time.time()
+            self.validator = SQLValidator(self.db_path, connect=connect)
+            schema = self.validator.get_schema()
+            self.startup_timings["schema"] = time.time() - schema_start
+            # Sample tables are used through approximate mode only and the
+            # partition catalog by the router, so the agent never sees them
+            self.db = SQLDatabase(
+                engine,
+                ignore_tables=[table for table in SAMPLE_TABLES + (CATALOG_TABLE,) if table in schema]
+            )
+            self.approximator = ApproximateQueryEngine(
+                self.db_path, min_rows=int(os.getenv("FETII_APPROX_MIN_ROWS", 1000000)), connect=connect
+            )
+            if self.replica is not None:
+                self.replica.on_swap(self.validator.refresh_schema)
+                self.replica.start()
+            self.startup_timings["db_connect"] = time.time() - start_time - self.startup_timings["schema"]
             print(f"✅ Connected to database: {self.db_path}")
         except Exception as e:
             print(f"❌ Error connecting to database: {e}")
             raise
     
+    def _use_replica(self) -> bool:
+        """
+        Whether to query an in-memory copy: opt-in with FETII_MEMORY_REPLICA=1,
+        and only for files up to FETII_REPLICA_MAX_MB (default 256), since
+        every worker and every pooled dataset holds its own copy
+        """
+        if os.getenv("FETII_MEMORY_REPLICA", "0") != "1":
+            return False
+        size_mb = os.path.getsize(self.db_path) / (1024 * 1024)
+        max_mb = float(os.getenv("FETII_REPLICA_MAX_MB", 256))
+        if size_mb > max_mb:
+            print(f"⚠️ {self.db_path} is {size_mb:.0f} MB, over FETII_REPLICA_MAX_MB ({max_mb:.0f}); reading the file")
+            return False
+        return True
+    
     def _setup_agent(self):
-        """Set up the LangChain SQL agent with enhanced configuration"""
+        """Set up the tiered LangChain SQL agents"""
         try:
-            # Initialize the LLM with GPT-4 for better performance
-            llm = ChatOpenAI(
-                model="gpt-4",
-                temperature=0,
-                openai_api_key=self.openai_api_key,
-                max_retries=3,
-                request_timeout=60  # Increased timeout for GPT-4
-            )
-            
-            # Create SQL toolkit
-            self.toolkit = SQLDatabaseToolkit(db=self.db, llm=llm)
-            
-            # Create memory for conversation context
+            start_time = time.time()
+            # Create memory for conversation context, shared by all model tiers
             self.memory = ConversationBufferMemory(
                 memory_key="chat_history",
                 return_messages=True,
-                memory_key_prefix="fetii_pro_"
+                memory_key_prefix="fetii_pro_",
+                input_key="input",
+                output_key="output"
             )
             
-            # Create custom prompt for better SQL generation
-            custom_prompt = PromptTemplate(
-                input_variables=["input", "agent_scratchpad", "tools", "tool_names"],
-                template="""
+            # Cheap model first, escalating to the strong model on validation failure
+            self.cascade = ModelCascade(self._build_agent, validator=self.validator, memory=self.memory)
+            self.agent_executor = self.cascade.get_executor(self.cascade.tiers[-1])
+            self.startup_timings["agent"] = time.time() - start_time
+            
+            print("✅ LangChain SQL agent initialized successfully with enhanced configuration")
+            print(f"🪜 Model tiers: {' -> '.join(tier['model'] for tier in self.cascade.tiers)}")
+            
+        except Exception as e:
+            print(f"❌ Error setting up LangChain agent: {e}")
+            raise
+    
+    def _describe_tables(self) -> Dict[str, str]:
+        """
+        Prompt lines for the tables and table-specific guidelines
+        
+        Only tables present in the database are described: derived tables
+        are missing from databases built before they were added, and the
+        agent would otherwise query tables that do not exist.
+        """
+        schema = self.validator.get_schema()
+        tables = [description for table, description in TABLE_DESCRIPTIONS if table in schema]
+        guidelines = [
+            guideline for required, guideline in TABLE_GUIDELINES if all(table in schema for table in required)
+        ]
+        return {
+            "table_descriptions": "\n".join(tables),
+            "table_guidelines": "\n".join(
+                f"{number}. {guideline}" for number, guideline in enumerate(guidelines, start=6)
+            )
+        }
+    
+    def _build_agent(self, model: str, request_timeout: int) -> AgentExecutor:
+        """Build a SQL agent executor for one model tier"""
+        if self.llm_factory is not None:
+            llm = self.llm_factory(model, request_timeout)
+        else:
+            llm = DeadlineChatOpenAI(
+                model=model,
+                temperature=0,
+                openai_api_key=self.openai_api_key,
+                max_retries=3,
+                request_timeout=request_timeout,
+                streaming=True,
+                stream_usage=True
+            )
+        
+        # Create SQL toolkit with a local (non-LLM) query checker
+        # Large results are compacted before they reach the prompt, with
+        # column summaries computed while reading them
+        self.toolkit = LocalSQLDatabaseToolkit(
+            db=self.db, llm=llm, validator=self.validator, approximator=self.approximator,
+            engine=self.engine,
+            max_observation_rows=int(os.getenv("FETII_OBSERVATION_ROWS", 20)),
+            max_value_chars=int(os.getenv("FETII_OBSERVATION_VALUE_CHARS", 60)),
+            max_summary_rows=int(os.getenv("FETII_SUMMARY_ROWS", 50000))
+        )
+        
+        # Create custom prompt for better SQL generation
+        custom_prompt = PromptTemplate(
+            input_variables=["input", "examples", "agent_scratchpad", "tools", "tool_names"],
+            partial_variables=self._describe_tables(),
+            template="""
 You are a helpful SQL assistant for FetiiPro ride-sharing data analysis. 
 You have access to the following tables:
-- demographics: user_id, age
-- riders: trip_id, user_id, age  
-- trips: trip_id, booking_user_id, pick_up_address, drop_off_address, passenger_count, date, hour, day_of_week, is_weekend, time_of_day
-
+{table_descriptions}
 Guidelines:
 1. Always use proper JOINs when combining data from multiple tables
 2. Use descriptive column aliases in your results
 3. Include LIMIT clauses for large result sets
 4. Handle NULL values appropriately
 5. Provide clear, formatted responses
+{table_guidelines}
 
-Question: {input}
+Examples of similar questions answered before:
+{examples}
 
 You have access to the following tools:
 {tools}
@@ -126,39 +352,50 @@ Begin!
 
 Question: {input}
 Thought: {agent_scratchpad}
-                """
-            )
-            
-            # Create the SQL agent with enhanced configuration
-            self.agent_executor = create_sql_agent(
-                llm=llm,
-                toolkit=self.toolkit,
-                agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-                verbose=True,
-                memory=self.memory,
-                handle_parsing_errors=True,
-                max_iterations=10,
-                max_execution_time=60
-            )
-            
-            print("✅ LangChain SQL agent initialized successfully with enhanced configuration")
-            
-        except Exception as e:
-            print(f"❌ Error setting up LangChain agent: {e}")
-            raise
+            """
+        )
+        
+        # Create the SQL agent with enhanced configuration; intermediate steps
+        # are returned so the cascade can validate the executed SQL
+        return create_sql_agent(
+            llm=llm,
+            toolkit=self.toolkit,
+            agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+            prompt=custom_prompt,
+            verbose=True,
+            max_iterations=10,
+            max_execution_time=request_timeout,
+            # The cascade keeps the memory, recording only the answer it returns
+            agent_executor_kwargs={
+                "handle_parsing_errors": True,
+                "return_intermediate_steps": True
+            }
+        )
     
-    def process_query(self, natural_language_query: str) -> Dict[str, Any]:
+    def process_query(self, natural_language_query: str, use_cache: bool = True,
+                      deadline: Deadline = None, approximate: bool = False,
+                      return_results: bool = False) -> Dict[str, Any]:
         """
         Process a natural language query and return the result with enhanced formatting
         
         Args:
             natural_language_query: The user's question in natural language
+            use_cache: Whether a cached answer for the current data may be returned
+            deadline: Deadline after which (or once cancelled) the agent run and
+                its SQL are aborted; defaults to FETII_QUERY_TIMEOUT seconds
+            approximate: Accept estimates with confidence intervals computed
+                from the trip samples; queries on small tables still run exactly
+            return_results: Also run the executed SQL into the result store and
+                return a handle ("results") to its full, unsummarized rows
             
         Returns:
             Dictionary with success status, response, and metadata
         """
         import time
         start_time = time.time()
+        trace = self.trace_store.new_trace(natural_language_query)
+        if deadline is None:
+            deadline = Deadline(float(os.getenv("FETII_QUERY_TIMEOUT", 90)))
         
         try:
             print(f"🤖 Processing query: {natural_language_query}")
@@ -173,28 +410,117 @@ Thought: {agent_scratchpad}
                     "query_type": "langchain_nl_sql"
                 }
             
-            # Use the LangChain agent to process the query
-            result = self.agent_executor.invoke({
-                "input": natural_language_query
-            })
+            # Serve repeated questions from the answer cache
+            cache_key = self._get_cache_key(natural_language_query, approximate)
+            db_version = self.get_db_version()
+            span = trace.start_span("answer_cache", "cache")
+            cached = self.answer_cache.get(cache_key, db_version) if use_cache else None
+            trace.end_span(span, hit=cached is not None)
+            if cached is not None:
+                trace.finish()
+                response_time = time.time() - start_time
+                self._log_query(natural_language_query, True, response_time, cached["raw_response"])
+                response = dict(
+                    cached,
+                    cached=True,
+                    trace_id=trace.trace_id,
+                    timestamp=self._get_timestamp(),
+                    response_time=response_time
+                )
+                if return_results:
+                    response["results"] = self._materialize_results(response, natural_language_query, deadline)
+                return response
+            
+            # Retrieve similar solved questions as few-shot examples
+            span = trace.start_span("example_retrieval", "examples")
+            examples = self.example_store.search(natural_language_query)
+            trace.end_span(span, examples=len(examples))
+            
+            # Use the LangChain agent to process the query, sharing the run
+            # with any identical question that is already in flight
+            span = trace.start_span("agent_run", "agent")
+            inputs = {
+                "input": natural_language_query,
+                "examples": self.example_store.format_examples(examples)
+            }
+            approximation = ApproximationContext(enabled=approximate)
+            result, shared = self.coalescer.run(
+                cache_key,
+                lambda: run_with_deadline(
+                    lambda: run_with_approximation(
+                        lambda: self.cascade.run(
+                            inputs, trace=trace, callbacks=[DeadlineCallbackHandler(deadline)]
+                        ),
+                        approximation
+                    ),
+                    deadline
+                ),
+                deadline=deadline
+            )
+            trace.end_span(span, coalesced=shared)
             
             response_text = result.get("output", "No response generated")
-            response_time = time.time() - start_time
             
             # Enhanced response formatting
+            span = trace.start_span("format_response", "format")
             formatted_response = self._format_response(response_text, natural_language_query)
+            trace.end_span(span)
+            response_time = time.time() - start_time
+            
+            # Learn from accepted answers so similar questions start warm;
+            # answers built on sampled estimates are not kept as examples
+            sql, _ = get_executed_sql(result)
+            if sql and not shared and not result["validation_problems"] and not approximation.estimates:
+                self.example_store.add(natural_language_query, sql, formatted_response)
             
             # Log successful query
             self._log_query(natural_language_query, True, response_time, response_text)
             
-            return {
+            response = {
                 "success": True,
                 "response": formatted_response,
                 "raw_response": response_text,
                 "query_type": "langchain_nl_sql",
-                "model": "gpt-4",
+                "model": result["model"],
+                "tiers_tried": result["tiers_tried"],
+                "sql": sql,
+                "iterations": len(result.get("intermediate_steps", [])),
+                "token_usage": result["token_usage"],
+                "examples_used": len(examples),
                 "timestamp": self._get_timestamp(),
-                "response_time": response_time
+                "response_time": response_time,
+                "coalesced": shared,
+                "cached": False,
+                "approximate": bool(approximation.estimates),
+                "confidence_intervals": approximation.estimates,
+                "trace_id": trace.trace_id
+            }
+            trace.finish()
+            self.answer_cache.put(cache_key, natural_language_query, db_version, response)
+            self._trim_conversation(self.max_memory_messages)
+            if return_results:
+                response = dict(
+                    response,
+                    results=self._materialize_results(response, natural_language_query, deadline)
+                )
+            return response
+            
+        except QueryCancelled as e:
+            response_time = time.time() - start_time
+            print(f"🛑 {e}")
+            self._log_query(natural_language_query, False, response_time)
+            self._log_cancellation(e.reason)
+            trace.finish()
+            
+            return {
+                "success": False,
+                "error": str(e),
+                "cancelled": True,
+                "cancel_reason": e.reason,
+                "query_type": "langchain_nl_sql",
+                "timestamp": self._get_timestamp(),
+                "response_time": response_time,
+                "trace_id": trace.trace_id
             }
             
         except Exception as e:
@@ -213,15 +539,66 @@ Thought: {agent_scratchpad}
             
             # Log failed query
             self._log_query(natural_language_query, False, response_time)
+            trace.finish()
             
             return {
                 "success": False,
                 "error": error_msg,
                 "query_type": "langchain_nl_sql",
                 "timestamp": self._get_timestamp(),
-                "response_time": response_time
+                "response_time": response_time,
+                "trace_id": trace.trace_id
             }
     
+    def _materialize_results(self, response: Dict[str, Any], natural_language_query: str,
+                             deadline: Deadline) -> Dict[str, Any]:
+        """Copy the full result of the answer's SQL into the result store and get its handle"""
+        if not response.get("sql"):
+            return {"error": "The answer did not run a SQL query"}
+        try:
+            return run_with_deadline(
+                lambda: self.result_store.materialize(self.engine, response["sql"], natural_language_query),
+                deadline
+            )
+        except QueryCancelled:
+            raise
+        except Exception as e:
+            print(f"⚠️ Could not materialize results: {e}")
+            return {"error": str(e)}
+    
+    def has_cached_answer(self, natural_language_query: str, approximate: bool = False) -> bool:
+        """Whether the question can be answered from the cache without the LLM"""
+        return self.answer_cache.contains(
+            self._get_cache_key(natural_language_query, approximate), self.get_db_version()
+        )
+    
+    def get_db_version(self):
+        """Version of the data queries currently run against (the loaded replica, if any)"""
+        if self.replica is not None:
+            return self.replica.version
+        return get_db_version(self.db_path)
+    
+    def _get_cache_key(self, natural_language_query: str, approximate: bool) -> str:
+        """Cache and coalescing key; approximate answers never stand in for exact ones"""
+        key = normalize_question(natural_language_query)
+        return key + APPROXIMATE_SUFFIX if approximate else key
+    
+    def get_trace(self, trace_id: str, chrome: bool = False) -> Dict[str, Any]:
+        """
+        Get the recorded span timeline of a query
+        
+        Args:
+            trace_id: The trace_id returned by process_query
+            chrome: Export in Chrome trace event format instead
+            
+        Returns:
+            The trace, or None if it is unknown or has been evicted
+        """
+        trace = self.trace_store.get(trace_id)
+        if trace is None:
+            return None
+        return trace.to_chrome_trace() if chrome else trace.to_dict()
+    
     def _format_response(self, response: str, original_query: str) -> str:
         """Format the response to show only the clean answer"""
         # Extract just the final answer
@@ -251,13 +628,7 @@ Thought: {agent_scratchpad}
     
     def get_sample_questions(self) -> List[str]:
         """Get sample questions that work well with this chatbot"""
-        return [
-            "How many total trips are there?",
-            "What is the average passenger count?",
-            "How many trips happened on weekends?",
-            "What are the busiest hours for trips?",
-            "How many large group trips are there?"
-        ]
+        return list(SAMPLE_QUESTIONS)
     
     def clear_memory(self):
         """Clear the conversation memory"""
@@ -265,17 +636,105 @@ Thought: {agent_scratchpad}
             self.memory.clear()
             print("🧹 Conversation memory cleared")
     
+    def _trim_conversation(self, keep: int) -> int:
+        """Keep only the last messages of the conversation memory; returns how many were dropped"""
+        if not self.memory:
+            return 0
+        messages = self.memory.chat_memory.messages
+        dropped = max(0, len(messages) - keep)
+        if dropped:
+            self.memory.chat_memory.messages = messages[-keep:] if keep else []
+        return dropped
+    
+    def release_memory(self) -> Dict[str, int]:
+        """
+        Drop in-process caches and history under memory pressure
+        
+        The persistent example store and the shared (on-disk) answer cache
+        are kept; everything released here is rebuilt on demand.
+        
+        Returns:
+            Number of entries released per structure
+        """
+        released = {"conversation_messages": self._trim_conversation(self.max_memory_messages // 4)}
+        if isinstance(self.answer_cache, AnswerCache):
+            released["answer_cache"] = self.answer_cache.get_stats()["entries"]
+            self.answer_cache.clear()
+        released["traces"] = self.trace_store.clear()
+        with self._stats_lock:
+            released["query_history"] = max(0, len(self.query_history) - 100)
+            for _ in range(released["query_history"]):
+                self.query_history.popleft()
+        gc.collect()
+        print(f"🧹 Released memory: {released}")
+        return released
+    
+    def get_memory_structures(self) -> Dict[str, Any]:
+        """Sizes of the in-process structures that grow with use"""
+        return {
+            "query_history": len(self.query_history),
+            "answer_cache": self.answer_cache.get_stats().get("entries"),
+            "conversation_messages": len(self.memory.chat_memory.messages) if self.memory else 0,
+            "example_store": len(self.example_store.examples),
+            "replica_mb": round(self.replica.get_stats()["size_mb"], 1) if self.replica else 0
+        }
+    
+    def close(self):
+        """
+        Stop background work and release pooled connections
+        
+        Queries still running finish normally, but new queries fail: a closed
+        replica refuses new connections (ReplicaClosed) instead of opening an
+        empty database. The pool only closes a chatbot after its last release.
+        """
+        if self.replica is not None:
+            self.replica.close()
+        if self.engine is not None:
+            self.engine.dispose()
+    
     def get_query_analytics(self) -> Dict[str, Any]:
         """Get query analytics and statistics"""
+        if self.shared_store is not None:
+            # Global statistics across all worker processes
+            stats = self.shared_store.get_query_stats()
+            return {
+                "stats": stats,
+                "recent_queries": self.shared_store.get_recent_queries(10),
+                "total_queries": stats["total_queries"],
+                "cancellations": self.shared_store.get_counters("cancelled."),
+                "coalescing": self.coalescer.get_stats(),
+                "answer_cache": self.answer_cache.get_stats(),
+                "approximation": self.approximator.get_stats() if self.approximator else {},
+                "partitions": self.partition_router.get_stats() if self.partition_router else {},
+                "results": self.result_store.get_stats(),
+                "replica": self.replica.get_stats() if self.replica else {},
+                "cascade": self.cascade.get_stats() if self.cascade else {}
+            }
+        
         return {
             "stats": self.query_stats,
-            "recent_queries": self.query_history[-10:],  # Last 10 queries
-            "total_queries": len(self.query_history)
+            "recent_queries": list(self.query_history)[-10:],  # Last 10 queries
+            "total_queries": self.query_stats["total_queries"],
+            "cancellations": dict(self.cancellations),
+            "coalescing": self.coalescer.get_stats(),
+            "answer_cache": self.answer_cache.get_stats(),
+            "approximation": self.approximator.get_stats() if self.approximator else {},
+            "partitions": self.partition_router.get_stats() if self.partition_router else {},
+            "results": self.result_store.get_stats(),
+            "cascade": self.cascade.get_stats() if self.cascade else {}
         }
     
+    def _log_cancellation(self, reason: str):
+        """Count a cancelled query by reason"""
+        with self._stats_lock:
+            self.query_stats["cancelled_queries"] += 1
+            self.cancellations[reason] = self.cancellations.get(reason, 0) + 1
+        if self.shared_store is not None:
+            self.shared_store.increment(f"cancelled.{reason}")
+    
     def get_query_history(self) -> List[Dict[str, Any]]:
-        """Get full query history"""
-        return self.query_history
+        """Get the retained query history (the last FETII_QUERY_HISTORY queries)"""
+        return list(self.query_history)
     
     def _log_query(self, query: str, success: bool, response_time: float, response: str = None):
         """Log query for analytics"""
@@ -287,17 +746,22 @@ Thought: {agent_scratchpad}
             "response_length": len(response) if response else 0
         }
         
-        self.query_history.append(query_log)
-        self.query_stats["total_queries"] += 1
-        
-        if success:
-            self.query_stats["successful_queries"] += 1
-        else:
-            self.query_stats["failed_queries"] += 1
+        with self._stats_lock:
+            self.query_history.append(query_log)
+            self.query_stats["total_queries"] += 1
+            
+            if success:
+                self.query_stats["successful_queries"] += 1
+            else:
+                self.query_stats["failed_queries"] += 1
+            
+            # Running average, since the history only keeps recent queries
+            self.query_stats["avg_response_time"] += (
+                response_time - self.query_stats["avg_response_time"]
+            ) / self.query_stats["total_queries"]
         
-        # Update average response time
-        total_time = sum(q["response_time"] for q in self.query_history)
-        self.query_stats["avg_response_time"] = total_time / len(self.query_history)
+        if self.shared_store is not None:
+            self.shared_store.log_query(query_log)
 
 def main():
     """Main function for testing the LangChain chatbot"""
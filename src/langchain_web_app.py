@@ -3,55 +3,244 @@ LangChain-based Web Chatbot for FetiiPro Data Analysis
 Web interface for the LangChain NL-SQL chatbot
 """
 import os
+import hashlib
+import hmac
 import json
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import re
+import select
+import socket
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
-from langchain_chatbot import FetiiProLangChainChatbot
+from chatbot_pool import DEFAULT_DATASET, ChatbotPool, parse_datasets
+from deadlines import Deadline, QueryCancelled
+from example_store import ExampleStore
+from geo_tiles import TILE_FORMATS, GeoTileStore, parse_filters, tile_to_json
+from http_transport import StaticAsset, send_cacheable, send_chunked, send_json, send_static
+from memory_watchdog import MemoryWatchdog
+from prefork import serve_prefork
+from result_store import RESULT_FORMATS, encode_pages
+from scheduler import PRIORITY_API, PRIORITY_INTERACTIVE, QueryScheduler, SchedulerRejected
+from sample_questions import SAMPLE_QUESTIONS
+from shared_store import SharedStore
+from warmup import CacheRefresher, WarmupState, warm_up
 
-class LangChainChatbotHandler(BaseHTTPRequestHandler):
-    """HTTP request handler for the LangChain chatbot web interface"""
+DB_PATH = "data/database/fetiipro.db"
+
+# Header naming the dataset of a request (the /d/<dataset>/ path prefix
+# takes precedence)
+DATASET_HEADER = "X-Fetii-Dataset"
+
+# Rate limits key on the peer address; X-Forwarded-For is only read from
+# these proxies and X-API-Key only for these keys
+TRUSTED_PROXIES = {ip.strip() for ip in os.environ.get('FETII_TRUSTED_PROXIES', '').split(',') if ip.strip()}
+API_KEYS = {key.strip() for key in os.environ.get('FETII_API_KEYS', '').split(',') if key.strip()}
+
+# The page sets a signed cookie bound to the client's rate-limit key; only
+# requests carrying it get the interactive lane. The secret is made before
+# prefork so all workers accept it (set FETII_WEB_SECRET across servers)
+WEB_COOKIE = "fetii_web"
+WEB_COOKIE_MAX_AGE = 12 * 3600
+_web_secret = os.environ.get('FETII_WEB_SECRET', '').encode() or os.urandom(32)
+
+# /api/debug/memory is only served to requests bearing this token
+DEBUG_TOKEN = os.environ.get('FETII_DEBUG_TOKEN', '')
+
+_chatbot_class = None
+_chatbot_class_lock = threading.Lock()
+_warmup_state = WarmupState()
+_shared_store = None
+
+# Seconds spent in each startup phase; LangChain is only imported when the
+# first chatbot is built so the port can be bound first
+_process_started = time.time()
+_startup_timings = {}
+
+# Set by run_server; the watchdog recycles prefork workers past the hard limit
+_httpd = None
+_prefork_worker = False
+_watchdog = None
+
+# Admission control in front of process_query
+_scheduler = QueryScheduler(
+    rate_per_minute=float(os.environ.get('FETII_RATE_PER_MINUTE', 30)),
+    burst=float(os.environ.get('FETII_RATE_BURST', 10)),
+    max_concurrent=int(os.environ.get('FETII_MAX_CONCURRENT_LLM', 4)),
+    max_queue=int(os.environ.get('FETII_MAX_QUEUE', 32)),
+    queue_timeout=float(os.environ.get('FETII_QUEUE_TIMEOUT', 30))
+)
+
+
+def get_chatbot_class():
+    """Import the chatbot class on first use (LangChain takes seconds to import)"""
+    global _chatbot_class
+    with _chatbot_class_lock:
+        if _chatbot_class is None:
+            import_start = time.time()
+            from langchain_chatbot import FetiiProLangChainChatbot
+            _chatbot_class = FetiiProLangChainChatbot
+            _startup_timings["import"] = time.time() - import_start
+    return _chatbot_class
+
+
+def open_shared_store(path):
+    """Open a shared store with the query log retention from the environment"""
+    return SharedStore(
+        path,
+        max_query_log=int(os.environ.get('FETII_QUERY_LOG_ROWS', 100000)),
+        query_log_ttl=float(os.environ.get('FETII_QUERY_LOG_DAYS', 30)) * 86400
+    )
+
+
+def create_chatbot(dataset):
+    """Build the chatbot of a dataset, with its own answer cache and examples"""
+    openai_api_key = os.getenv("OPENAI_API_KEY")
     
-    def __init__(self, *args, **kwargs):
-        self.chatbot = None
-        super().__init__(*args, **kwargs)
+    if not openai_api_key:
+        raise ValueError("OPENAI_API_KEY environment variable not set")
     
-    def do_GET(self):
-        """Handle GET requests"""
-        parsed_path = urlparse(self.path)
-        
-        if parsed_path.path == '/':
-            self.serve_html()
-        elif parsed_path.path == '/api/query':
-            self.handle_query()
-        elif parsed_path.path == '/api/info':
-            self.handle_info()
-        elif parsed_path.path == '/api/samples':
-            self.handle_samples()
-        elif parsed_path.path == '/api/analytics':
-            self.handle_analytics()
-        else:
-            self.send_error(404)
+    chatbot_class = get_chatbot_class()
+    if dataset.name == DEFAULT_DATASET:
+        chatbot = chatbot_class(dataset.db_path, openai_api_key, shared_store=_shared_store)
+        if "ready" not in _startup_timings:
+            _startup_timings.update(chatbot.startup_timings)
+            _startup_timings["ready"] = time.time() - _process_started
+            print("⏱️ Startup: " + ", ".join(
+                f"{phase} {seconds:.2f}s" for phase, seconds in _startup_timings.items()
+            ))
+        return chatbot
     
-    def do_POST(self):
-        """Handle POST requests"""
-        parsed_path = urlparse(self.path)
-        
-        if parsed_path.path == '/api/query':
-            self.handle_query_post()
-        else:
-            self.send_error(404)
+    # Workers share a dataset's answers only if they share the default one's
+    shared_store = open_shared_store(dataset.state_path("shared_cache.db")) if _shared_store is not None else None
+    return chatbot_class(
+        dataset.db_path,
+        openai_api_key,
+        shared_store=shared_store,
+        example_store=ExampleStore(dataset.state_path("examples.jsonl")),
+        results_path=dataset.state_path("results.db")
+    )
+
+
+# One chatbot per dataset is shared by all request threads so that
+# identical concurrent questions can be coalesced into one agent run
+_pool = ChatbotPool(
+    parse_datasets(os.environ.get('FETII_DATASETS'), DB_PATH),
+    create_chatbot,
+    max_chatbots=int(os.environ.get('FETII_POOL_SIZE', 4)),
+    max_memory_mb=float(os.environ['FETII_POOL_MAX_MB']) if os.environ.get('FETII_POOL_MAX_MB') else None
+)
+
+
+# Density tile caches per dataset; they read the database directly, so
+# tiles are served without building a chatbot
+_tile_stores = {}
+_tile_stores_lock = threading.Lock()
+
+
+def get_tile_store(dataset=DEFAULT_DATASET):
+    """Get or create the tile cache of a dataset"""
+    with _tile_stores_lock:
+        if dataset not in _tile_stores:
+            config = _pool.datasets[dataset]
+            if dataset == DEFAULT_DATASET:
+                path = os.environ.get('FETII_TILES_DB', "data/database/tiles.db")
+            else:
+                path = config.state_path("tiles.db")
+            _tile_stores[dataset] = GeoTileStore(
+                config.db_path, path, grid=int(os.environ.get('FETII_TILE_GRID', 64))
+            )
+        return _tile_stores[dataset]
+
+
+def get_shared_chatbot(dataset=DEFAULT_DATASET):
+    """Get or create the shared chatbot instance of a dataset"""
+    # Import outside the pool's build lock so its memory accounting only
+    # covers the dataset itself
+    get_chatbot_class()
+    return _pool.get(dataset)
+
+
+def build_chatbot_in_background():
+    """Build the chatbot in a daemon thread so requests are served meanwhile"""
+    def build():
+        try:
+            get_shared_chatbot()
+        except Exception as e:
+            print(f"❌ Chatbot build failed: {e}")
     
-    def serve_html(self):
-        """Serve the main HTML page"""
-        html_content = """
+    threading.Thread(target=build, name="chatbot-builder", daemon=True).start()
+
+
+def release_caches():
+    """Soft memory limit: evict idle datasets and drop in-process caches and history"""
+    return _pool.release_memory()
+
+
+def recycle_worker():
+    """Hard memory limit: stop accepting requests so the worker drains and exits"""
+    if _httpd is None or not _prefork_worker:
+        # Without the prefork manager nothing would restart the process
+        print("⚠️ Hard memory limit reached outside a prefork worker; releasing caches instead")
+        release_caches()
+        return
+    # shutdown() blocks until serve_forever() returns, so call it off-thread
+    threading.Thread(target=_httpd.shutdown, name="recycle", daemon=True).start()
+
+
+def drain_worker(index):
+    """Wait for in-flight queries of a recycled worker before it exits"""
+    timeout = float(os.environ.get('FETII_DRAIN_TIMEOUT', 30))
+    give_up = time.time() + timeout
+    while time.time() < give_up:
+        stats = _scheduler.get_stats()
+        if not stats["active_llm_runs"] and not stats["queue_depth"]:
+            break
+        time.sleep(0.2)
+    # Let request threads finish writing their responses
+    time.sleep(1)
+    print(f"♻️ Worker {index} (pid {os.getpid()}) drained and exiting")
+
+
+def start_memory_watchdog():
+    """Start the memory watchdog with limits from the environment"""
+    global _watchdog
+    soft_limit = os.environ.get('FETII_MEMORY_SOFT_MB')
+    hard_limit = os.environ.get('FETII_MEMORY_HARD_MB')
+    _watchdog = MemoryWatchdog(
+        soft_limit_mb=float(soft_limit) if soft_limit else None,
+        hard_limit_mb=float(hard_limit) if hard_limit else None,
+        interval=float(os.environ.get('FETII_MEMORY_INTERVAL', 30)),
+        trace_frames=int(os.environ.get('FETII_TRACEMALLOC_FRAMES', 0)),
+        on_soft_limit=release_caches,
+        on_hard_limit=recycle_worker
+    )
+    _watchdog.start()
+
+
+def watch_client_disconnect(sock, deadline, done, poll_interval=0.5):
+    """Cancel the deadline if the client closes its connection before done is set"""
+    while not done.is_set() and not deadline.cancelled:
+        try:
+            readable, _, _ = select.select([sock], [], [], poll_interval)
+            if not readable:
+                continue
+            # A readable socket with no data means the peer closed it
+            if sock.recv(1, socket.MSG_PEEK) == b'':
+                deadline.cancel("client_disconnected")
+            # Otherwise the client pipelined another request; stop watching
+            return
+        except (OSError, ValueError):
+            deadline.cancel("client_disconnected")
+            return
+
+
+INDEX_HTML = """
 <!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <meta http-equiv="Cache-Control" content="no-cache, no-store, must-revalidate">
-        <meta http-equiv="Pragma" content="no-cache">
-        <meta http-equiv="Expires" content="0">
         <meta name="version" content="2.0">
     <title>FetiiPro LangChain SQL Chatbot</title>
     <style>
@@ -342,7 +531,7 @@ class LangChainChatbotHandler(BaseHTTPRequestHandler):
                 document.getElementById('loading').style.display = 'block';
                 
                 try {
-                    const response = await fetch('/api/query', {
+                    const response = await fetch('api/query', {
                         method: 'POST',
                         headers: { 'Content-Type': 'application/json' },
                         body: JSON.stringify({ question: message })
@@ -371,7 +560,7 @@ class LangChainChatbotHandler(BaseHTTPRequestHandler):
 
         async function loadDbInfo() {
             try {
-                const response = await fetch('/api/info');
+                const response = await fetch('api/info');
                 const data = await response.json();
                 dbInfoTextarea.value = data.info;
             } catch (error) {
@@ -385,7 +574,7 @@ class LangChainChatbotHandler(BaseHTTPRequestHandler):
 
         async function loadSampleQuestions() {
             try {
-                const response = await fetch('/api/samples');
+                const response = await fetch('api/samples');
                 const data = await response.json();
                 sampleQuestionsDiv.innerHTML = '';
                 data.sample_questions.forEach(q => {
@@ -415,7 +604,7 @@ class LangChainChatbotHandler(BaseHTTPRequestHandler):
 
         async function clearMemory() {
             try {
-                await fetch('/api/clear-memory', { method: 'POST' });
+                await fetch('api/clear-memory', { method: 'POST' });
                 displayMessage("🧠 Conversation memory cleared!", false, false, 'LangChain');
             } catch (error) {
                 displayMessage("Error clearing memory: " + error, false, true);
@@ -424,7 +613,7 @@ class LangChainChatbotHandler(BaseHTTPRequestHandler):
 
         async function showAnalytics() {
             try {
-                const response = await fetch('/api/analytics');
+                const response = await fetch('api/analytics');
                 const data = await response.json();
                 
                 if (data.success) {
@@ -438,6 +627,7 @@ class LangChainChatbotHandler(BaseHTTPRequestHandler):
                             • Successful: ${stats.successful_queries}<br>
                             • Failed: ${stats.failed_queries}<br>
                             • Avg Response Time: ${stats.avg_response_time.toFixed(2)}s<br>
+                            • LLM Runs Saved: ${analytics.coalescing ? analytics.coalescing.llm_runs_saved : 0}<br>
                             • Success Rate: ${((stats.successful_queries / stats.total_queries) * 100).toFixed(1)}%
                         </div>
                     `;
@@ -459,25 +649,124 @@ class LangChainChatbotHandler(BaseHTTPRequestHandler):
     </script>
 </body>
 </html>
+"""
+
+# Rendered, hashed and compressed once instead of on every GET /
+INDEX_ASSET = StaticAsset(INDEX_HTML.encode("utf-8"), "text/html; charset=utf-8")
+
+class LangChainChatbotHandler(BaseHTTPRequestHandler):
+    """HTTP request handler for the LangChain chatbot web interface"""
+    
+    # HTTP/1.1 keeps connections alive between requests; every response
+    # therefore carries a Content-Length
+    protocol_version = "HTTP/1.1"
+    
+    def do_GET(self):
+        """Handle GET requests"""
+        try:
+            self.route_get()
+        finally:
+            self.release_chatbot()
+    
+    def route_get(self):
+        """Dispatch a GET request"""
+        parsed_path = self.parse_dataset_path()
+        
+        if parsed_path is None:
+            return
+        elif parsed_path.path == '/':
+            self.serve_html()
+        elif parsed_path.path == '/api/query':
+            self.handle_query()
+        elif parsed_path.path == '/api/info':
+            self.handle_info()
+        elif parsed_path.path == '/api/samples':
+            self.handle_samples()
+        elif parsed_path.path == '/api/analytics':
+            self.handle_analytics()
+        elif parsed_path.path.startswith('/api/trace/'):
+            self.handle_trace(parsed_path)
+        elif parsed_path.path.startswith('/api/results/'):
+            self.handle_results(parsed_path)
+        elif parsed_path.path.startswith('/api/tiles/'):
+            self.handle_tile(parsed_path)
+        elif parsed_path.path == '/api/debug/memory':
+            self.handle_debug_memory(parsed_path)
+        elif parsed_path.path == '/healthz':
+            self.handle_healthz()
+        elif parsed_path.path == '/readyz':
+            self.handle_readyz()
+        else:
+            self.send_error(404)
+    
+    def do_POST(self):
+        """Handle POST requests"""
+        try:
+            self.route_post()
+        finally:
+            self.release_chatbot()
+    
+    def route_post(self):
+        """Dispatch a POST request"""
+        parsed_path = self.parse_dataset_path()
+        
+        if parsed_path is None:
+            return
+        elif parsed_path.path == '/api/query':
+            self.handle_query_post()
+        else:
+            self.send_error(404)
+    
+    def parse_dataset_path(self):
         """
+        Pick the request's dataset from a /d/<dataset>/ prefix or the
+        X-Fetii-Dataset header (else the default dataset)
         
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-        self.wfile.write(html_content.encode())
+        Returns:
+            The parsed URL with the prefix removed, or None if a redirect or
+            404 was sent instead
+        """
+        parsed_path = urlparse(self.path)
+        self.dataset = self.headers.get(DATASET_HEADER) or DEFAULT_DATASET
+        self.dataset_prefix = ""
+        match = re.match(r"^/d/([^/]+)(/.*)?$", parsed_path.path)
+        if match:
+            if match.group(2) is None:
+                # The page fetches relative API paths, which need the slash
+                self.send_response(301)
+                self.send_header("Location", parsed_path._replace(path=parsed_path.path + "/").geturl())
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            self.dataset = match.group(1)
+            self.dataset_prefix = f"/d/{self.dataset}"
+            parsed_path = parsed_path._replace(path=match.group(2))
+        if self.dataset not in _pool.datasets:
+            self.send_json_response({"success": False, "error": f"Unknown dataset: {self.dataset}"}, 404)
+            return None
+        return parsed_path
+    
+    def serve_html(self):
+        """Serve the main HTML page (pre-rendered and pre-compressed)"""
+        issued = str(int(time.time()))
+        cookie = f"{WEB_COOKIE}={issued}.{self.sign_web_session(issued)}"
+        send_static(self, INDEX_ASSET, headers={
+            "Set-Cookie": f"{cookie}; Max-Age={WEB_COOKIE_MAX_AGE}; Path=/; HttpOnly; SameSite=Strict"
+        })
     
     def handle_query(self):
         """Handle GET query requests"""
         parsed_path = urlparse(self.path)
         query_params = parse_qs(parsed_path.query)
         question = query_params.get('q', [''])[0]
+        approximate = query_params.get('approximate', ['0'])[0].lower() in ('1', 'true', 'yes')
+        return_results = query_params.get('results', ['0'])[0].lower() in ('1', 'true', 'yes')
         
         if not question:
             self.send_error(400, "Missing question parameter")
             return
         
-        result = self.get_chatbot().process_query(question)
-        self.send_json_response(result)
+        self.send_query_result(question, approximate, return_results)
     
     def handle_query_post(self):
         """Handle POST query requests"""
@@ -487,23 +776,114 @@ class LangChainChatbotHandler(BaseHTTPRequestHandler):
         try:
             data = json.loads(post_data.decode('utf-8'))
             question = data.get('question', '')
+            approximate = bool(data.get('approximate', False))
+            return_results = bool(data.get('return_results', False))
             
             if not question:
                 self.send_error(400, "Missing question")
                 return
             
-            result = self.get_chatbot().process_query(question)
-            self.send_json_response(result)
+            self.send_query_result(question, approximate, return_results)
             
         except json.JSONDecodeError:
             self.send_error(400, "Invalid JSON")
     
+    def get_client_key(self):
+        """
+        Identify the client for rate limiting: an allow-listed API key, else
+        the peer IP (or the client IP a trusted proxy forwarded)
+        """
+        api_key = self.headers.get('X-API-Key')
+        if api_key and api_key in API_KEYS:
+            return f"key:{api_key}"
+        peer = self.client_address[0]
+        forwarded = self.headers.get('X-Forwarded-For')
+        if forwarded and peer in TRUSTED_PROXIES:
+            # Proxies append; the last hop not added by a trusted proxy is the client
+            hops = [hop.strip() for hop in forwarded.split(',') if hop.strip()]
+            for hop in reversed(hops):
+                if hop not in TRUSTED_PROXIES:
+                    return f"ip:{hop}"
+            if hops:
+                return f"ip:{hops[0]}"
+        return f"ip:{peer}"
+    
+    def sign_web_session(self, issued):
+        """Sign a web session cookie issued at a time for this client"""
+        message = f"{self.get_client_key()}|{issued}".encode()
+        return hmac.new(_web_secret, message, hashlib.sha256).hexdigest()
+    
+    def has_web_session(self):
+        """Whether the request carries a current web session cookie signed for this client"""
+        for part in self.headers.get('Cookie', '').split(';'):
+            name, _, value = part.strip().partition('=')
+            if name != WEB_COOKIE:
+                continue
+            issued, _, signature = value.partition('.')
+            if not issued.isdigit() or time.time() - int(issued) > WEB_COOKIE_MAX_AGE:
+                return False
+            return hmac.compare_digest(signature, self.sign_web_session(issued))
+        return False
+    
+    def send_query_result(self, question, approximate=False, return_results=False):
+        """Schedule a query and send its result, or a 429/503 if it was rejected"""
+        try:
+            result = self.run_query(question, approximate, return_results)
+        except QueryCancelled as e:
+            # Cancelled while queued; the client has gone, so nothing is sent
+            print(f"🛑 {e} (while queued)")
+            self.close_connection = True
+            return
+        except SchedulerRejected as e:
+            send_json(
+                self,
+                {"success": False, "error": str(e), "retry_after": round(e.retry_after, 1)},
+                e.status,
+                headers={"Retry-After": str(max(1, int(e.retry_after + 0.5)))}
+            )
+            return
+        handle = result.get("results")
+        if handle and handle.get("result_id"):
+            handle["url"] = f"{self.dataset_prefix}/api/results/{handle['result_id']}"
+        self.send_json_response(result)
+    
+    def run_query(self, question, approximate=False, return_results=False):
+        """Run a query under a deadline, cancelling it if the client disconnects"""
+        timeout = float(os.environ.get('FETII_QUERY_TIMEOUT', 90))
+        requested = self.headers.get('X-Request-Timeout')
+        if requested:
+            try:
+                timeout = min(timeout, float(requested))
+            except ValueError:
+                pass
+        deadline = Deadline(timeout)
+        done = threading.Event()
+        threading.Thread(
+            target=watch_client_disconnect,
+            args=(self.connection, deadline, done),
+            daemon=True
+        ).start()
+        chatbot = self.get_chatbot()
+        priority = PRIORITY_INTERACTIVE if self.has_web_session() else PRIORITY_API
+        try:
+            return _scheduler.submit(
+                self.get_client_key(),
+                lambda: chatbot.process_query(
+                    question, deadline=deadline, approximate=approximate, return_results=return_results
+                ),
+                lambda: chatbot.has_cached_answer(question, approximate),
+                priority=priority,
+                deadline=deadline
+            )
+        finally:
+            done.set()
+    
     def handle_info(self):
         """Handle database info requests"""
         try:
             chatbot = self.get_chatbot()
             info = chatbot.get_database_info()
-            result = {"success": True, "info": info}
+            result = {"success": True, "dataset": self.dataset, "info": info}
             self.send_json_response(result)
         except Exception as e:
             result = {"success": False, "error": str(e)}
@@ -512,9 +892,8 @@ class LangChainChatbotHandler(BaseHTTPRequestHandler):
     def handle_samples(self):
         """Handle sample questions requests"""
         try:
-            chatbot = self.get_chatbot()
-            samples = chatbot.get_sample_questions()
-            result = {"success": True, "sample_questions": samples}
+            # Served without the chatbot so it works while the agent is built
+            result = {"success": True, "sample_questions": list(SAMPLE_QUESTIONS)}
             self.send_json_response(result)
         except Exception as e:
             result = {"success": False, "error": str(e)}
@@ -525,45 +904,237 @@ class LangChainChatbotHandler(BaseHTTPRequestHandler):
         try:
             chatbot = self.get_chatbot()
             analytics = chatbot.get_query_analytics()
+            analytics["scheduler"] = _scheduler.get_stats()
+            analytics["pool"] = _pool.get_stats()
+            tile_store = _tile_stores.get(self.dataset)
+            analytics["tiles"] = tile_store.get_stats() if tile_store else {}
             result = {"success": True, "analytics": analytics}
             self.send_json_response(result)
         except Exception as e:
             result = {"success": False, "error": str(e)}
             self.send_json_response(result)
     
+    def handle_trace(self, parsed_path):
+        """Handle query trace requests (?format=chrome for Chrome trace JSON)"""
+        trace_id = parsed_path.path[len('/api/trace/'):]
+        chrome = parse_qs(parsed_path.query).get('format', [''])[0] == 'chrome'
+        try:
+            trace = self.get_chatbot().get_trace(trace_id, chrome=chrome)
+            if trace is None:
+                self.send_json_response({"success": False, "error": "Unknown trace id"}, 404)
+            elif chrome:
+                self.send_json_response(trace)
+            else:
+                self.send_json_response({"success": True, "trace": trace})
+        except Exception as e:
+            self.send_json_response({"success": False, "error": str(e)}, 500)
+    
+    def handle_results(self, parsed_path):
+        """
+        Stream a materialized result set
+        
+        Query parameters: format (csv, ndjson or columnar; default ndjson),
+        cursor (row number to continue after) and limit (rows to return).
+        The next cursor is sent in the X-Next-Cursor header.
+        """
+        result_id = parsed_path.path[len('/api/results/'):]
+        params = parse_qs(parsed_path.query)
+        fmt = params.get('format', ['ndjson'])[0]
+        if fmt not in RESULT_FORMATS:
+            self.send_json_response(
+                {"success": False, "error": f"format must be one of {', '.join(RESULT_FORMATS)}"}, 400
+            )
+            return
+        try:
+            cursor = max(0, int(params.get('cursor', ['0'])[0]))
+            limit = int(params['limit'][0]) if 'limit' in params else None
+        except ValueError:
+            self.send_json_response({"success": False, "error": "cursor and limit must be integers"}, 400)
+            return
+        
+        store = self.get_chatbot().result_store
+        meta = store.get(result_id)
+        if meta is None:
+            self.send_json_response({"success": False, "error": "Unknown or expired result id"}, 404)
+            return
+        
+        headers = {
+            "X-Result-Rows": str(meta["row_count"]),
+            "X-Result-Truncated": str(meta["truncated"]).lower()
+        }
+        # Row numbers are dense, so the next cursor is known before streaming
+        if limit is not None and cursor + limit < meta["row_count"]:
+            headers["X-Next-Cursor"] = str(cursor + limit)
+        pages = store.iter_pages(result_id, after=cursor, limit=limit)
+        send_chunked(self, encode_pages(pages, meta["columns"], fmt), RESULT_FORMATS[fmt], headers)
+    
+    def handle_tile(self, parsed_path):
+        """
+        Serve a density tile: /api/tiles/<pickup|dropoff>/<z>/<x>/<y>.<bin|json>
+        
+        Query parameters hour, day_of_week and is_weekend filter the trips.
+        Tiles are cached until the database changes and revalidated by ETag.
+        """
+        match = re.match(r"^/api/tiles/([a-z]+)/(\d+)/(\d+)/(\d+)\.([a-z]+)$", parsed_path.path)
+        if not match or match.group(5) not in TILE_FORMATS:
+            self.send_json_response(
+                {"success": False, "error": "Expected /api/tiles/<kind>/<z>/<x>/<y>.<bin|json>"}, 404
+            )
+            return
+        kind, fmt = match.group(1), match.group(5)
+        z, x, y = (int(value) for value in match.group(2, 3, 4))
+        try:
+            filters = parse_filters(parse_qs(parsed_path.query))
+            data = get_tile_store(self.dataset).get_tile(kind, z, x, y, filters)
+        except ValueError as e:
+            self.send_json_response({"success": False, "error": str(e)}, 400)
+            return
+        except Exception as e:
+            self.send_json_response({"success": False, "error": str(e)}, 500)
+            return
+        if fmt == "json":
+            data = tile_to_json(data, kind, z, x, y, filters)
+        # Short max-age: the URL stays the same when the data is reloaded
+        send_cacheable(self, data, TILE_FORMATS[fmt], cache_control="public, max-age=60")
+    
+    def handle_debug_memory(self, parsed_path):
+        """
+        Memory report: RSS history, limits and watchdog actions, plus top
+        allocators and snapshot diffs when FETII_TRACEMALLOC_FRAMES is set
+        (?snapshot=1 takes a fresh snapshot, ?top=N sets the row count)
+        
+        Disabled unless FETII_DEBUG_TOKEN is set; requests must send it as
+        "Authorization: Bearer <token>".
+        """
+        authorization = self.headers.get('Authorization', '')
+        if not DEBUG_TOKEN or not hmac.compare_digest(authorization, f"Bearer {DEBUG_TOKEN}"):
+            self.send_error(404)
+            return
+        params = parse_qs(parsed_path.query)
+        try:
+            top_n = int(params.get('top', ['20'])[0])
+        except ValueError:
+            top_n = 20
+        snapshot = params.get('snapshot', ['0'])[0].lower() in ('1', 'true', 'yes')
+        watchdog = _watchdog or MemoryWatchdog()
+        if snapshot:
+            retry_after = watchdog.reserve_snapshot()
+            if retry_after:
+                send_json(
+                    self,
+                    {"success": False, "error": "A snapshot was taken recently", "retry_after": round(retry_after, 1)},
+                    429,
+                    headers={"Retry-After": str(max(1, int(retry_after + 0.5)))}
+                )
+                return
+        report = watchdog.get_report(top_n=top_n, snapshot=snapshot)
+        # Accounted memory and structure sizes per built dataset
+        report["pool"] = _pool.get_stats()
+        self.send_json_response({"success": True, "memory": report})
+    
+    def handle_healthz(self):
+        """Liveness probe: the process is up, with its warmup state"""
+        self.send_json_response({
+            "alive": True,
+            "warmup": _warmup_state.to_dict(),
+            "startup": dict(_startup_timings)
+        })
+    
+    def handle_readyz(self):
+        """Readiness probe: 200 once warm, 503 while still warming up"""
+        status = 200 if _warmup_state.is_ready() else 503
+        self.send_json_response({
+            "ready": _warmup_state.is_ready(),
+            "warmup": _warmup_state.to_dict(),
+            "startup": dict(_startup_timings)
+        }, status)
+    
     def get_chatbot(self):
-        """Get or create chatbot instance"""
-        if self.chatbot is None:
-            db_path = "data/database/fetiipro.db"
-            openai_api_key = os.getenv("OPENAI_API_KEY")
-            
-            if not openai_api_key:
-                raise ValueError("OPENAI_API_KEY environment variable not set")
-            
-            self.chatbot = FetiiProLangChainChatbot(db_path, openai_api_key)
-        return self.chatbot
+        """
+        Get or create the shared chatbot instance of the request's dataset,
+        held until the request ends so eviction cannot close it mid-request
+        """
+        chatbot = getattr(self, "chatbot", None)
+        if chatbot is None:
+            get_chatbot_class()
+            chatbot = self.chatbot = _pool.acquire(self.dataset)
+        return chatbot
     
-    def send_json_response(self, data):
-        """Send JSON response"""
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+    def release_chatbot(self):
+        """Release the chatbot held by this request (handlers are reused across keep-alive requests)"""
+        chatbot, self.chatbot = getattr(self, "chatbot", None), None
+        if chatbot is not None:
+            _pool.release(chatbot)
+    
+    def send_json_response(self, data, status=200):
+        """Send JSON response (compressed when large)"""
+        send_json(self, data, status)
+
+def start_background_tasks(worker_index=0):
+    """Start warmup or the chatbot build (and, in the first worker, the cache refresher)"""
+    start_memory_watchdog()
+    # Warm up in the background so the port is bound immediately; /readyz
+    # reports 503 until the chatbot is built and common questions are cached
+    if os.environ.get('FETII_WARMUP', '1') != '0':
+        top_n = int(os.environ.get('FETII_WARMUP_TOP_N', 10))
+        # With a shared answer cache only the first worker pre-answers questions
+        answer_questions = worker_index == 0 or _shared_store is None
+        threading.Thread(
+            target=warm_up,
+            args=(get_shared_chatbot, _warmup_state, top_n, answer_questions),
+            name="warmup",
+            daemon=True
+        ).start()
+        if answer_questions:
+            # Refreshes the default dataset while it is in the pool
+            CacheRefresher(
+                lambda: _pool.peek(DEFAULT_DATASET),
+                interval=float(os.environ.get('FETII_REFRESH_INTERVAL', 30))
+            ).start()
+    else:
+        _warmup_state.update(status="warm")
+        build_chatbot_in_background()
 
-def run_server(port=None):
+def start_worker(worker_index):
+    """Prefork worker entry point"""
+    global _prefork_worker
+    _prefork_worker = True
+    start_background_tasks(worker_index)
+
+def run_server(port=None, workers=None):
     """Run the LangChain web server"""
+    global _shared_store, _httpd
     # Use environment port for cloud deployment, fallback to 8082
     port = port or int(os.environ.get('PORT', 8082))
+    workers = workers or int(os.environ.get('FETII_WORKERS', 1))
+    if workers > 1 and not hasattr(os, 'fork'):
+        print("⚠️ Multi-worker mode needs os.fork(); running a single process")
+        workers = 1
+    
+    # Workers share answers and analytics through a WAL SQLite file
+    shared_cache_path = os.environ.get('FETII_SHARED_CACHE')
+    if workers > 1 or shared_cache_path:
+        _shared_store = open_shared_store(shared_cache_path or "data/database/shared_cache.db")
+    
     server_address = ('0.0.0.0', port)  # Allow external connections
-    httpd = HTTPServer(server_address, LangChainChatbotHandler)
+    httpd = _httpd = ThreadingHTTPServer(server_address, LangChainChatbotHandler)
+    _startup_timings["bind"] = time.time() - _process_started
+    
     print(f"🚗 FetiiPro LangChain SQL Chatbot Web Server")
     print(f"🌐 Server running at: http://localhost:{port}")
     print(f"🌍 External access: http://[YOUR_IP]:{port}")
-    print(f"📊 Database: data/database/fetiipro.db")
+    print(f"📊 Datasets: " + ", ".join(f"{name} ({dataset.db_path})" for name, dataset in _pool.datasets.items()))
     print(f"🤖 Powered by: LangChain + OpenAI GPT-4")
     print(f"💡 Ask natural language questions about your ride-sharing data!")
+    print(f"⚡ Port bound in {_startup_timings['bind']:.2f}s; the agent is built in the background")
     print(f"🔄 Press Ctrl+C to stop the server")
     
+    if workers > 1:
+        # The chatbot is built after fork in each worker
+        serve_prefork(httpd, workers, start_worker, drain_worker)
+        return
+    
+    start_background_tasks()
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
@@ -0,0 +1,192 @@
+"""
+In-memory read replica of the FetiiPro database
+Copies the database file into a shared-cache memory database with the SQLite
+backup API, watches the file version and swaps in a fresh copy on change
+"""
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from answer_cache import get_db_version
+from sql_validator import connect_readonly
+
+# Distinguishes replicas of several chatbots in one process
+_replica_ids = itertools.count(1)
+
+
+class ReplicaClosed(RuntimeError):
+    """Raised when connecting to a replica that has been closed"""
+
+
+class ReplicaConnection(sqlite3.Connection):
+    """sqlite3 connection that remembers which replica generation it reads"""
+
+    generation = 0
+
+
+class MemoryReplica:
+    """
+    Read-only in-memory copy of a SQLite database file.
+    Each reload builds a new, separately named memory database in the
+    background and then switches new connections to it in one assignment.
+    Queries already running keep reading the previous copy, which SQLite
+    frees once its last connection closes.
+    """
+
+    def __init__(self, db_path: str, poll_interval: float = 5.0, grace_period: float = 60.0):
+        """
+        Initialize the replica and load the first copy
+
+        Args:
+            db_path: Path to the SQLite database file
+            poll_interval: Seconds between file version checks
+            grace_period: Seconds the previous copy is kept open after a swap,
+                so connections opened just before the swap still find it
+
+        Raises:
+            FileNotFoundError: If the database file does not exist
+        """
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.grace_period = grace_period
+        self.version = None
+        self.stats = {"loads": 0, "failed_loads": 0, "last_load_seconds": 0.0, "size_mb": 0.0}
+        self._replica_id = next(_replica_ids)
+        # (generation, uri) of the current copy, replaced in one assignment
+        self._current = (0, None)
+        self._anchor = None
+        self._closed = False
+        self._on_swap: List[Callable[[], None]] = []
+        self._load_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        if get_db_version(db_path) is None:
+            raise FileNotFoundError(f"Database not found: {db_path}")
+        self.load()
+
+    @property
+    def generation(self) -> int:
+        return self._current[0]
+
+    def load(self) -> bool:
+        """
+        Copy the database file into a new memory database and swap it in
+
+        Returns:
+            True if a new copy was swapped in, False if the file is missing
+        """
+        with self._load_lock:
+            if self._closed:
+                return False
+            # Read the version before copying: if the file is replaced during
+            # the copy, the next check sees a newer version and reloads again
+            version = get_db_version(self.db_path)
+            if version is None:
+                return False
+            start_time = time.time()
+            generation = self.generation + 1
+            uri = f"file:fetii_replica_{os.getpid()}_{self._replica_id}_{generation}?mode=memory&cache=shared"
+            # The anchor connection keeps the memory database alive
+            anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            try:
+                source = connect_readonly(self.db_path)
+                try:
+                    source.backup(anchor)
+                finally:
+                    source.close()
+                page_count = anchor.execute("PRAGMA page_count").fetchone()[0]
+                page_size = anchor.execute("PRAGMA page_size").fetchone()[0]
+            except Exception:
+                anchor.close()
+                raise
+
+            previous = self._anchor
+            self._anchor = anchor
+            self._current = (generation, uri)
+            self.version = version
+            self.stats["loads"] += 1
+            self.stats["last_load_seconds"] = time.time() - start_time
+            self.stats["size_mb"] = page_count * page_size / (1024 * 1024)
+
+        if previous is not None:
+            timer = threading.Timer(self.grace_period, previous.close)
+            timer.daemon = True
+            timer.start()
+        for callback in self._on_swap:
+            callback()
+        print(f"🧠 Loaded in-memory replica #{generation} of {self.db_path} "
+              f"({self.stats['size_mb']:.1f} MB in {self.stats['last_load_seconds']:.2f}s)")
+        return True
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open a read-only connection to the current copy
+
+        Raises:
+            ReplicaClosed: If the replica has been closed
+        """
+        if self._closed:
+            raise ReplicaClosed(f"In-memory replica of {self.db_path} is closed")
+        generation, uri = self._current
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, factory=ReplicaConnection)
+        conn.generation = generation
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def on_swap(self, callback: Callable[[], None]):
+        """Register a callback run after each new copy is swapped in"""
+        self._on_swap.append(callback)
+
+    def attach_to_engine(self, engine):
+        """Make a SQLAlchemy engine drop pooled connections to previous copies"""
+        from sqlalchemy import event, exc
+
+        @event.listens_for(engine, "checkout")
+        def _check_generation(dbapi_connection, connection_record, connection_proxy):
+            if getattr(dbapi_connection, "generation", self.generation) != self.generation:
+                # The pool discards the connection and retries with a new one
+                raise exc.DisconnectionError("In-memory replica was swapped")
+
+    def start(self):
+        """Watch the database file in a daemon thread"""
+        self._thread = threading.Thread(target=self._run, name="replica-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching"""
+        self._stop.set()
+
+    def close(self):
+        """
+        Stop watching and free the current copy
+
+        Connections already open keep reading it (SQLite frees a shared-cache
+        memory database with its last connection); new connections raise
+        ReplicaClosed instead of silently opening an empty database.
+        """
+        self.stop()
+        with self._load_lock:
+            anchor, self._anchor = self._anchor, None
+            self._closed = True
+        if anchor is not None:
+            anchor.close()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            current = get_db_version(self.db_path)
+            if current is None or current == self.version:
+                continue
+            try:
+                self.load()
+            except Exception as e:
+                # Keep serving the current copy; the next check retries
+                self.stats["failed_loads"] += 1
+                print(f"⚠️ Could not reload the in-memory replica: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get replica statistics"""
+        return dict(self.stats, generation=self.generation, version=self.version)
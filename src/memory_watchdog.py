@@ -0,0 +1,232 @@
+"""
+Memory watchdog for the FetiiPro web app
+Samples RSS (and optionally tracemalloc snapshots) in the background, trims
+caches past a soft limit and recycles the worker past a hard limit
+"""
+import gc
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+# psutil is optional; /proc and resource are used without it
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def get_rss_mb() -> Optional[float]:
+    """Current resident set size of this process in MB (None if unknown)"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    try:
+        with open("/proc/self/statm", "r") as file:
+            pages = int(file.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # Peak rather than current RSS; kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if peak > 1 << 32 else peak / 1024
+    except ImportError:
+        return None
+
+
+def format_stats(stats: List[tracemalloc.StatisticDiff], limit: int) -> List[Dict[str, Any]]:
+    """Turn tracemalloc statistics (or diffs) into JSON-serializable rows"""
+    rows = []
+    for stat in stats:
+        if len(rows) >= limit:
+            break
+        frame = stat.traceback[0]
+        # Skip the snapshots' own bookkeeping
+        if frame.filename == tracemalloc.__file__:
+            continue
+        row = {
+            "location": f"{frame.filename}:{frame.lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count
+        }
+        if hasattr(stat, "size_diff"):
+            row["size_diff_kb"] = round(stat.size_diff / 1024, 1)
+            row["count_diff"] = stat.count_diff
+        rows.append(row)
+    return rows
+
+
+class MemoryWatchdog:
+    """
+    Background thread that watches this process's memory.
+    Past the soft limit on_soft_limit is called (at most once per cooldown)
+    to release caches; past the hard limit on_hard_limit is called once to
+    recycle the process.
+    """
+
+    def __init__(self, soft_limit_mb: Optional[float] = None, hard_limit_mb: Optional[float] = None,
+                 interval: float = 30.0, trace_frames: int = 0,
+                 on_soft_limit: Optional[Callable[[], Dict[str, Any]]] = None,
+                 on_hard_limit: Optional[Callable[[], None]] = None,
+                 cooldown: float = 300.0, history_size: int = 120, snapshot_interval: float = 300.0,
+                 min_request_interval: float = 60.0):
+        """
+        Initialize the watchdog
+
+        Args:
+            soft_limit_mb: RSS above which caches are trimmed (None disables)
+            hard_limit_mb: RSS above which the process is recycled (None disables)
+            interval: Seconds between samples
+            trace_frames: Frames kept per tracemalloc allocation; 0 leaves
+                tracemalloc off, since tracing slows every allocation
+            on_soft_limit: Releases memory and returns a summary of what it freed
+            on_hard_limit: Recycles the process
+            cooldown: Minimum seconds between soft-limit trims
+            history_size: RSS samples kept for the report
+            snapshot_interval: Seconds between background tracemalloc
+                snapshots; they are cheap to take but not to analyze, so
+                statistics are only computed when the report is requested
+            min_request_interval: Minimum seconds between snapshots taken on
+                request, since each report with a fresh one costs seconds of CPU
+        """
+        self.soft_limit_mb = soft_limit_mb
+        self.hard_limit_mb = hard_limit_mb
+        self.interval = interval
+        self.trace_frames = trace_frames
+        self.on_soft_limit = on_soft_limit
+        self.on_hard_limit = on_hard_limit
+        self.cooldown = cooldown
+        self.snapshot_interval = snapshot_interval
+        self.history = deque(maxlen=history_size)
+        self.actions = deque(maxlen=20)
+        self.stats = {"samples": 0, "soft_limit_trims": 0, "hard_limit_hits": 0}
+        self._snapshots = deque(maxlen=2)
+        self._last_snapshot = 0.0
+        self.min_request_interval = min_request_interval
+        self._last_requested_snapshot = 0.0
+        self._last_trim = 0.0
+        self._recycling = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling in a daemon thread"""
+        if self.trace_frames and not tracemalloc.is_tracing():
+            tracemalloc.start(self.trace_frames)
+        self._thread = threading.Thread(target=self._run, name="memory-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling"""
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"⚠️ Memory watchdog check failed: {e}")
+
+    def take_snapshot(self):
+        """Take a tracemalloc snapshot (kept for diffs) if tracing is on"""
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot()
+        with self._lock:
+            self._last_snapshot = time.time()
+            self._snapshots.append((self._last_snapshot, snapshot))
+        return snapshot
+
+    def reserve_snapshot(self) -> float:
+        """
+        Reserve a snapshot taken on request
+
+        Returns:
+            0 if one may be taken now, otherwise seconds until one may be
+        """
+        with self._lock:
+            wait = self.min_request_interval - (time.time() - self._last_requested_snapshot)
+            if wait > 0:
+                return wait
+            self._last_requested_snapshot = time.time()
+            return 0.0
+
+    def check(self) -> Optional[float]:
+        """Sample memory once and act on the limits"""
+        rss = get_rss_mb()
+        if time.time() - self._last_snapshot >= self.snapshot_interval:
+            self.take_snapshot()
+        with self._lock:
+            self.stats["samples"] += 1
+            self.history.append((round(time.time(), 1), round(rss, 1) if rss is not None else None))
+        if rss is None:
+            return None
+
+        if self.hard_limit_mb and rss >= self.hard_limit_mb and not self._recycling:
+            self._recycling = True
+            self._record("hard_limit", rss)
+            print(f"🧯 RSS {rss:.0f} MB over the hard limit of {self.hard_limit_mb:.0f} MB, recycling")
+            if self.on_hard_limit:
+                self.on_hard_limit()
+        elif self.soft_limit_mb and rss >= self.soft_limit_mb and time.time() - self._last_trim >= self.cooldown:
+            self._last_trim = time.time()
+            freed = self.on_soft_limit() if self.on_soft_limit else {}
+            gc.collect()
+            after = get_rss_mb()
+            self._record("soft_limit", rss, after=after, freed=freed)
+            print(f"🧹 RSS {rss:.0f} MB over the soft limit of {self.soft_limit_mb:.0f} MB, "
+                  f"trimmed caches (now {after:.0f} MB)")
+        return rss
+
+    def _record(self, action: str, rss: float, **details):
+        key = "hard_limit_hits" if action == "hard_limit" else "soft_limit_trims"
+        with self._lock:
+            self.stats[key] += 1
+            self.actions.append(dict(details, action=action, rss_mb=round(rss, 1), time=time.time()))
+
+    def get_report(self, top_n: int = 20, snapshot: bool = False) -> Dict[str, Any]:
+        """
+        Get the memory report served at /api/debug/memory
+
+        Args:
+            top_n: Number of top allocation sites to include
+            snapshot: Take a fresh tracemalloc snapshot first, so the diff
+                covers the time since the previous one
+
+        Returns:
+            RSS, limits, recent samples and actions, and (while tracemalloc is
+            on) the top allocators and the diff between the last two snapshots
+        """
+        if snapshot:
+            self.take_snapshot()
+        with self._lock:
+            report = {
+                "pid": os.getpid(),
+                "rss_mb": get_rss_mb(),
+                "soft_limit_mb": self.soft_limit_mb,
+                "hard_limit_mb": self.hard_limit_mb,
+                "stats": dict(self.stats),
+                "history": list(self.history),
+                "actions": list(self.actions),
+                "gc_counts": gc.get_count(),
+                "tracemalloc": {"tracing": tracemalloc.is_tracing()}
+            }
+            snapshots = list(self._snapshots)
+
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            report["tracemalloc"].update(traced_mb=current / (1024 * 1024), peak_mb=peak / (1024 * 1024))
+        if snapshots:
+            taken_at, latest = snapshots[-1]
+            report["tracemalloc"]["snapshot_at"] = taken_at
+            report["tracemalloc"]["top"] = format_stats(latest.statistics("lineno"), top_n)
+        if len(snapshots) == 2:
+            report["tracemalloc"]["diff_seconds"] = snapshots[1][0] - snapshots[0][0]
+            report["tracemalloc"]["diff"] = format_stats(
+                snapshots[1][1].compare_to(snapshots[0][1], "lineno"), top_n
+            )
+        return report
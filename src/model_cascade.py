@@ -0,0 +1,266 @@
+"""
+Model cascade for the FetiiPro chatbot
+Answers with a fast, cheap model first and escalates to a stronger model
+only when the cheap answer fails local validation
+"""
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_community.callbacks import get_openai_callback
+
+from agent_callbacks import TracingCallbackHandler
+from deadlines import QueryCancelled
+
+# Refusals and non-answers; matched as phrases about the model itself so
+# answers merely containing e.g. "unable to" are not escalated
+REFUSAL_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"\bi (?:don['’]t|do not) know\b",
+    r"\bi(?:['’]m| am) not sure\b",
+    r"\bi(?:['’]m| am| was) (?:unable|not able) to (?:answer|determine|find|provide|access|run|execute|query|retrieve)\b",
+    r"\b(?:i|we) (?:cannot|can['’]t|could not|couldn['’]t) (?:answer|determine|find|provide|access|run|execute|retrieve)\b",
+    r"\b(?:cannot|can['’]t) (?:be )?determined?\b",
+    r"\bnot enough (?:information|data)\b",
+    r"^i(?:['’]m| am) sorry\b",
+    r"\bagent stopped due to\b"
+)]
+
+
+def get_executed_sql(result: Dict[str, Any]) -> Tuple[Optional[str], Any]:
+    """
+    Find the last SQL query the agent executed
+
+    Returns:
+        Tuple of (sql, observation), or (None, None) if no query was run
+    """
+    for action, observation in reversed(result.get("intermediate_steps", [])):
+        if getattr(action, "tool", None) == "sql_db_query":
+            tool_input = action.tool_input
+            if isinstance(tool_input, dict):
+                tool_input = tool_input.get("query", "")
+            return str(tool_input), observation
+    return None, None
+
+
+def get_default_tiers() -> List[Dict[str, Any]]:
+    """
+    Get the model tiers from the environment, cheapest first
+
+    FETII_FAST_MODEL sets the first-tier model (empty disables the tier),
+    FETII_STRONG_MODEL sets the escalation model.
+    """
+    tiers = []
+    fast_model = os.getenv("FETII_FAST_MODEL", "gpt-4o-mini")
+    strong_model = os.getenv("FETII_STRONG_MODEL", "gpt-4")
+
+    if fast_model and fast_model != strong_model:
+        tiers.append({"name": "fast", "model": fast_model, "request_timeout": 20})
+    tiers.append({"name": "strong", "model": strong_model, "request_timeout": 60})
+    return tiers
+
+
+class ModelCascade:
+    """
+    Runs an agent question through model tiers in order.
+    Each tier's run is checked locally (SQL validity, SQL errors, parsing
+    failures, low-confidence answers, figures not backed by a query); only
+    failed runs move to the next tier.
+    Only the answer returned is recorded in the conversation memory.
+    """
+
+    def __init__(self, build_agent: Callable[[str, int], Any], validator=None,
+                 tiers: Optional[List[Dict[str, Any]]] = None, memory=None):
+        """
+        Initialize the cascade
+
+        Args:
+            build_agent: Factory taking (model, request_timeout) and returning an AgentExecutor
+            validator: Optional SQLValidator used to check the executed SQL
+            tiers: Model tiers, cheapest first (defaults to get_default_tiers())
+            memory: Optional conversation memory shared by the tiers; the
+                agents must be built without it, since an executor with memory
+                would also record rejected attempts
+        """
+        self.build_agent = build_agent
+        self.memory = memory
+        self.validator = validator
+        self.tiers = tiers or get_default_tiers()
+        self._executors: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+        self.stats = {
+            "queries": 0,
+            "escalations": 0,
+            "tiers": {
+                tier["name"]: {
+                    "model": tier["model"],
+                    "attempts": 0,
+                    "accepted": 0,
+                    "failed": 0,
+                    "total_latency": 0.0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "total_cost": 0.0
+                }
+                for tier in self.tiers
+            }
+        }
+
+    def get_executor(self, tier: Dict[str, Any]):
+        """Get (building on first use) the agent executor for a tier"""
+        with self._lock:
+            executor = self._executors.get(tier["name"])
+            if executor is None:
+                executor = self.build_agent(tier["model"], tier["request_timeout"])
+                self._executors[tier["name"]] = executor
+            return executor
+
+    def run(self, inputs: Dict[str, Any], trace=None, callbacks: Optional[List[Any]] = None) -> Dict[str, Any]:
+        """
+        Run the inputs through the tiers until one produces an acceptable answer
+
+        Args:
+            inputs: Agent inputs (must contain "input")
+            trace: Optional QueryTrace receiving a span per tier attempt
+            callbacks: Extra LangChain callback handlers for the agent runs
+
+        Returns:
+            The accepted agent result, extended with "model", "tier", "tiers_tried"
+            and "token_usage" (summed over all tiers tried)
+        """
+        tiers_tried = []
+        token_usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "total_cost": 0.0}
+        last_error = None
+        last_result = None
+        last_tier = None
+
+        with self._lock:
+            self.stats["queries"] += 1
+        if self.memory is not None:
+            inputs = dict(self.memory.load_memory_variables(inputs), **inputs)
+
+        for index, tier in enumerate(self.tiers):
+            is_last = index == len(self.tiers) - 1
+            tier_stats = self.stats["tiers"][tier["name"]]
+            tiers_tried.append(tier["name"])
+            start_time = time.time()
+
+            run_callbacks = list(callbacks or [])
+            tier_span = None
+            if trace is not None:
+                tier_span = trace.start_span(f"tier:{tier['name']}", "tier", model=tier["model"])
+                run_callbacks.append(TracingCallbackHandler(trace, tier_span))
+
+            try:
+                with get_openai_callback() as usage:
+                    result = self.get_executor(tier).invoke(inputs, config={"callbacks": run_callbacks})
+                problems = self.check_result(result)
+                last_error = None
+            except QueryCancelled:
+                # Cancelled runs are never escalated to a more expensive tier
+                if tier_span is not None:
+                    trace.end_span(tier_span, cancelled=True)
+                raise
+            except Exception as e:
+                usage = None
+                result = None
+                problems = [f"{type(e).__name__}: {e}"]
+                last_error = e
+
+            if usage is not None:
+                for key in token_usage:
+                    token_usage[key] += getattr(usage, key)
+
+            with self._lock:
+                tier_stats["attempts"] += 1
+                tier_stats["total_latency"] += time.time() - start_time
+                if usage is not None:
+                    tier_stats["prompt_tokens"] += usage.prompt_tokens
+                    tier_stats["completion_tokens"] += usage.completion_tokens
+                    tier_stats["total_cost"] += usage.total_cost
+                if problems:
+                    tier_stats["failed"] += 1
+                    if not is_last:
+                        self.stats["escalations"] += 1
+                else:
+                    tier_stats["accepted"] += 1
+
+            if tier_span is not None:
+                trace.end_span(
+                    tier_span,
+                    accepted=not problems,
+                    problems=problems,
+                    total_tokens=usage.total_tokens if usage is not None else 0
+                )
+
+            if result is not None:
+                last_result = result
+                last_tier = tier
+            if not problems:
+                break
+            if not is_last:
+                print(f"⬆️ Escalating from {tier['model']}: {'; '.join(problems)}")
+
+        if last_error is not None and last_result is None:
+            raise last_error
+
+        if self.memory is not None:
+            self.memory.save_context({"input": inputs["input"]}, {"output": last_result.get("output", "")})
+        result = dict(last_result)
+        result["model"] = last_tier["model"]
+        result["tier"] = last_tier["name"]
+        result["tiers_tried"] = tiers_tried
+        result["validation_problems"] = problems
+        result["token_usage"] = token_usage
+        return result
+
+    def check_result(self, result: Dict[str, Any]) -> List[str]:
+        """
+        Validate an agent run locally
+
+        Returns:
+            List of problems; empty if the answer is acceptable
+        """
+        problems = []
+        output = (result.get("output") or "").strip()
+        if not output:
+            problems.append("empty answer")
+        elif any(pattern.search(output) for pattern in REFUSAL_PATTERNS):
+            problems.append("low-confidence answer")
+
+        sql, observation = get_executed_sql(result)
+        if sql is None:
+            # Schema and conversational answers need no query; figures do
+            if re.search(r"\d", output):
+                problems.append("answer quotes figures but no SQL was executed")
+            return problems
+
+        if str(observation).startswith("Error"):
+            problems.append("final SQL query failed")
+        elif self.validator is not None:
+            validation = self.validator.validate(sql)
+            if not validation["valid"]:
+                problems.append("final SQL query is invalid")
+        return problems
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get per-tier latency, token and escalation statistics"""
+        with self._lock:
+            queries = self.stats["queries"]
+            tiers = {}
+            for name, tier_stats in self.stats["tiers"].items():
+                attempts = tier_stats["attempts"]
+                tiers[name] = dict(tier_stats)
+                tiers[name]["avg_latency"] = tier_stats["total_latency"] / attempts if attempts else 0
+                tiers[name]["avg_tokens"] = (
+                    (tier_stats["prompt_tokens"] + tier_stats["completion_tokens"]) / attempts
+                    if attempts else 0
+                )
+            return {
+                "queries": queries,
+                "escalations": self.stats["escalations"],
+                "escalation_rate": self.stats["escalations"] / queries if queries else 0,
+                "tiers": tiers
+            }
@@ -0,0 +1,708 @@
+"""
+Time-partitioned storage for the FetiiPro database
+Moves trips and riders into one SQLite file per month, serves them back as
+views over the attached files and prunes each query to the months its date
+predicates can match
+"""
+import argparse
+import os
+import re
+import sqlite3
+import stat
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from answer_cache import get_db_version
+from sql_validator import ALIAS_STOPWORDS
+
+PARTITIONED_TABLES = ("trips", "riders")
+CATALOG_TABLE = "trip_partitions"
+
+# Rows that cannot be dated (trips without a date, riders whose trip is
+# unknown) go to a partition that is never pruned
+UNDATED = "undated"
+
+# SQLite's default (and in most builds, maximum) number of attached databases
+MAX_ATTACHED = 10
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_TABLE_REF = re.compile(
+    r"\b(FROM|JOIN)\s+(trips|riders)\b(?:(\s+(?:AS\s+)?)([A-Za-z_]\w*))?",
+    re.IGNORECASE
+)
+# The optional group captures the table or alias qualifying the column
+_DATE_COLUMN = r"(?:\b(\w+)\.)?\b(?:date|trip_datetime)\b"
+_DATE_LITERAL = r"'(\d{4}-\d{2}(?:-\d{2})?)[^']*'"
+_DATE_COMPARISON = re.compile(rf"{_DATE_COLUMN}\s*(=|>=|<=|>|<)\s*{_DATE_LITERAL}", re.IGNORECASE)
+_DATE_COMPARISON_REVERSED = re.compile(rf"{_DATE_LITERAL}\s*(=|>=|<=|>|<)\s*{_DATE_COLUMN}", re.IGNORECASE)
+_DATE_BETWEEN = re.compile(rf"{_DATE_COLUMN}\s+BETWEEN\s+{_DATE_LITERAL}\s+AND\s+{_DATE_LITERAL}", re.IGNORECASE)
+_DATE_LIKE = re.compile(rf"{_DATE_COLUMN}\s+LIKE\s+'(\d{{4}}-\d{{2}}(?:-\d{{2}})?)%'", re.IGNORECASE)
+_MONTH_EXPRESSION = re.compile(
+    rf"(?:strftime\s*\(\s*'%Y-%m'\s*,\s*{_DATE_COLUMN}\s*\)|substr\s*\(\s*{_DATE_COLUMN}\s*,\s*1\s*,\s*7\s*\))"
+    rf"\s*=\s*'(\d{{4}}-\d{{2}})'",
+    re.IGNORECASE
+)
+_MAIN_TABLE_REF = re.compile(r"\bmain\s*\.\s*(?:trips|riders)\b", re.IGNORECASE)
+_WHERE_TOKEN = re.compile(r"[()]|\b(?:WHERE|AND|OR|BETWEEN|GROUP|ORDER|LIMIT|HAVING|WINDOW)\b", re.IGNORECASE)
+_CLAUSE_END = {"GROUP", "ORDER", "LIMIT", "HAVING", "WINDOW"}
+_REVERSED_OPERATORS = {"=": "=", ">=": "<=", "<=": ">=", ">": "<", "<": ">"}
+
+
+def _copy_schema(conn: sqlite3.Connection, table: str, target: str):
+    """Create a table and its indexes in an attached database with the main DDL"""
+    rows = conn.execute(
+        "SELECT type, sql FROM main.sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL "
+        "ORDER BY type = 'index'", (table,)
+    ).fetchall()
+    for kind, sql in rows:
+        if kind == "table":
+            sql = re.sub(r"^CREATE TABLE\s+", f"CREATE TABLE {target}.", sql, flags=re.IGNORECASE)
+        else:
+            sql = re.sub(r"^CREATE (UNIQUE )?INDEX\s+", rf"CREATE \1INDEX {target}.", sql, flags=re.IGNORECASE)
+        conn.execute(sql)
+
+
+def group_months(months: List[str], max_groups: int) -> List[List[str]]:
+    """
+    Group months (YYYY-MM, ascending) into at most max_groups partitions
+
+    Recent months keep their own partition; when there are too many, the
+    oldest years are merged into one partition per year, and past that the
+    oldest years are merged together, so an unfiltered query never needs
+    more files than SQLite can attach.
+    """
+    groups = [[month] for month in months]
+    latest_year = months[-1][:4] if months else None
+    # Oldest full years first
+    for year in sorted({month[:4] for month in months if month[:4] != latest_year}):
+        if len(groups) <= max_groups:
+            break
+        merged = [month for group in groups for month in group if month[:4] == year]
+        rest = [group for group in groups if group[0][:4] != year]
+        groups = sorted(rest + [merged])
+    while len(groups) > max(1, max_groups):
+        groups = [groups[0] + groups[1]] + groups[2:]
+    return groups
+
+
+def _group_name(group: List[str]) -> str:
+    first, last = group[0], group[-1]
+    if first == last:
+        return first.replace("-", "_")
+    if first[:4] == last[:4]:
+        return first[:4]
+    return f"{first[:4]}_{last[:4]}"
+
+
+def partition_database(db_path: str, partition_dir: Optional[str] = None,
+                       max_partitions: int = MAX_ATTACHED) -> List[Dict[str, Any]]:
+    """
+    Move trips and riders into one SQLite file per month
+
+    The main database keeps empty trips and riders tables (with their
+    indexes) so the schema seen by the agent and the validator is unchanged,
+    plus a catalog of partition files and the date range each one covers.
+    Older months are merged by year as needed to stay within max_partitions.
+
+    Partition files are written to a new directory, so a server reading the
+    previous partitions is never affected; remove_stale_partitions deletes
+    old directories once the new database is in place.
+
+    Args:
+        db_path: Path to a fully built database
+        partition_dir: New directory for partition files (default: a
+            timestamped <db name>_partitions-* directory next to the database)
+        max_partitions: Partition files written at most
+
+    Returns:
+        The catalog entries
+
+    Raises:
+        FileExistsError: If partition_dir already contains files
+    """
+    db_path = Path(db_path)
+    if partition_dir is None:
+        partition_dir = db_path.with_name(f"{db_path.stem}_partitions-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}")
+    partition_dir = Path(partition_dir)
+    if partition_dir.exists() and any(partition_dir.iterdir()):
+        raise FileExistsError(f"Partition directory is not empty: {partition_dir}")
+    partition_dir.mkdir(parents=True, exist_ok=True)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        months = [
+            month for (month,) in conn.execute(
+                "SELECT DISTINCT substr(date, 1, 7) FROM trips WHERE date IS NOT NULL ORDER BY 1"
+            )
+        ]
+        undated = conn.execute(
+            "SELECT (SELECT COUNT(*) FROM trips WHERE date IS NULL) + "
+            "(SELECT COUNT(*) FROM riders r WHERE NOT EXISTS "
+            "(SELECT 1 FROM trips t WHERE t.trip_id = r.trip_id AND t.date IS NOT NULL))"
+        ).fetchone()[0]
+        groups = group_months(months, max_partitions - (1 if undated else 0))
+        if undated:
+            groups.append(None)
+
+        catalog = []
+        for group in groups:
+            name = _group_name(group) if group else UNDATED
+            path = partition_dir / f"trips_{name}.db"
+
+            conn.execute("ATTACH DATABASE ? AS part", (str(path),))
+            try:
+                conn.execute("BEGIN")
+                for table in PARTITIONED_TABLES:
+                    _copy_schema(conn, table, "part")
+                if group:
+                    placeholders = ", ".join("?" for _ in group)
+                    conn.execute(
+                        f"INSERT INTO part.trips SELECT * FROM main.trips WHERE substr(date, 1, 7) IN ({placeholders})",
+                        group
+                    )
+                    conn.execute(
+                        "INSERT INTO part.riders SELECT r.* FROM main.riders r JOIN main.trips t "
+                        f"ON t.trip_id = r.trip_id WHERE substr(t.date, 1, 7) IN ({placeholders})",
+                        group
+                    )
+                else:
+                    conn.execute("INSERT INTO part.trips SELECT * FROM main.trips WHERE date IS NULL")
+                    conn.execute(
+                        "INSERT INTO part.riders SELECT r.* FROM main.riders r WHERE NOT EXISTS "
+                        "(SELECT 1 FROM main.trips t WHERE t.trip_id = r.trip_id AND t.date IS NOT NULL)"
+                    )
+                first_date, last_date, trips = conn.execute(
+                    "SELECT MIN(date), MAX(date), COUNT(*) FROM part.trips"
+                ).fetchone()
+                riders = conn.execute("SELECT COUNT(*) FROM part.riders").fetchone()[0]
+                conn.execute("COMMIT")
+            finally:
+                conn.execute("DETACH DATABASE part")
+
+            catalog.append({
+                "name": name,
+                "path": os.path.relpath(path, db_path.parent),
+                "first_date": first_date,
+                "last_date": last_date,
+                "trips": trips,
+                "riders": riders,
+                "immutable": 0
+            })
+            print(f"Partition {name}: {trips} trips, {riders} riders")
+
+        conn.execute("BEGIN")
+        conn.execute(f"DROP TABLE IF EXISTS {CATALOG_TABLE}")
+        conn.execute(f'''
+            CREATE TABLE {CATALOG_TABLE} (
+                name TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                first_date TEXT,
+                last_date TEXT,
+                trips INTEGER,
+                riders INTEGER,
+                immutable INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.executemany(
+            f"INSERT INTO {CATALOG_TABLE} VALUES "
+            f"(:name, :path, :first_date, :last_date, :trips, :riders, :immutable)",
+            catalog
+        )
+        for table in PARTITIONED_TABLES:
+            conn.execute(f"DELETE FROM {table}")
+        conn.execute("COMMIT")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    return catalog
+
+
+def remove_stale_partitions(db_path: str, keep: int = 1) -> List[str]:
+    """
+    Delete partition directories the database no longer uses
+
+    The directory in the current catalog is kept, plus the newest `keep`
+    others, so queries that attached the previous partitions just before a
+    rebuild can finish.
+
+    Returns:
+        The directories removed
+    """
+    db_path = Path(db_path)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        used = {
+            (db_path.parent / path).resolve().parent
+            for (path,) in conn.execute(f"SELECT path FROM {CATALOG_TABLE}")
+        }
+    finally:
+        conn.close()
+    candidates = sorted(
+        (path for path in db_path.parent.glob(f"{db_path.stem}_partitions*")
+         if path.is_dir() and path.resolve() not in used),
+        key=lambda path: path.stat().st_mtime,
+        reverse=True
+    )
+    removed = []
+    for directory in candidates[keep:]:
+        for file in directory.iterdir():
+            os.chmod(file, stat.S_IRUSR | stat.S_IWUSR)
+            file.unlink()
+        directory.rmdir()
+        removed.append(str(directory))
+    return removed
+
+
+def freeze_partitions(db_path: str, before: str) -> List[str]:
+    """
+    Make partitions that end before a month immutable
+
+    Frozen months are merged into one file per year, so the number of files a
+    query may need stays within SQLite's attach limit as history grows. Each
+    yearly file is analyzed, vacuumed and made read-only on disk; the query
+    layer then opens it with immutable=1 (no locking or change detection) and
+    memory-maps it.
+
+    The merged file is written under a new name and swapped in with a single
+    catalog update, so an interrupted freeze never exposes duplicate rows.
+
+    Args:
+        db_path: Path to the partitioned main database
+        before: Month (YYYY-MM); partitions whose last date is earlier are frozen
+
+    Returns:
+        Names of the yearly partitions written
+    """
+    db_dir = Path(db_path).parent
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    frozen = []
+    try:
+        rows = conn.execute(
+            f"SELECT name, path, first_date FROM {CATALOG_TABLE} WHERE immutable = 0 "
+            f"AND last_date IS NOT NULL AND last_date < ? ORDER BY name", (before,)
+        ).fetchall()
+        years: Dict[str, List[Tuple[str, str]]] = {}
+        for name, path, first_date in rows:
+            years.setdefault(first_date[:4], []).append((name, path))
+
+        for year, months in years.items():
+            previous = conn.execute(
+                f"SELECT path FROM {CATALOG_TABLE} WHERE name = ? AND immutable = 1", (year,)
+            ).fetchone()
+            sources = ([previous[0]] if previous else []) + [path for _, path in months]
+            target = (db_dir / months[0][1]).with_name(f"trips_{year}_{time.strftime('%Y%m%d%H%M%S')}.db")
+
+            conn.execute("ATTACH DATABASE ? AS frozen", (str(target),))
+            try:
+                for table in PARTITIONED_TABLES:
+                    _copy_schema(conn, table, "frozen")
+                for source in sources:
+                    conn.execute("ATTACH DATABASE ? AS source", (f"file:{db_dir / source}?mode=ro",))
+                    try:
+                        conn.execute("BEGIN")
+                        for table in PARTITIONED_TABLES:
+                            conn.execute(f"INSERT INTO frozen.{table} SELECT * FROM source.{table}")
+                        conn.execute("COMMIT")
+                    finally:
+                        conn.execute("DETACH DATABASE source")
+                first_date, last_date, trips = conn.execute(
+                    "SELECT MIN(date), MAX(date), COUNT(*) FROM frozen.trips"
+                ).fetchone()
+                riders = conn.execute("SELECT COUNT(*) FROM frozen.riders").fetchone()[0]
+            finally:
+                conn.execute("DETACH DATABASE frozen")
+
+            partition = sqlite3.connect(target, isolation_level=None)
+            try:
+                partition.execute("ANALYZE")
+                partition.execute("VACUUM")
+            finally:
+                partition.close()
+            os.chmod(target, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+            conn.execute("BEGIN")
+            conn.executemany(
+                f"DELETE FROM {CATALOG_TABLE} WHERE name = ?",
+                [(year,)] + [(name,) for name, _ in months]
+            )
+            conn.execute(
+                f"INSERT INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, ?, ?, 1)",
+                (year, os.path.relpath(target, db_dir), first_date, last_date, trips, riders)
+            )
+            conn.execute("COMMIT")
+
+            # Superseded files are only removed once the catalog no longer uses them
+            for source in sources:
+                source_path = db_dir / source
+                os.chmod(source_path, stat.S_IRUSR | stat.S_IWUSR)
+                source_path.unlink()
+            frozen.append(year)
+            print(f"Partition {year} is now immutable ({len(months)} months merged)")
+    finally:
+        conn.close()
+    return frozen
+
+
+def _where_conjuncts(sql: str) -> Optional[List[str]]:
+    """
+    Split the WHERE clause of a single SELECT into its top-level AND-ed conjuncts
+
+    Returns:
+        The conjuncts (empty if there is no WHERE clause), or None if the
+        statement is not a single SELECT, has comments, or its WHERE clause
+        has a top-level OR
+    """
+    # Literals are blanked out with their length kept, so positions found in
+    # the masked text slice the original statement
+    masked = _STRING_LITERAL.sub(lambda match: "'" + "x" * (len(match.group()) - 2) + "'", sql)
+    if "--" in masked or "/*" in masked or len(re.findall(r"\bSELECT\b", masked, re.IGNORECASE)) != 1:
+        return None
+
+    conjuncts = []
+    depth, start, in_between = 0, None, False
+    for token in _WHERE_TOKEN.finditer(masked):
+        word = token.group().upper()
+        if word == "(":
+            depth += 1
+        elif word == ")":
+            depth -= 1
+        elif depth:
+            continue
+        elif start is None:
+            if word == "WHERE":
+                start = token.end()
+        elif word == "OR":
+            return None
+        elif word == "BETWEEN":
+            in_between = True
+        elif word == "AND" and in_between:
+            in_between = False
+        elif word == "AND":
+            conjuncts.append(sql[start:token.start()])
+            start = token.end()
+        elif word in _CLAUSE_END:
+            conjuncts.append(sql[start:token.start()])
+            return [_unwrap(conjunct) for conjunct in conjuncts]
+    if start is not None:
+        conjuncts.append(sql[start:])
+    return [_unwrap(conjunct) for conjunct in conjuncts]
+
+
+def _unwrap(expression: str) -> str:
+    """Strip whitespace, trailing semicolons and parentheses enclosing a whole expression"""
+    expression = expression.strip().rstrip(";").strip()
+    while expression.startswith("(") and expression.endswith(")"):
+        depth = 0
+        for position, char in enumerate(_STRING_LITERAL.sub(lambda match: "x" * len(match.group()), expression)):
+            depth += {"(": 1, ")": -1}.get(char, 0)
+            if depth == 0 and position < len(expression) - 1:
+                return expression
+        expression = expression[1:-1].strip()
+    return expression
+
+
+def get_date_bounds(sql: str, qualifiers: Optional[Set[str]] = None,
+                    allow_unqualified: bool = True) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """
+    Extract the date range a query (or one table reference in it) is restricted to
+
+    Only top-level AND-ed conjuncts of a single SELECT's WHERE clause count,
+    and only when the whole conjunct is a comparison of date / trip_datetime
+    with a literal. Predicates anywhere else (select list, CASE, NOT, OR,
+    join conditions, subqueries) never narrow the range.
+
+    Args:
+        sql: The statement
+        qualifiers: Lower-cased table names or aliases whose predicates count
+            (None counts predicates on any table)
+        allow_unqualified: Whether predicates on unqualified columns count
+
+    Returns:
+        (low, high) inclusive bounds as date prefixes (either may be None),
+        or None if the query is not restricted by date
+    """
+    conjuncts = _where_conjuncts(sql)
+    if not conjuncts:
+        return None
+
+    low, high = None, None
+
+    def applies(qualifier: str) -> bool:
+        if not qualifier:
+            return allow_unqualified
+        return qualifiers is None or qualifier.lower() in qualifiers
+
+    def restrict(qualifier: str, operator: str, value: str):
+        nonlocal low, high
+        if not applies(qualifier):
+            return
+        # A month prefix covers the whole month
+        upper = value if len(value) == 10 else value + "-31"
+        if operator in ("=", ">=", ">"):
+            low = max(low, value) if low else value
+        if operator in ("=", "<=", "<"):
+            high = min(high, upper) if high else upper
+
+    for conjunct in conjuncts:
+        match = _DATE_COMPARISON.fullmatch(conjunct)
+        if match:
+            restrict(*match.groups())
+            continue
+        match = _DATE_COMPARISON_REVERSED.fullmatch(conjunct)
+        if match:
+            value, operator, qualifier = match.groups()
+            restrict(qualifier, _REVERSED_OPERATORS[operator], value)
+            continue
+        match = _DATE_BETWEEN.fullmatch(conjunct)
+        if match:
+            qualifier, first, last = match.groups()
+            restrict(qualifier, ">=", first)
+            restrict(qualifier, "<=", last)
+            continue
+        match = _DATE_LIKE.fullmatch(conjunct)
+        if match:
+            restrict(match.group(1), "=", match.group(2))
+            continue
+        match = _MONTH_EXPRESSION.fullmatch(conjunct)
+        if match:
+            first_qualifier, second_qualifier, value = match.groups()
+            restrict(first_qualifier or second_qualifier, "=", value)
+
+    if low is None and high is None:
+        return None
+    return low, high
+
+
+class PartitionedConnection(sqlite3.Connection):
+    """sqlite3 connection that remembers which partition catalog its views read"""
+
+    partition_version = None
+
+
+class PartitionRouter:
+    """
+    Serves trips and riders from monthly partition files.
+    Every connection attaches all partitions and gets TEMP views named trips
+    and riders that UNION ALL them, so any statement on any connection reads
+    the full tables. Statements run through an engine are additionally
+    rewritten so each plain FROM/JOIN reference whose WHERE clause restricts
+    its date reads only the partitions that can match; every other reference
+    keeps reading the views.
+    """
+
+    def __init__(self, db_path: str, max_attached: int = MAX_ATTACHED, mmap_size: int = 256 * 1024 * 1024):
+        """
+        Initialize the router
+
+        Args:
+            db_path: Path to the partitioned main database
+            max_attached: Maximum partitions attached to one connection
+            mmap_size: Bytes of each immutable partition to memory-map
+        """
+        self.db_path = db_path
+        self.max_attached = max_attached
+        self.mmap_size = mmap_size
+        self._version = None
+        self._partitions: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self.stats = {"queries_routed": 0, "partitions_scanned": 0, "partitions_pruned": 0, "attaches": 0}
+        self.refresh()
+
+    @staticmethod
+    def is_partitioned(db_path: str) -> bool:
+        """Whether a database has been split into partitions"""
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            return conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (CATALOG_TABLE,)
+            ).fetchone() is not None
+        finally:
+            conn.close()
+
+    def refresh(self):
+        """Reload the partition catalog if the main database changed"""
+        version = get_db_version(self.db_path)
+        with self._lock:
+            if version == self._version:
+                return
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            try:
+                conn.row_factory = sqlite3.Row
+                rows = conn.execute(f"SELECT * FROM {CATALOG_TABLE} ORDER BY name").fetchall()
+            finally:
+                conn.close()
+            if len(rows) > self.max_attached:
+                raise sqlite3.OperationalError(
+                    f"Database has {len(rows)} partitions but at most {self.max_attached} can be attached; "
+                    f"freeze older months to merge them"
+                )
+            db_dir = Path(self.db_path).parent
+            self._partitions = [
+                dict(row, alias=f"p_{row['name']}", file=str((db_dir / row["path"]).resolve()))
+                for row in rows
+            ]
+            self._version = version
+
+    def get_partitions(self, sql: str, qualifiers: Optional[Set[str]] = None,
+                       allow_unqualified: bool = True) -> List[Dict[str, Any]]:
+        """Get the partitions a query (or one table reference, see get_date_bounds) has to read"""
+        bounds = get_date_bounds(sql, qualifiers, allow_unqualified)
+        if bounds is None:
+            return list(self._partitions)
+        low, high = bounds
+        return [
+            partition for partition in self._partitions
+            if partition["first_date"] is None
+            or ((low is None or partition["last_date"] >= low)
+                and (high is None or partition["first_date"][:len(high)] <= high))
+        ]
+
+    def _attach(self, conn: PartitionedConnection):
+        """Attach every partition to a connection and point the trips and riders views at them"""
+        with self._lock:
+            version, partitions = self._version, list(self._partitions)
+        for table in PARTITIONED_TABLES:
+            conn.execute(f"DROP VIEW IF EXISTS temp.{table}")
+        for _, alias, _ in conn.execute("PRAGMA database_list").fetchall():
+            if alias.startswith("p_"):
+                conn.execute(f"DETACH DATABASE {alias}")
+
+        for partition in partitions:
+            alias = partition["alias"]
+            uri = f"file:{partition['file']}?mode=ro"
+            if partition["immutable"]:
+                uri += "&immutable=1"
+            conn.execute(f"ATTACH DATABASE ? AS {alias}", (uri,))
+            if partition["immutable"]:
+                conn.execute(f"PRAGMA {alias}.mmap_size = {int(self.mmap_size)}")
+        for table in PARTITIONED_TABLES:
+            conn.execute(f"CREATE TEMP VIEW {table} AS {self._union(table, partitions)}")
+        conn.partition_version = version
+        with self._lock:
+            self.stats["attaches"] += len(partitions)
+
+    @staticmethod
+    def _union(table: str, partitions: List[Dict[str, Any]]) -> str:
+        """SELECT reading a table from the given partitions"""
+        if not partitions:
+            # Nothing can match; read the empty table kept in the main database
+            return f"SELECT * FROM main.{table}"
+        return " UNION ALL ".join(f"SELECT * FROM {partition['alias']}.{table}" for partition in partitions)
+
+    def prepare(self, conn: PartitionedConnection, sql: str) -> str:
+        """
+        Make sure a connection reads the current partitions and prune a statement's references
+
+        Args:
+            conn: A connection opened by connect()
+            sql: The statement
+
+        Returns:
+            The statement, with prunable trips and riders references rewritten
+            to read only the partitions they can match
+
+        Raises:
+            sqlite3.OperationalError: If the statement reads main.trips or
+                main.riders, which are empty in a partitioned database
+        """
+        masked = _STRING_LITERAL.sub("'?'", sql)
+        if _MAIN_TABLE_REF.search(masked):
+            raise sqlite3.OperationalError(
+                "trips and riders are partitioned; refer to them without the main. prefix"
+            )
+        self.refresh()
+        if conn.partition_version != self._version:
+            self._attach(conn)
+
+        references = []
+        for match in _TABLE_REF.finditer(masked):
+            keyword, table, spacing, alias = match.groups()
+            if alias and alias.upper() in ALIAS_STOPWORDS:
+                alias = None
+            references.append((table.lower(), (alias or table).lower()))
+        if not references:
+            return sql
+
+        # Each reference is pruned by the predicates on its own alias only, so
+        # a self-join over two months reads both. Unqualified date columns can
+        # only belong to trips (riders has none), and only if it is the one
+        # trips table in the statement (including comma joins).
+        single_trips = len(re.findall(r"\btrips\b", masked, re.IGNORECASE)) == 1
+        reference_partitions = [
+            self.get_partitions(sql, {name}, allow_unqualified=table == "trips" and single_trips)
+            for table, name in references
+        ]
+        with self._lock:
+            self.stats["queries_routed"] += 1
+            for partitions in reference_partitions:
+                self.stats["partitions_scanned"] += len(partitions)
+                self.stats["partitions_pruned"] += len(self._partitions) - len(partitions)
+        if all(len(partitions) == len(self._partitions) for partitions in reference_partitions):
+            return sql
+
+        # Matches are replaced in the order they were found above
+        remaining = iter(reference_partitions)
+
+        def replace_table(match):
+            keyword, table, spacing, alias = match.groups()
+            partitions = next(remaining)
+            if len(partitions) == len(self._partitions):
+                return match.group()
+            trailing = ""
+            if alias and alias.upper() in ALIAS_STOPWORDS:
+                trailing, spacing, alias = spacing + alias, None, None
+            if len(partitions) == 1:
+                source = f"{partitions[0]['alias']}.{table}"
+            else:
+                source = f"({self._union(table, partitions)})"
+            return f"{keyword} {source}{spacing or ' AS '}{alias or table}{trailing}"
+
+        literals = _STRING_LITERAL.findall(sql)
+        rewritten = _TABLE_REF.sub(replace_table, masked)
+        for literal in literals:
+            rewritten = rewritten.replace("'?'", literal, 1)
+        return rewritten
+
+    def connect(self) -> PartitionedConnection:
+        """Open a connection to the main database whose trips and riders read the partitions"""
+        self.refresh()
+        conn = sqlite3.connect(
+            f"file:{self.db_path}", uri=True, check_same_thread=False, factory=PartitionedConnection
+        )
+        self._attach(conn)
+        return conn
+
+    def attach_to_engine(self, engine):
+        """Prune every statement run through a SQLAlchemy engine built on connect()"""
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "before_cursor_execute", retval=True)
+        def _route(conn, cursor, statement, parameters, context, executemany):
+            return self.prepare(conn.connection.dbapi_connection, statement), parameters
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get routing statistics"""
+        with self._lock:
+            return dict(
+                self.stats,
+                partitions=len(self._partitions),
+                immutable_partitions=sum(1 for partition in self._partitions if partition["immutable"])
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage monthly partitions of the FetiiPro database")
+    parser.add_argument("command", choices=["partition", "freeze"])
+    parser.add_argument("--db", default="data/database/fetiipro.db", help="Main database path")
+    parser.add_argument("--before", help="freeze: make partitions ending before this month (YYYY-MM) immutable")
+    args = parser.parse_args()
+
+    if args.command == "partition":
+        partition_database(args.db)
+    else:
+        if not args.before:
+            parser.error("freeze requires --before YYYY-MM")
+        freeze_partitions(args.db, args.before)
@@ -0,0 +1,83 @@
+"""
+Pre-fork process manager for the FetiiPro web app
+The parent binds the listening socket once and forks N workers that all
+accept connections from it, so CPU-bound work can use every core
+"""
+import os
+import signal
+import time
+from typing import Callable, Dict
+
+
+def serve_prefork(httpd, workers: int, on_worker_start: Callable[[int], None] = None,
+                  on_worker_exit: Callable[[int], None] = None):
+    """
+    Serve an already-bound HTTP server from several forked worker processes
+
+    Workers that exit unexpectedly (crash, or recycled after hitting a
+    limit) are replaced. SIGINT/SIGTERM stop all workers.
+
+    Args:
+        httpd: A bound HTTPServer instance
+        workers: Number of worker processes
+        on_worker_start: Called in each worker with its index before serving
+        on_worker_exit: Called in a worker whose serve_forever() was shut down
+            (a graceful recycle), e.g. to drain in-flight queries before exiting
+    """
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            # Worker: restore default signal handling and serve forever
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                if on_worker_start:
+                    on_worker_start(index)
+                httpd.serve_forever()
+                if on_worker_exit:
+                    on_worker_exit(index)
+            except KeyboardInterrupt:
+                pass
+            except Exception as e:
+                print(f"❌ Worker {index} crashed: {e}")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for index in range(workers):
+        spawn(index)
+    print(f"👷 Started {workers} worker processes")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f"♻️ Worker {index} (pid {pid}) exited with status {status}, restarting")
+        time.sleep(0.5)
+        spawn(index)
+
+    httpd.server_close()
+    print("\n🛑 Server stopped")
@@ -0,0 +1,117 @@
+"""
+Single-flight coalescing of identical in-flight questions
+Concurrent callers asking the same (normalized) question share one agent run
+"""
+import re
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+from deadlines import QueryCancelled
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivially different phrasings share a key"""
+    normalized = question.strip().lower()
+    normalized = re.sub(r"\s+", " ", normalized)
+    # Trailing punctuation does not change the meaning of the question
+    return normalized.rstrip(" ?!.")
+
+
+class _Flight:
+    """A single in-flight computation that followers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class QueryCoalescer:
+    """
+    Runs at most one computation per key at a time.
+    Callers that arrive while a computation for the same key is running
+    wait for it and receive the same result instead of starting their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._local = threading.local()
+        self.stats = {
+            "executions": 0,
+            "coalesced_requests": 0,
+            "llm_runs_saved": 0,
+            "follower_retries": 0,
+            "in_flight": 0
+        }
+
+    def run(self, key: str, fn: Callable[[], Any], deadline=None) -> Tuple[Any, bool]:
+        """
+        Run fn for key, or wait on an identical in-flight run
+
+        Args:
+            key: Normalized question used to detect duplicates
+            fn: Zero-argument callable doing the actual work
+            deadline: Optional Deadline bounding how long a follower waits
+
+        Returns:
+            Tuple of (result, shared) where shared is True if the result
+            came from another caller's run
+        """
+        while True:
+            try:
+                return self._run_once(key, fn, deadline)
+            except QueryCancelled:
+                # The leader's client went away; followers that are still
+                # wanted retry, one of them becoming the new leader
+                if deadline is not None:
+                    deadline.check()
+                if not getattr(self._local, "follower", False):
+                    raise
+                with self._lock:
+                    self.stats["follower_retries"] += 1
+
+    def _run_once(self, key: str, fn: Callable[[], Any], deadline) -> Tuple[Any, bool]:
+        self._local.follower = False
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.stats["executions"] += 1
+                self.stats["in_flight"] = len(self._flights)
+            else:
+                flight.waiters += 1
+                self.stats["coalesced_requests"] += 1
+
+        if not leader:
+            self._local.follower = True
+            while not flight.done.wait(0.1):
+                if deadline is not None:
+                    deadline.check()
+            if flight.error is not None:
+                raise flight.error
+            # Only a follower that got the leader's result avoided a run
+            with self._lock:
+                self.stats["llm_runs_saved"] += 1
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+                self.stats["in_flight"] = len(self._flights)
+            flight.done.set()
+
+        return flight.result, False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get coalescing statistics"""
+        with self._lock:
+            return dict(self.stats)
@@ -0,0 +1,274 @@
+"""
+Materialized query results for the FetiiPro web app
+Re-runs the agent's final SQL into a scratch SQLite file so the full result
+set can be paged through /api/results/<id> without passing through the LLM
+"""
+import csv
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    result_id TEXT PRIMARY KEY,
+    question TEXT,
+    sql TEXT NOT NULL,
+    columns TEXT NOT NULL,
+    row_count INTEGER NOT NULL,
+    truncated INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_created_at ON results(created_at);
+"""
+
+RESULT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "columnar": "application/x-ndjson"
+}
+
+
+class ResultStore:
+    """
+    Scratch SQLite store of query result sets.
+    Each result is copied into its own table keyed by a dense row number, so
+    pages are read with keyset pagination (row > cursor) at constant cost.
+    The file is shared by all worker processes, like the SharedStore.
+    """
+
+    def __init__(self, path: str = "data/database/results.db", ttl: float = 3600,
+                 max_results: int = 100, max_rows: int = 1000000, batch_size: int = 5000):
+        """
+        Initialize the store and create its catalog table
+
+        Args:
+            path: Path to the scratch SQLite file
+            ttl: Seconds a result stays available
+            max_results: Results kept at most; the oldest are dropped first
+            max_rows: Rows copied per result at most (the result is marked truncated)
+            batch_size: Rows fetched and inserted per batch
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_results = max_results
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.stats = {"materialized": 0, "rows_written": 0, "expired": 0, "pages_served": 0}
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Get this thread's connection, reopening it after a fork"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    @staticmethod
+    def _table(result_id: str) -> str:
+        # Ids are interpolated into table names, so only our own hex ids pass
+        if not re.fullmatch(r"[0-9a-f]{32}", result_id):
+            raise ValueError(f"Invalid result id: {result_id}")
+        return f"result_{result_id}"
+
+    def materialize(self, engine, sql: str, question: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Run a query and copy its full result set into the store
+
+        Args:
+            engine: SQLAlchemy engine to run the query on (so partition
+                routing and deadlines apply)
+            sql: A read-only SELECT statement
+            question: The question the SQL answers, kept for reference
+
+        Returns:
+            Result handle with result_id, columns, row_count and truncated
+
+        Raises:
+            ValueError: If the statement is not a SELECT
+        """
+        if not sql.lstrip().lower().startswith(("select", "with")):
+            raise ValueError("Only SELECT results can be materialized")
+        self.expire()
+
+        result_id = uuid.uuid4().hex
+        table = self._table(result_id)
+        store = self._conn()
+        row_count = 0
+        truncated = False
+        with engine.connect() as connection:
+            result = connection.exec_driver_sql(sql)
+            columns = list(result.keys())
+            placeholders = ", ".join("?" for _ in range(len(columns) + 1))
+            store.execute("BEGIN")
+            try:
+                # Untyped columns keep each value's own storage class
+                store.execute(
+                    f"CREATE TABLE {table} (_row INTEGER PRIMARY KEY, "
+                    + ", ".join(f"c{index}" for index in range(len(columns))) + ")"
+                )
+                while row_count < self.max_rows:
+                    rows = result.fetchmany(min(self.batch_size, self.max_rows - row_count))
+                    if not rows:
+                        break
+                    store.executemany(
+                        f"INSERT INTO {table} VALUES ({placeholders})",
+                        ((row_count + offset + 1, *row) for offset, row in enumerate(rows))
+                    )
+                    row_count += len(rows)
+                else:
+                    truncated = result.fetchone() is not None
+                store.execute(
+                    "INSERT INTO results (result_id, question, sql, columns, row_count, truncated, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (result_id, question, sql, json.dumps(columns), row_count, int(truncated), time.time())
+                )
+                store.execute("COMMIT")
+            except Exception:
+                store.execute("ROLLBACK")
+                raise
+
+        self._count("materialized")
+        self._count("rows_written", row_count)
+        return {"result_id": result_id, "columns": columns, "row_count": row_count, "truncated": truncated}
+
+    def get(self, result_id: str) -> Optional[Dict[str, Any]]:
+        """Get a result's metadata, or None if it is unknown or expired"""
+        if not re.fullmatch(r"[0-9a-f]{32}", result_id):
+            return None
+        row = self._conn().execute(
+            "SELECT question, sql, columns, row_count, truncated, created_at FROM results "
+            "WHERE result_id = ? AND created_at >= ?",
+            (result_id, time.time() - self.ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        question, sql, columns, row_count, truncated, created_at = row
+        return {
+            "result_id": result_id,
+            "question": question,
+            "sql": sql,
+            "columns": json.loads(columns),
+            "row_count": row_count,
+            "truncated": bool(truncated),
+            "created_at": created_at
+        }
+
+    def iter_pages(self, result_id: str, after: int = 0, limit: Optional[int] = None,
+                   page_size: int = 1000) -> Iterator[List[Tuple]]:
+        """
+        Stream a result's rows in pages
+
+        Args:
+            result_id: The result handle
+            after: Row cursor; only rows after it are returned
+            limit: Maximum rows to return (None for all remaining rows)
+            page_size: Rows per page
+
+        Yields:
+            Lists of (row_number, *values) tuples, in row order
+        """
+        table = self._table(result_id)
+        conn = self._conn()
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = page_size if remaining is None else min(page_size, remaining)
+            rows = conn.execute(
+                f"SELECT * FROM {table} WHERE _row > ? ORDER BY _row LIMIT ?", (after, size)
+            ).fetchall()
+            if not rows:
+                return
+            self._count("pages_served")
+            yield rows
+            after = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def expire(self):
+        """Drop results past their TTL and the oldest beyond max_results"""
+        conn = self._conn()
+        expired = [row[0] for row in conn.execute(
+            "SELECT result_id FROM results WHERE created_at < ? OR result_id NOT IN ("
+            "SELECT result_id FROM results ORDER BY created_at DESC LIMIT ?)",
+            # Leave room for the result about to be stored
+            (time.time() - self.ttl, max(0, self.max_results - 1))
+        ).fetchall()]
+        for result_id in expired:
+            conn.execute("BEGIN")
+            conn.execute(f"DROP TABLE IF EXISTS {self._table(result_id)}")
+            conn.execute("DELETE FROM results WHERE result_id = ?", (result_id,))
+            conn.execute("COMMIT")
+        if expired:
+            self._count("expired", len(expired))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get store statistics"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["stored_results"] = self._conn().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return stats
+
+
+def encode_pages(pages: Iterator[List[Tuple]], columns: List[str], fmt: str) -> Iterator[bytes]:
+    """
+    Encode result pages for streaming
+
+    Formats:
+        csv: a header line, then one line per row
+        ndjson: one JSON object per row
+        columnar: a {"columns": [...]} line, then one line per page with
+            {"cursor": last row number, "data": [values of each column]}
+
+    Args:
+        pages: Pages from ResultStore.iter_pages
+        columns: Column names
+        fmt: One of RESULT_FORMATS
+
+    Yields:
+        Encoded chunks, one per page (plus the header)
+    """
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        yield buffer.getvalue().encode("utf-8")
+        for page in pages:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(row[1:] for row in page)
+            yield buffer.getvalue().encode("utf-8")
+    elif fmt == "ndjson":
+        for page in pages:
+            yield "".join(
+                json.dumps(dict(zip(columns, row[1:])), default=str) + "\n" for row in page
+            ).encode("utf-8")
+    elif fmt == "columnar":
+        yield (json.dumps({"columns": columns}) + "\n").encode("utf-8")
+        for page in pages:
+            data = [list(values) for values in zip(*page)][1:] if page else []
+            yield (json.dumps({"cursor": page[-1][0], "data": data}, default=str) + "\n").encode("utf-8")
+    else:
+        raise ValueError(f"Unknown result format: {fmt}")
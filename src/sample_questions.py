@@ -0,0 +1,13 @@
+"""
+Sample questions for the FetiiPro chatbot
+Kept free of LangChain imports so the web server can serve them before the
+agent is built
+"""
+
+SAMPLE_QUESTIONS = (
+    "How many total trips are there?",
+    "What is the average passenger count?",
+    "How many trips happened on weekends?",
+    "What are the busiest hours for trips?",
+    "How many large group trips are there?"
+)
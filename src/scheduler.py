@@ -0,0 +1,215 @@
+"""
+Query scheduler for the FetiiPro web app
+Per-client token-bucket rate limits, a fast lane for cached answers and a
+priority queue bounding the number of concurrent LLM-bound runs
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+from deadlines import QueryCancelled
+
+# Priority lanes; lower numbers are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_API = 1
+
+
+class SchedulerRejected(Exception):
+    """Raised when a query is rejected by rate limiting or overload protection"""
+
+    def __init__(self, status: int, message: str, retry_after: float):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Classic token bucket: rate tokens per second, up to burst tokens saved"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """
+        Take tokens if available
+
+        Returns:
+            0 if the tokens were taken, otherwise seconds until they would be
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+
+class QueryScheduler:
+    """
+    Admission control in front of process_query.
+    Cached answers are served immediately; LLM-bound queries are rate limited
+    per client and wait in a priority queue for one of a fixed number of slots.
+    When the queue is full or the wait would exceed the queue timeout the
+    query is rejected right away instead of timing out later.
+    """
+
+    def __init__(self, rate_per_minute: float = 30, burst: float = 10, max_concurrent: int = 4,
+                 max_queue: int = 32, queue_timeout: float = 30, max_clients: int = 10000):
+        """
+        Initialize the scheduler
+
+        Args:
+            rate_per_minute: Sustained LLM-bound queries per client per minute
+            burst: Queries a client may send in a burst
+            max_concurrent: Maximum LLM-bound runs at once
+            max_queue: Maximum queued LLM-bound queries
+            queue_timeout: Maximum seconds a query may wait for a slot
+            max_clients: Number of client buckets kept (least recently used are dropped)
+        """
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_clients = max_clients
+
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._condition = threading.Condition()
+
+        self.stats = {
+            "fast_path": 0,
+            "llm_runs": 0,
+            "rate_limited": 0,
+            "rejected_queue_full": 0,
+            "queue_timeouts": 0,
+            "cancelled_in_queue": 0,
+            "total_queue_time": 0.0,
+            "max_queue_time": 0.0
+        }
+
+    def _bucket(self, client_key: str) -> TokenBucket:
+        with self._condition:
+            bucket = self._buckets.get(client_key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self._buckets[client_key] = bucket
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client_key)
+            return bucket
+
+    def submit(self, client_key: str, run: Callable[[], Any], is_fast: Callable[[], bool],
+               priority: int = PRIORITY_API, deadline=None) -> Any:
+        """
+        Run a query under admission control
+
+        Args:
+            client_key: Identifies the client for rate limiting (API key or IP)
+            run: Runs the query and returns its result
+            is_fast: Returns True if the query can be answered without the LLM
+            priority: Priority lane (PRIORITY_INTERACTIVE or PRIORITY_API)
+            deadline: Optional Deadline also bounding the time spent queued
+
+        Returns:
+            The result of run()
+
+        Raises:
+            SchedulerRejected: If rate limited or overloaded
+            QueryCancelled: If the query was cancelled (e.g. its client
+                disconnected) while it waited for a slot
+        """
+        if is_fast():
+            with self._condition:
+                self.stats["fast_path"] += 1
+            return run()
+
+        retry_after = self._bucket(client_key).try_acquire()
+        if retry_after:
+            with self._condition:
+                self.stats["rate_limited"] += 1
+            raise SchedulerRejected(429, "Rate limit exceeded. Please slow down.", retry_after)
+
+        self._acquire_slot(priority, deadline)
+        try:
+            return run()
+        finally:
+            # A cancelled run returns before its helper thread has stopped
+            # calling the LLM; keep the slot until that thread is done
+            if deadline is not None:
+                deadline.when_finished(self._release_slot)
+            else:
+                self._release_slot()
+
+    def _release_slot(self):
+        """Free an LLM slot and wake the next queued query"""
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def _acquire_slot(self, priority: int, deadline):
+        """Wait in the priority queue for an LLM slot"""
+        timeout = self.queue_timeout
+        if deadline is not None and deadline.remaining() is not None:
+            timeout = min(timeout, deadline.remaining())
+        enqueued_at = time.monotonic()
+        ticket = (priority, next(self._sequence))
+
+        with self._condition:
+            if len(self._waiting) >= self.max_queue:
+                self.stats["rejected_queue_full"] += 1
+                raise SchedulerRejected(503, "Server is busy. Please try again shortly.", self.queue_timeout)
+
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while self._active >= self.max_concurrent or self._waiting[0] != ticket:
+                    remaining = timeout - (time.monotonic() - enqueued_at)
+                    if deadline is not None and deadline.cancelled and deadline.reason != "deadline":
+                        self.stats["cancelled_in_queue"] += 1
+                        raise QueryCancelled(deadline.reason)
+                    if remaining <= 0 or (deadline is not None and deadline.cancelled):
+                        self.stats["queue_timeouts"] += 1
+                        raise SchedulerRejected(
+                            503, "Server is busy and the query could not start in time. Please retry.",
+                            self.queue_timeout
+                        )
+                    self._condition.wait(min(remaining, 0.5))
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+                raise
+
+            heapq.heappop(self._waiting)
+            self._active += 1
+            waited = time.monotonic() - enqueued_at
+            self.stats["llm_runs"] += 1
+            self.stats["total_queue_time"] += waited
+            self.stats["max_queue_time"] = max(self.stats["max_queue_time"], waited)
+            # The next ticket in line may also be able to start
+            self._condition.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get scheduler statistics"""
+        with self._condition:
+            runs = self.stats["llm_runs"]
+            return dict(
+                self.stats,
+                avg_queue_time=self.stats["total_queue_time"] / runs if runs else 0,
+                queue_depth=len(self._waiting),
+                active_llm_runs=self._active,
+                max_concurrent=self.max_concurrent,
+                tracked_clients=len(self._buckets)
+            )
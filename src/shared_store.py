@@ -0,0 +1,301 @@
+"""
+Cross-process shared store for the FetiiPro web app
+A WAL-mode SQLite file holding the answer cache, query analytics and finished
+query traces so that pre-forked workers share hit rates, statistics and traces
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from tracing import QueryTrace
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key TEXT PRIMARY KEY,
+    question TEXT NOT NULL,
+    version TEXT,
+    result TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_answers_updated_at ON answers(updated_at);
+CREATE TABLE IF NOT EXISTS query_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    query TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    response_time REAL NOT NULL,
+    response_length INTEGER NOT NULL,
+    pid INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_query_log_timestamp ON query_log(timestamp);
+CREATE TABLE IF NOT EXISTS traces (
+    trace_id TEXT PRIMARY KEY,
+    trace TEXT NOT NULL,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_traces_finished_at ON traces(finished_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class SharedStore:
+    """
+    SQLite-backed store shared by all worker processes.
+    Connections are opened lazily per thread and per process, so the store
+    can be created before forking.
+    """
+
+    # Query log entries written by this process between retention passes
+    EXPIRE_EVERY = 500
+
+    def __init__(self, path: str = "data/database/shared_cache.db", max_query_log: int = 100000,
+                 query_log_ttl: float = 30 * 86400):
+        """
+        Initialize the store and create its tables
+
+        Args:
+            path: Path to the shared SQLite file
+            max_query_log: Query log entries kept at most; the oldest are dropped first
+            query_log_ttl: Seconds a query log entry is kept
+        """
+        self.path = path
+        self.max_query_log = max_query_log
+        self.query_log_ttl = query_log_ttl
+        self._logged = 0
+        self._logged_lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        # Set up the schema with a throwaway connection so no connection
+        # is inherited across fork()
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+        self.expire_query_log()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Get this thread's connection, reopening it after a fork"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def increment(self, name: str, amount: int = 1):
+        """Increment a named counter"""
+        self._conn().execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount)
+        )
+
+    def get_counters(self, prefix: str = "") -> Dict[str, int]:
+        """Get all counters whose names start with prefix"""
+        rows = self._conn().execute(
+            "SELECT name, value FROM counters WHERE name LIKE ?", (prefix + "%",)
+        ).fetchall()
+        return {name[len(prefix):]: value for name, value in rows}
+
+    def log_query(self, query_log: Dict[str, Any]):
+        """Append a query log entry"""
+        self._conn().execute(
+            "INSERT INTO query_log (timestamp, query, success, response_time, response_length, pid) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                query_log["timestamp"], query_log["query"], int(query_log["success"]),
+                query_log["response_time"], query_log["response_length"], os.getpid()
+            )
+        )
+        with self._logged_lock:
+            self._logged += 1
+            due = self._logged % self.EXPIRE_EVERY == 0
+        if due:
+            self.expire_query_log()
+
+    def expire_query_log(self) -> int:
+        """Drop query log entries past their TTL and the oldest beyond max_query_log"""
+        cutoff = (datetime.now() - timedelta(seconds=self.query_log_ttl)).strftime("%Y-%m-%d %H:%M:%S")
+        conn = self._conn()
+        expired = conn.execute("DELETE FROM query_log WHERE timestamp < ?", (cutoff,)).rowcount
+        expired += conn.execute(
+            "DELETE FROM query_log WHERE id <= (SELECT MAX(id) FROM query_log) - ?", (self.max_query_log,)
+        ).rowcount
+        if expired:
+            self.increment("query_log.expired", expired)
+        return expired
+
+    def get_query_stats(self) -> Dict[str, Any]:
+        """Get query statistics across all workers"""
+        total, successful, avg_time, workers = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(success), 0), COALESCE(AVG(response_time), 0), "
+            "COUNT(DISTINCT pid) FROM query_log"
+        ).fetchone()
+        return {
+            "total_queries": total,
+            "successful_queries": successful,
+            "failed_queries": total - successful,
+            "avg_response_time": avg_time,
+            "workers_reporting": workers
+        }
+
+    def get_recent_queries(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Get the most recent query log entries, oldest first"""
+        rows = self._conn().execute(
+            "SELECT timestamp, query, success, response_time, response_length FROM query_log "
+            "ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [
+            {
+                "timestamp": timestamp,
+                "query": query,
+                "success": bool(success),
+                "response_time": response_time,
+                "response_length": response_length
+            }
+            for timestamp, query, success, response_time, response_length in reversed(rows)
+        ]
+
+
+class SharedAnswerCache:
+    """
+    Answer cache stored in a SharedStore.
+    Same interface as AnswerCache, so the chatbot can use either.
+    """
+
+    def __init__(self, store: SharedStore, max_entries: int = 1024):
+        """
+        Initialize the cache
+
+        Args:
+            store: The shared store
+            max_entries: Maximum number of cached answers across all workers
+        """
+        self.store = store
+        self.max_entries = max_entries
+
+    def get(self, key: str, version: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Get a cached result for the current database version"""
+        conn = self.store._conn()
+        row = conn.execute("SELECT version, result FROM answers WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] != version:
+            self.store.increment("answer_cache.misses")
+            return None
+        conn.execute("UPDATE answers SET updated_at = ? WHERE key = ?", (time.time(), key))
+        self.store.increment("answer_cache.hits")
+        return json.loads(row[1])
+
+    def contains(self, key: str, version: Optional[str]) -> bool:
+        """Check for a current entry without affecting statistics or recency"""
+        row = self.store._conn().execute("SELECT version FROM answers WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] == version
+
+    def put(self, key: str, question: str, version: Optional[str], result: Dict[str, Any]):
+        """Store a result computed against the given database version"""
+        conn = self.store._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO answers (key, question, version, result, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, question, version, json.dumps(result), time.time())
+        )
+        self.store.increment("answer_cache.stores")
+        # Evict least recently used entries beyond the limit
+        evicted = conn.execute(
+            "DELETE FROM answers WHERE key IN ("
+            "SELECT key FROM answers ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        ).rowcount
+        if evicted:
+            self.store.increment("answer_cache.evictions", evicted)
+
+    def get_entries(self) -> List[Tuple[str, str]]:
+        """Get the (key, original question) of all cached entries, most recent last"""
+        return self.store._conn().execute("SELECT key, question FROM answers ORDER BY updated_at").fetchall()
+
+    def clear(self):
+        """Remove all cached answers"""
+        self.store._conn().execute("DELETE FROM answers")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics across all workers"""
+        counters = self.store.get_counters("answer_cache.")
+        entries = self.store._conn().execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        stats = {name: counters.get(name, 0) for name in ("hits", "misses", "stores", "evictions")}
+        lookups = stats["hits"] + stats["misses"]
+        return dict(stats, entries=entries, hit_rate=stats["hits"] / lookups if lookups else 0)
+
+
+class SharedTraceStore:
+    """
+    Trace store backed by a SharedStore.
+    Same interface as TraceStore. Traces are kept in this process while their
+    query runs and saved when they finish, so /api/trace/<id> works on any
+    worker.
+    """
+
+    def __init__(self, store: SharedStore, max_traces: int = 200):
+        """
+        Initialize the store
+
+        Args:
+            store: The shared store
+            max_traces: Finished traces kept across all workers (and running
+                traces kept in this process)
+        """
+        self.store = store
+        self.max_traces = max_traces
+        self._running: "OrderedDict[str, QueryTrace]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def new_trace(self, question: str) -> QueryTrace:
+        """Create a trace for a new query, saved once it finishes"""
+        trace = QueryTrace(question, on_finish=self._save)
+        with self._lock:
+            self._running[trace.trace_id] = trace
+            while len(self._running) > self.max_traces:
+                self._running.popitem(last=False)
+        return trace
+
+    def _save(self, trace: QueryTrace):
+        with self._lock:
+            self._running.pop(trace.trace_id, None)
+        conn = self.store._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO traces (trace_id, trace, finished_at) VALUES (?, ?, ?)",
+            (trace.trace_id, json.dumps(trace.to_record(), default=str), trace.finished_at)
+        )
+        conn.execute(
+            "DELETE FROM traces WHERE trace_id IN ("
+            "SELECT trace_id FROM traces ORDER BY finished_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_traces,)
+        )
+
+    def get(self, trace_id: str) -> Optional[QueryTrace]:
+        """Get a trace by id, running in this process or finished in any"""
+        with self._lock:
+            trace = self._running.get(trace_id)
+        if trace is not None:
+            return trace
+        row = self.store._conn().execute("SELECT trace FROM traces WHERE trace_id = ?", (trace_id,)).fetchone()
+        return QueryTrace.from_record(json.loads(row[0])) if row else None
+
+    def clear(self) -> int:
+        """Drop the running traces held in memory (they are still saved when they finish)"""
+        with self._lock:
+            dropped = len(self._running)
+            self._running.clear()
+            return dropped
@@ -1,13 +1,119 @@
 """
 Simple database setup without pandas dependency
 """
+import argparse
 import sqlite3
 import csv
 import os
+import time
 from pathlib import Path
 
-def create_database():
-    """Create SQLite database from CSV files"""
+from approximate_query import build_trip_samples
+from feature_tables import build_feature_tables
+from partitions import partition_database, remove_stale_partitions
+
+def load_csv_files(cursor):
+    """Load the demographics, riders and trips tables from the cleaned CSVs"""
+    # Load demographics data
+    print("Loading demographics data...")
+    with open("data/csv_xlsx/clean_demographics.csv", 'r', encoding='utf-8') as file:
+        csv_reader = csv.reader(file)
+        headers = next(csv_reader)
+        
+        # Create table
+        cursor.execute(f'''
+            CREATE TABLE demographics (
+                {headers[0]} INTEGER,
+                {headers[1]} REAL
+            )
+        ''')
+        
+        # Insert data
+        for row in csv_reader:
+            cursor.execute(f'''
+                INSERT INTO demographics ({headers[0]}, {headers[1]})
+                VALUES (?, ?)
+            ''', row)
+    
+    print("Demographics data loaded successfully")
+    
+    # Load riders data
+    print("Loading riders data...")
+    with open("data/csv_xlsx/clean_riders.csv", 'r', encoding='utf-8') as file:
+        csv_reader = csv.reader(file)
+        headers = next(csv_reader)
+        
+        # Create table
+        cursor.execute(f'''
+            CREATE TABLE riders (
+                {headers[0]} INTEGER,
+                {headers[1]} INTEGER,
+                {headers[2]} REAL
+            )
+        ''')
+        
+        # Insert data
+        for row in csv_reader:
+            cursor.execute(f'''
+                INSERT INTO riders ({headers[0]}, {headers[1]}, {headers[2]})
+                VALUES (?, ?, ?)
+            ''', row)
+    
+    print("Riders data loaded successfully")
+    
+    # Load trips data
+    print("Loading trips data...")
+    with open("data/csv_xlsx/clean_trips.csv", 'r', encoding='utf-8') as file:
+        csv_reader = csv.reader(file)
+        headers = next(csv_reader)
+        
+        # Create table with all columns
+        create_sql = f'''
+            CREATE TABLE trips (
+                {headers[0]} INTEGER,
+                {headers[1]} INTEGER,
+                {headers[2]} REAL,
+                {headers[3]} REAL,
+                {headers[4]} REAL,
+                {headers[5]} REAL,
+                {headers[6]} TEXT,
+                {headers[7]} TEXT,
+                {headers[8]} TEXT,
+                {headers[9]} INTEGER,
+                {headers[10]} TEXT,
+                {headers[11]} INTEGER,
+                {headers[12]} TEXT,
+                {headers[13]} TEXT,
+                {headers[14]} TEXT,
+                {headers[15]} TEXT,
+                {headers[16]} INTEGER
+            )
+        '''
+        cursor.execute(create_sql)
+        
+        # Insert data
+        for row in csv_reader:
+            cursor.execute(f'''
+                INSERT INTO trips ({', '.join(headers)})
+                VALUES ({', '.join(['?' for _ in headers])})
+            ''', row)
+    
+    print("Trips data loaded successfully")
+
+def create_database(xlsx_path=None, workers=1, chunk_size=5000, sample_fraction=0.01, partition=False):
+    """
+    Create SQLite database from the cleaned CSV files, or from the raw workbook
+    
+    Args:
+        xlsx_path: Path to the raw workbook; when set, it is streamed and
+            cleaned instead of reading the CSVs
+        workers: Worker processes used to clean workbook chunks
+        chunk_size: Workbook rows cleaned and inserted per batch
+        sample_fraction: Share of each (date, hour) stratum kept in the
+            trip samples used for approximate answers
+        partition: Move trips and riders into one SQLite file per month (older
+            months are merged by year to stay within the attach limit)
+    """
     
     # Create database directory if it doesn't exist
     db_dir = Path("data/database")
@@ -16,100 +122,24 @@ def create_database():
     # Database path
     db_path = db_dir / "fetiipro.db"
     
-    # Remove existing database if it exists
-    if db_path.exists():
-        os.remove(db_path)
+    # Build into a temporary file that is renamed over the database at the
+    # end, so a running server never sees a missing or half-built file
+    build_path = db_dir / f"fetiipro.db.building-{os.getpid()}"
+    if build_path.exists():
+        os.remove(build_path)
     
     # Create connection
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(build_path)
     cursor = conn.cursor()
     
     try:
-        # Load demographics data
-        print("Loading demographics data...")
-        with open("data/csv_xlsx/clean_demographics.csv", 'r', encoding='utf-8') as file:
-            csv_reader = csv.reader(file)
-            headers = next(csv_reader)
-            
-            # Create table
-            cursor.execute(f'''
-                CREATE TABLE demographics (
-                    {headers[0]} INTEGER,
-                    {headers[1]} REAL
-                )
-            ''')
-            
-            # Insert data
-            for row in csv_reader:
-                cursor.execute(f'''
-                    INSERT INTO demographics ({headers[0]}, {headers[1]})
-                    VALUES (?, ?)
-                ''', row)
-        
-        print("Demographics data loaded successfully")
-        
-        # Load riders data
-        print("Loading riders data...")
-        with open("data/csv_xlsx/clean_riders.csv", 'r', encoding='utf-8') as file:
-            csv_reader = csv.reader(file)
-            headers = next(csv_reader)
-            
-            # Create table
-            cursor.execute(f'''
-                CREATE TABLE riders (
-                    {headers[0]} INTEGER,
-                    {headers[1]} INTEGER,
-                    {headers[2]} REAL
-                )
-            ''')
-            
-            # Insert data
-            for row in csv_reader:
-                cursor.execute(f'''
-                    INSERT INTO riders ({headers[0]}, {headers[1]}, {headers[2]})
-                    VALUES (?, ?, ?)
-                ''', row)
-        
-        print("Riders data loaded successfully")
-        
-        # Load trips data
-        print("Loading trips data...")
-        with open("data/csv_xlsx/clean_trips.csv", 'r', encoding='utf-8') as file:
-            csv_reader = csv.reader(file)
-            headers = next(csv_reader)
-            
-            # Create table with all columns
-            create_sql = f'''
-                CREATE TABLE trips (
-                    {headers[0]} INTEGER,
-                    {headers[1]} INTEGER,
-                    {headers[2]} REAL,
-                    {headers[3]} REAL,
-                    {headers[4]} REAL,
-                    {headers[5]} REAL,
-                    {headers[6]} TEXT,
-                    {headers[7]} TEXT,
-                    {headers[8]} TEXT,
-                    {headers[9]} INTEGER,
-                    {headers[10]} TEXT,
-                    {headers[11]} INTEGER,
-                    {headers[12]} TEXT,
-                    {headers[13]} TEXT,
-                    {headers[14]} TEXT,
-                    {headers[15]} TEXT,
-                    {headers[16]} INTEGER
-                )
-            '''
-            cursor.execute(create_sql)
-            
-            # Insert data
-            for row in csv_reader:
-                cursor.execute(f'''
-                    INSERT INTO trips ({', '.join(headers)})
-                    VALUES ({', '.join(['?' for _ in headers])})
-                ''', row)
-        
-        print("Trips data loaded successfully")
+        if xlsx_path:
+            from xlsx_loader import load_xlsx
+            # Bulk load: the file is rebuilt from scratch if anything fails
+            cursor.execute("PRAGMA synchronous=OFF")
+            load_xlsx(conn, xlsx_path, chunk_size=chunk_size, workers=workers)
+        else:
+            load_csv_files(cursor)
         
         # Create indexes for better performance
         print("Creating indexes...")
@@ -119,6 +149,14 @@ def create_database():
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_trips_booking_user_id ON trips(booking_user_id)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_trips_date ON trips(date)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_trips_hour ON trips(hour)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_trips_trip_id ON trips(trip_id)")
+        
+        # Precompute rider relationship tables so the agent avoids self-joins
+        build_feature_tables(conn)
+        
+        # Stratified samples for approximate answers on very large tables
+        print("Building trip samples...")
+        build_trip_samples(cursor, fraction=sample_fraction)
         
         # Commit changes
         conn.commit()
@@ -127,12 +165,39 @@ def create_database():
     except Exception as e:
         print(f"Error creating database: {e}")
         conn.rollback()
+        conn.close()
+        os.remove(build_path)
         raise
     finally:
         conn.close()
     
+    if partition:
+        # Feature tables and samples above are built from the full tables first
+        print("Partitioning trips and riders by month...")
+        # A new directory, so a running server keeps reading the old files
+        partition_dir = db_path.with_name(f"{db_path.stem}_partitions-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}")
+        partition_database(build_path, partition_dir=partition_dir)
+    
+    os.replace(build_path, db_path)
+    if partition:
+        removed = remove_stale_partitions(db_path)
+        if removed:
+            print(f"Removed {len(removed)} stale partition directories")
     return db_path
 
 if __name__ == "__main__":
-    db_path = create_database()
+    parser = argparse.ArgumentParser(description="Build the FetiiPro SQLite database")
+    parser.add_argument("--xlsx", nargs="?", const="FetiiAI_Data_Austin.xlsx",
+                        help="Load from the raw workbook instead of the cleaned CSVs")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes for cleaning workbook chunks")
+    parser.add_argument("--chunk-size", type=int, default=5000,
+                        help="Workbook rows per cleaning chunk")
+    parser.add_argument("--sample-fraction", type=float, default=0.01,
+                        help="Share of trips per (date, hour) kept for approximate answers")
+    parser.add_argument("--partition", action="store_true",
+                        help="Store trips and riders in one SQLite file per month")
+    args = parser.parse_args()
+    db_path = create_database(args.xlsx, workers=args.workers, chunk_size=args.chunk_size,
+                              sample_fraction=args.sample_fraction, partition=args.partition)
     print(f"Database created at: {db_path}")
@@ -0,0 +1,221 @@
+"""
+Custom LangChain SQL tools for the FetiiPro chatbot
+"""
+from collections import Counter
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from langchain_community.agent_toolkits import SQLDatabaseToolkit
+from langchain_community.tools.sql_database.tool import QuerySQLCheckerTool
+from langchain_core.callbacks import CallbackManagerForToolRun
+from langchain_core.tools import BaseTool
+from sqlalchemy.exc import SQLAlchemyError
+
+try:
+    from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
+except ImportError:  # Older langchain-community only has the old spelling
+    from langchain_community.tools.sql_database.tool import QuerySQLDataBaseTool as QuerySQLDatabaseTool
+
+from approximate_query import get_current_approximation
+
+
+class LocalQueryCheckerTool(BaseTool):
+    """Checks SQL locally instead of asking the LLM to review it"""
+
+    name: str = "sql_db_query_checker"
+    description: str = """
+    Use this tool to double check if your query is correct before executing it.
+    Always use this tool before executing a query with sql_db_query!
+    Input is a single SQL query. Returns the query if it is valid, or a list of
+    problems (unknown tables/columns, write statements, SQLite errors) to fix.
+    """
+    validator: Any = None
+
+    def _run(self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        """Validate the query"""
+        return self.validator.format_result(self.validator.validate(query))
+
+
+def truncate_value(value: Any, max_chars: int) -> Any:
+    """Shorten long strings (such as full addresses) for the prompt"""
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars - 3] + "..."
+    return value
+
+
+def format_number(value: Any) -> str:
+    """Format a summary number compactly"""
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+
+def summarize_rows(columns: List[str], batches: Iterable[Sequence[Sequence[Any]]], max_rows: int,
+                   top_k: int = 5) -> Dict[str, Any]:
+    """
+    Summarize a running result set in one pass, without storing it
+
+    Numeric columns get min/max/mean, other columns the top_k most frequent
+    values; every column gets its non-null and distinct counts (the same
+    summaries as ResultStore.summarize).
+
+    Args:
+        columns: Column names
+        batches: Row batches, consumed until exhausted or max_rows is reached
+        max_rows: Rows summarized at most
+
+    Returns:
+        Dict with row_count, truncated and one summary per column
+    """
+    counts = [Counter() for _ in columns]
+    row_count = 0
+    truncated = False
+    for rows in batches:
+        if row_count + len(rows) > max_rows:
+            rows = rows[:max_rows - row_count]
+            truncated = True
+        for row in rows:
+            for counter, value in zip(counts, row):
+                if value is not None:
+                    counter[value] += 1
+        row_count += len(rows)
+        if truncated:
+            break
+
+    summaries = []
+    for name, counter in zip(columns, counts):
+        non_null = sum(counter.values())
+        summary = {"column": name, "non_null": non_null, "distinct": len(counter)}
+        if non_null and all(isinstance(value, (int, float)) for value in counter):
+            summary.update(
+                min=min(counter),
+                max=max(counter),
+                mean=sum(value * count for value, count in counter.items()) / non_null
+            )
+        else:
+            summary["top"] = counter.most_common(top_k)
+        summaries.append(summary)
+    return {"row_count": row_count, "truncated": truncated, "summaries": summaries}
+
+
+def format_summary(summary: Dict[str, Any], max_chars: int) -> str:
+    """Format one column summary (see summarize_rows) as a line"""
+    text = f"- {summary['column']}: {summary['distinct']} distinct"
+    if summary["non_null"] == 0:
+        return text + ", all null"
+    if "mean" in summary:
+        return text + (f", min {format_number(summary['min'])}, max {format_number(summary['max'])}, "
+                       f"mean {format_number(summary['mean'])}")
+    top = ", ".join(f"{truncate_value(value, max_chars)!r} ({count})" for value, count in summary["top"])
+    return text + f"; most frequent: {top}"
+
+
+class CompactQueryTool(QuerySQLDatabaseTool):
+    """
+    SQL query tool that keeps observations small. Long strings are truncated,
+    and results over max_rows are replaced by their first rows plus column
+    summaries computed locally in one pass over at most max_summary_rows.
+    Nothing is stored: the answer's final SQL is materialized for export
+    only when the caller asks for results.
+    """
+
+    engine: Any = None
+    max_rows: int = 20
+    max_value_chars: int = 60
+    max_summary_rows: int = 50000
+
+    def _run(self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        """Execute the query and return a compact observation"""
+        if self.engine is None:
+            return super()._run(query, run_manager)
+        try:
+            with self.engine.connect() as connection:
+                result = connection.exec_driver_sql(query)
+                if not result.returns_rows:
+                    return ""
+                columns = list(result.keys())
+                head = result.fetchmany(self.max_rows + 1)
+                if len(head) <= self.max_rows:
+                    return self.format_rows(head) if head else ""
+                batches = chain([head], iter(lambda: result.fetchmany(5000), []))
+                summary = summarize_rows(columns, batches, self.max_summary_rows)
+        except SQLAlchemyError as e:
+            return f"Error: {e}"
+        return self.format_compacted(columns, head[:self.max_rows], summary)
+
+    def format_rows(self, rows: Sequence[Sequence[Any]]) -> str:
+        """Format rows as the stock tool does (a list of tuples), with long strings truncated"""
+        return str([tuple(truncate_value(value, self.max_value_chars) for value in row) for row in rows])
+
+    def format_compacted(self, columns: List[str], rows: Sequence[Sequence[Any]],
+                         summary: Dict[str, Any]) -> str:
+        """Format the first rows of a large result with summaries of its rows"""
+        if summary["truncated"]:
+            header = f"Query returned over {summary['row_count']} rows; showing the first {len(rows)}."
+            summaries_header = f"Column summaries over the first {summary['row_count']} rows:"
+        else:
+            header = f"Query returned {summary['row_count']} rows; showing the first {len(rows)}."
+            summaries_header = "Column summaries over all rows:"
+        lines = [header, f"Columns: {', '.join(columns)}", self.format_rows(rows), summaries_header]
+        lines.extend(format_summary(column, self.max_value_chars) for column in summary["summaries"])
+        lines.append("To answer, aggregate in SQL (COUNT, GROUP BY, ORDER BY ... LIMIT) "
+                     "instead of reading more rows.")
+        return "\n".join(lines)
+
+
+class ApproximateQueryTool(CompactQueryTool):
+    """
+    SQL query tool that answers from the stratified samples when the current
+    query accepts approximate answers, and runs exactly otherwise
+    """
+
+    approximator: Any = None
+
+    def _run(self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        """Execute the query, approximately if allowed and possible"""
+        context = get_current_approximation()
+        if context is not None and context.enabled and self.approximator is not None:
+            try:
+                estimate = self.approximator.estimate(query)
+            except Exception as e:
+                # Fall through to exact execution, which reports real SQL errors
+                print(f"⚠️ Approximate execution failed, running exactly: {e}")
+                estimate = None
+            if estimate is not None:
+                context.estimates.append(estimate)
+                return self.approximator.format_estimate(estimate)
+        return super()._run(query, run_manager)
+
+
+class LocalSQLDatabaseToolkit(SQLDatabaseToolkit):
+    """
+    SQL toolkit whose query checker runs locally without an LLM call and whose
+    query tool compacts large results and can answer approximately from samples
+    """
+
+    validator: Any = None
+    approximator: Any = None
+    engine: Any = None
+    max_observation_rows: int = 20
+    max_value_chars: int = 60
+    max_summary_rows: int = 50000
+
+    def get_tools(self) -> List[BaseTool]:
+        """Get the tools in the toolkit"""
+        tools = []
+        for tool in super().get_tools():
+            if isinstance(tool, QuerySQLCheckerTool):
+                tool = LocalQueryCheckerTool(validator=self.validator)
+            elif isinstance(tool, QuerySQLDatabaseTool):
+                tool = ApproximateQueryTool(
+                    db=self.db,
+                    name=tool.name,
+                    description=tool.description,
+                    approximator=self.approximator,
+                    engine=self.engine,
+                    max_rows=self.max_observation_rows,
+                    max_value_chars=self.max_value_chars,
+                    max_summary_rows=self.max_summary_rows
+                )
+            tools.append(tool)
+        return tools
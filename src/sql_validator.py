@@ -0,0 +1,209 @@
+"""
+Local SQL validation for the FetiiPro chatbot
+Checks agent-generated SQL against the cached schema and SQLite's query planner
+without spending an LLM call
+"""
+import difflib
+import re
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+# Statements the agent is never allowed to run (REPLACE is omitted because it
+# is also a string function; REPLACE INTO is caught by the leading keyword check)
+WRITE_KEYWORDS = {
+    "INSERT", "UPDATE", "DELETE", "DROP", "ALTER", "CREATE",
+    "ATTACH", "DETACH", "PRAGMA", "VACUUM", "REINDEX", "TRUNCATE", "GRANT"
+}
+
+# Keywords that can follow a table name where an alias would otherwise be
+ALIAS_STOPWORDS = {
+    "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "OUTER",
+    "NATURAL", "ON", "USING", "GROUP", "ORDER", "LIMIT", "HAVING", "UNION",
+    "EXCEPT", "INTERSECT", "WINDOW", "AS"
+}
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_TABLE_REF = re.compile(
+    r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w]*(?:\.[A-Za-z_][\w]*)?)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?",
+    re.IGNORECASE
+)
+_CTE_NAME = re.compile(r"(?:\bWITH(?:\s+RECURSIVE)?|,)\s*([A-Za-z_]\w*)\s+AS\s*\(", re.IGNORECASE)
+_QUALIFIED_COLUMN = re.compile(r"\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)\b")
+
+
+def connect_readonly(db_path: str) -> sqlite3.Connection:
+    """Open a read-only connection to a SQLite database file"""
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+
+
+class SQLValidator:
+    """
+    Validates read-only SQL queries before the agent executes them.
+    Tables and columns are verified against a cached schema snapshot, and
+    the query is planned with EXPLAIN QUERY PLAN to catch remaining errors
+    and flag full table scans.
+    """
+
+    def __init__(self, db_path: str, connect: Optional[Callable[[], sqlite3.Connection]] = None):
+        """
+        Initialize the validator
+
+        Args:
+            db_path: Path to the SQLite database
+            connect: Optional factory returning a sqlite3 connection
+        """
+        self.db_path = db_path
+        self._connect = connect or (lambda: connect_readonly(self.db_path))
+        self._schema: Optional[Dict[str, List[str]]] = None
+        self._lock = threading.Lock()
+
+    def get_schema(self) -> Dict[str, List[str]]:
+        """Get the cached schema snapshot (table -> column names)"""
+        with self._lock:
+            if self._schema is None:
+                self._schema = self._load_schema()
+            return self._schema
+
+    def refresh_schema(self):
+        """Drop the cached schema so it is reloaded on next use"""
+        with self._lock:
+            self._schema = None
+
+    def _load_schema(self) -> Dict[str, List[str]]:
+        """Read table and view columns from the database"""
+        conn = self._connect()
+        try:
+            schema = {}
+            rows = conn.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') "
+                "AND name NOT LIKE 'sqlite_%'"
+            ).fetchall()
+            for (name,) in rows:
+                columns = conn.execute(f'PRAGMA table_info("{name}")').fetchall()
+                schema[name.lower()] = [col[1].lower() for col in columns]
+            return schema
+        finally:
+            conn.close()
+
+    def validate(self, sql: str) -> Dict[str, Any]:
+        """
+        Validate a SQL query
+
+        Args:
+            sql: The SQL query generated by the agent
+
+        Returns:
+            Dictionary with valid flag, cleaned query, errors, warnings and plan
+        """
+        query = sql.strip().strip("`").strip()
+        if query.lower().startswith("sql"):
+            query = query[3:].strip()
+        query = query.rstrip(";").strip()
+
+        result = {"valid": False, "query": query, "errors": [], "warnings": [], "plan": []}
+
+        if not query:
+            result["errors"].append("Query is empty.")
+            return result
+
+        # Work on a copy without string literals so their contents are ignored
+        stripped = _STRING_LITERAL.sub("''", query)
+
+        if ";" in stripped:
+            result["errors"].append("Only a single statement is allowed; remove extra ';' separated statements.")
+            return result
+
+        tokens = {token.upper() for token in re.findall(r"[A-Za-z_]+", stripped)}
+        first_word = stripped.split(None, 1)[0].upper()
+        writes = sorted(tokens & WRITE_KEYWORDS)
+        if first_word not in ("SELECT", "WITH") or writes:
+            result["errors"].append(
+                "Only read-only SELECT queries are allowed"
+                + (f" (found {', '.join(writes)})." if writes else ".")
+            )
+            return result
+
+        schema = self.get_schema()
+        self._check_identifiers(stripped, schema, result["errors"])
+        if result["errors"]:
+            return result
+
+        self._explain(query, result)
+        result["valid"] = not result["errors"]
+        return result
+
+    def _check_identifiers(self, query: str, schema: Dict[str, List[str]], errors: List[str]):
+        """Verify referenced tables and qualified columns exist"""
+        cte_names = {name.lower() for name in _CTE_NAME.findall(query)}
+        aliases = {}
+
+        for table, alias in _TABLE_REF.findall(query):
+            table_name = table.split(".")[-1].lower()
+            if table_name in cte_names:
+                continue
+            if table_name not in schema:
+                errors.append(f"Unknown table '{table}'.{self._suggest(table_name, schema.keys())}")
+                continue
+            aliases[table_name] = table_name
+            if alias and alias.upper() not in ALIAS_STOPWORDS:
+                aliases[alias.lower()] = table_name
+
+        for qualifier, column in _QUALIFIED_COLUMN.findall(query):
+            table_name = aliases.get(qualifier.lower())
+            if table_name is None:
+                continue
+            if column.lower() not in schema[table_name]:
+                errors.append(
+                    f"Unknown column '{qualifier}.{column}' in table '{table_name}'."
+                    f"{self._suggest(column.lower(), schema[table_name])}"
+                    f" Available columns: {', '.join(schema[table_name])}."
+                )
+
+    def _explain(self, query: str, result: Dict[str, Any]):
+        """Plan the query with SQLite to catch errors and flag full scans"""
+        conn = self._connect()
+        try:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+        except sqlite3.Error as e:
+            message = str(e)
+            match = re.search(r"no such (?:column|table): ([\w.]+)", message)
+            hint = ""
+            if match:
+                name = match.group(1).split(".")[-1].lower()
+                candidates = set(self.get_schema().keys())
+                for columns in self.get_schema().values():
+                    candidates.update(columns)
+                hint = self._suggest(name, candidates)
+            result["errors"].append(f"SQLite rejected the query: {message}.{hint}")
+            return
+        finally:
+            conn.close()
+
+        for row in plan:
+            detail = row[-1]
+            result["plan"].append(detail)
+            scan = re.match(r"SCAN (?:TABLE )?(\w+)(.*)", detail)
+            if scan and "INDEX" not in scan.group(2).upper():
+                result["warnings"].append(
+                    f"Full scan of '{scan.group(1)}'; filter on an indexed column if possible."
+                )
+
+    @staticmethod
+    def _suggest(name: str, candidates) -> str:
+        """Build a 'did you mean' hint"""
+        matches = difflib.get_close_matches(name, list(candidates), n=3, cutoff=0.6)
+        if matches:
+            return f" Did you mean: {', '.join(matches)}?"
+        return ""
+
+    def format_result(self, result: Dict[str, Any]) -> str:
+        """Format a validation result as a message for the agent"""
+        if not result["valid"]:
+            return "Query is invalid. Fix these problems and check again:\n" + "\n".join(
+                f"- {error}" for error in result["errors"]
+            )
+        message = result["query"]
+        if result["warnings"]:
+            message += "\n\n-- Warnings:\n" + "\n".join(f"-- {warning}" for warning in result["warnings"])
+        return message
@@ -0,0 +1,172 @@
+"""
+Per-query tracing for the FetiiPro chatbot
+Records timed spans (LLM calls, tool calls, SQL, formatting) for each query
+and exports them as JSON or Chrome trace format
+"""
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+
+class QueryTrace:
+    """The spans recorded while answering one question"""
+
+    def __init__(self, question: str, trace_id: Optional[str] = None,
+                 on_finish: Optional[Callable[["QueryTrace"], None]] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.question = question
+        self.started_at = time.time()
+        self.finished_at = None
+        self.pid = os.getpid()
+        self.spans: List[Dict[str, Any]] = []
+        self.on_finish = on_finish
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "QueryTrace":
+        """Rebuild a trace saved with to_record()"""
+        trace = cls(record["question"], trace_id=record["trace_id"])
+        trace.started_at = record["started_at"]
+        trace.finished_at = record["finished_at"]
+        trace.pid = record["pid"]
+        trace.spans = record["spans"]
+        return trace
+
+    def start_span(self, name: str, category: str, parent_id: Optional[int] = None, **attributes) -> int:
+        """
+        Open a span
+
+        Args:
+            name: Span name, e.g. "llm:gpt-4" or "tool:sql_db_query"
+            category: Span category (llm, tool, sql, agent, cache, format...)
+            parent_id: Id of the enclosing span, if any
+            **attributes: Extra attributes stored with the span
+
+        Returns:
+            The new span's id
+        """
+        with self._lock:
+            span_id = next(self._ids)
+            self.spans.append({
+                "id": span_id,
+                "parent_id": parent_id,
+                "name": name,
+                "category": category,
+                "start": time.time(),
+                "end": None,
+                "thread": threading.get_ident(),
+                "attributes": attributes
+            })
+            return span_id
+
+    def end_span(self, span_id: int, **attributes):
+        """Close a span, merging in any final attributes (e.g. token counts)"""
+        with self._lock:
+            for span in reversed(self.spans):
+                if span["id"] == span_id:
+                    span["end"] = time.time()
+                    span["attributes"].update(attributes)
+                    return
+
+    def finish(self):
+        """Mark the trace as complete"""
+        self.finished_at = time.time()
+        if self.on_finish is not None:
+            self.on_finish(self)
+
+    def to_record(self) -> Dict[str, Any]:
+        """Get the raw trace for storage (see from_record)"""
+        with self._lock:
+            spans = [dict(span, attributes=dict(span["attributes"])) for span in self.spans]
+        return {
+            "trace_id": self.trace_id,
+            "question": self.question,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "pid": self.pid,
+            "spans": spans
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the trace as a JSON-serializable dictionary"""
+        with self._lock:
+            spans = []
+            for span in self.spans:
+                end = span["end"] if span["end"] is not None else time.time()
+                spans.append(dict(
+                    span,
+                    offset_ms=round((span["start"] - self.started_at) * 1000, 2),
+                    duration_ms=round((end - span["start"]) * 1000, 2)
+                ))
+        totals: Dict[str, float] = {}
+        for span in spans:
+            if span["parent_id"] is None or span["category"] in ("llm", "sql"):
+                totals[span["category"]] = totals.get(span["category"], 0) + span["duration_ms"]
+        finished = self.finished_at or time.time()
+        return {
+            "trace_id": self.trace_id,
+            "question": self.question,
+            "started_at": self.started_at,
+            "duration_ms": round((finished - self.started_at) * 1000, 2),
+            "complete": self.finished_at is not None,
+            "time_by_category_ms": totals,
+            "spans": spans
+        }
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """Export the trace in Chrome trace event format (chrome://tracing, Perfetto)"""
+        events = []
+        pid = self.pid
+        with self._lock:
+            for span in self.spans:
+                end = span["end"] if span["end"] is not None else time.time()
+                events.append({
+                    "name": span["name"],
+                    "cat": span["category"],
+                    "ph": "X",
+                    "ts": int(span["start"] * 1_000_000),
+                    "dur": int((end - span["start"]) * 1_000_000),
+                    "pid": pid,
+                    "tid": span["thread"],
+                    "args": span["attributes"]
+                })
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"trace_id": self.trace_id, "question": self.question}
+        }
+
+
+class TraceStore:
+    """Keeps the most recent query traces in memory"""
+
+    def __init__(self, max_traces: int = 200):
+        self.max_traces = max_traces
+        self._traces: "OrderedDict[str, QueryTrace]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def new_trace(self, question: str) -> QueryTrace:
+        """Create and store a trace for a new query"""
+        trace = QueryTrace(question)
+        with self._lock:
+            self._traces[trace.trace_id] = trace
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+        return trace
+
+    def get(self, trace_id: str) -> Optional[QueryTrace]:
+        """Get a trace by id"""
+        with self._lock:
+            return self._traces.get(trace_id)
+
+    def clear(self) -> int:
+        """Drop all stored traces and return how many were dropped"""
+        with self._lock:
+            dropped = len(self._traces)
+            self._traces.clear()
+            return dropped
@@ -0,0 +1,156 @@
+"""
+Cache prewarming and background refresh for the FetiiPro chatbot
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from answer_cache import APPROXIMATE_SUFFIX
+
+
+
+class WarmupState:
+    """Tracks whether the server has finished warming up"""
+
+    def __init__(self):
+        self.status = "cold"
+        self.started_at = None
+        self.finished_at = None
+        self.questions_warmed = 0
+        self.errors: List[str] = []
+        self._lock = threading.Lock()
+
+    def update(self, **fields):
+        """Update state fields atomically"""
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+
+    def is_ready(self) -> bool:
+        """The server is ready once warmup finished (even with some failures)"""
+        return self.status in ("warm", "degraded")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the state as a JSON-serializable dictionary"""
+        with self._lock:
+            duration = None
+            if self.started_at and self.finished_at:
+                duration = self.finished_at - self.started_at
+            return {
+                "status": self.status,
+                "ready": self.is_ready(),
+                "questions_warmed": self.questions_warmed,
+                "warmup_seconds": duration,
+                "errors": self.errors[-5:]
+            }
+
+
+def get_warmup_questions(chatbot, top_n: int = 10) -> List[str]:
+    """Get the sample questions plus the top-N historical questions, deduplicated"""
+    questions = []
+    seen = set()
+    for question in chatbot.get_sample_questions() + chatbot.example_store.get_top_questions(top_n):
+        key = question.strip().lower()
+        if key not in seen:
+            seen.add(key)
+            questions.append(question)
+    return questions
+
+
+def warm_up(get_chatbot: Callable[[], Any], state: WarmupState, top_n: int = 10,
+            answer_questions: bool = True):
+    """
+    Build the chatbot, load the schema snapshot and pre-answer common questions
+
+    Args:
+        get_chatbot: Function returning the (possibly not yet built) chatbot
+        state: WarmupState to update as warmup progresses
+        top_n: Number of historical questions to pre-answer
+        answer_questions: Whether to pre-answer questions (False when another
+            worker fills a shared answer cache)
+    """
+    state.update(status="warming", started_at=time.time())
+    try:
+        chatbot = get_chatbot()
+        chatbot.validator.refresh_schema()
+        chatbot.validator.get_schema()
+
+        questions = get_warmup_questions(chatbot, top_n) if answer_questions else []
+        print(f"🔥 Warming up {len(questions)} questions...")
+        errors = []
+        for question in questions:
+            result = chatbot.process_query(question)
+            if not result["success"]:
+                errors.append(f"{question}: {result['error']}")
+        state.update(
+            status="degraded" if errors else "warm",
+            questions_warmed=len(questions) - len(errors),
+            errors=errors,
+            finished_at=time.time()
+        )
+        print(f"🔥 Warmup finished in {state.finished_at - state.started_at:.1f}s")
+    except Exception as e:
+        state.update(status="failed", errors=[str(e)], finished_at=time.time())
+        print(f"❌ Warmup failed: {e}")
+
+
+class CacheRefresher:
+    """
+    Background thread that watches the database version and re-runs cached
+    questions when the data changes, so users never see a cold cache after
+    a rebuild.
+    """
+
+    def __init__(self, get_chatbot: Callable[[], Any], interval: float = 30.0):
+        """
+        Initialize the refresher
+
+        Args:
+            get_chatbot: Function returning the chatbot, or None while it is
+                not built; it is called on every check so a rebuilt chatbot
+                is picked up and an evicted one is not kept alive
+            interval: Seconds between database version checks
+        """
+        self.get_chatbot = get_chatbot
+        self.interval = interval
+        self.refreshes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start watching in a daemon thread"""
+        self._thread = threading.Thread(target=self._run, name="cache-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the watcher"""
+        self._stop.set()
+
+    def _run(self):
+        chatbot, version = None, None
+        while not self._stop.wait(self.interval):
+            try:
+                current_chatbot = self.get_chatbot()
+            except Exception as e:
+                print(f"⚠️ Cache refresher could not get the chatbot: {e}")
+                continue
+            if current_chatbot is not chatbot:
+                # Not built yet, or rebuilt after being evicted from the pool
+                chatbot = current_chatbot
+                version = chatbot.get_db_version() if chatbot is not None else None
+                continue
+            current = chatbot.get_db_version() if chatbot is not None else None
+            if current is None or current == version:
+                continue
+            version = current
+            self.refresh(chatbot)
+
+    def refresh(self, chatbot):
+        """Reload the schema and recompute all cached answers"""
+        entries = chatbot.answer_cache.get_entries()
+        print(f"🔄 Database changed, refreshing {len(entries)} cached answers...")
+        chatbot.validator.refresh_schema()
+        for key, question in entries:
+            # Approximate answers are recomputed as approximate answers
+            chatbot.process_query(question, use_cache=False, approximate=key.endswith(APPROXIMATE_SUFFIX))
+        self.refreshes += 1
@@ -0,0 +1,292 @@
+"""
+Streaming loader for the raw Fetii workbook
+Reads FetiiAI_Data_Austin.xlsx sheet by sheet in read-only mode, cleans rows
+in bounded-size chunks (optionally in worker processes) and writes them
+straight into SQLite
+"""
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from openpyxl import load_workbook
+from openpyxl.utils.datetime import from_excel
+
+TRIPS_SHEET = "Trip Data"
+RIDERS_SHEET = "Checked in User ID's"
+DEMOGRAPHICS_SHEET = "Customer Demographics"
+
+# Workbook header -> database column
+TRIP_COLUMNS = {
+    "Trip ID": "trip_id",
+    "Booking User ID": "booking_user_id",
+    "Pick Up Latitude": "pick_up_latitude",
+    "Pick Up Longitude": "pick_up_longitude",
+    "Drop Off Latitude": "drop_off_latitude",
+    "Drop Off Longitude": "drop_off_longitude",
+    "Pick Up Address": "pick_up_address",
+    "Drop Off Address": "drop_off_address",
+    "Trip Date and Time": "trip_datetime",
+    "Total Passengers": "passenger_count",
+}
+RIDER_COLUMNS = {"Trip ID": "trip_id", "User ID": "user_id"}
+DEMOGRAPHIC_COLUMNS = {"User ID": "user_id", "Age": "age"}
+
+# Same column order and types as the tables built from the cleaned CSVs
+TRIPS_TABLE = [
+    ("trip_id", "INTEGER"),
+    ("booking_user_id", "INTEGER"),
+    ("pick_up_latitude", "REAL"),
+    ("pick_up_longitude", "REAL"),
+    ("drop_off_latitude", "REAL"),
+    ("drop_off_longitude", "REAL"),
+    ("pick_up_address", "TEXT"),
+    ("drop_off_address", "TEXT"),
+    ("trip_datetime", "TEXT"),
+    ("passenger_count", "INTEGER"),
+    ("date", "TEXT"),
+    ("hour", "INTEGER"),
+    ("day_of_week", "TEXT"),
+    ("is_weekend", "TEXT"),
+    ("time_of_day", "TEXT"),
+    ("group_size_from_checked", "TEXT"),
+    ("group_size", "INTEGER"),
+]
+RIDERS_TABLE = [("trip_id", "INTEGER"), ("user_id", "INTEGER"), ("age", "REAL")]
+DEMOGRAPHICS_TABLE = [("user_id", "INTEGER"), ("age", "REAL")]
+
+DAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+
+def get_time_of_day(hour: int) -> str:
+    """Bucket an hour of the day the same way the cleaned CSVs do"""
+    if 6 <= hour < 12:
+        return "morning"
+    if 12 <= hour < 17:
+        return "afternoon"
+    if 17 <= hour < 21:
+        return "evening"
+    return "night"
+
+
+def to_int(value: Any) -> Optional[int]:
+    """Convert a cell value to an int, treating blanks as null"""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    return int(float(value))
+
+
+def to_float(value: Any) -> Optional[float]:
+    """Convert a cell value to a float, treating blanks as null"""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    return float(value)
+
+
+def to_datetime(value: Any) -> Optional[datetime]:
+    """Convert a cell value (datetime, Excel serial number or text) to a datetime"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        value = from_excel(value)
+    elif isinstance(value, str):
+        value = datetime.fromisoformat(value.strip())
+    # Serial numbers carry float noise; round to the nearest second
+    return (value + timedelta(microseconds=500000)).replace(microsecond=0)
+
+
+def clean_trip_rows(rows: List[Dict[str, Any]]) -> List[Tuple]:
+    """
+    Clean a chunk of trip rows and derive the time columns
+
+    group_size_from_checked is filled in after riders are loaded, and
+    group_size falls back to it where the passenger count is missing.
+
+    Args:
+        rows: Raw rows keyed by database column name
+
+    Returns:
+        Tuples in TRIPS_TABLE column order
+    """
+    cleaned = []
+    for row in rows:
+        trip_id = to_int(row.get("trip_id"))
+        trip_datetime = to_datetime(row.get("trip_datetime"))
+        if trip_id is None or trip_datetime is None:
+            continue
+        day_of_week = DAY_NAMES[trip_datetime.weekday()]
+        passenger_count = to_int(row.get("passenger_count"))
+        cleaned.append((
+            trip_id,
+            to_int(row.get("booking_user_id")),
+            to_float(row.get("pick_up_latitude")),
+            to_float(row.get("pick_up_longitude")),
+            to_float(row.get("drop_off_latitude")),
+            to_float(row.get("drop_off_longitude")),
+            (row.get("pick_up_address") or "").strip().lower() or None,
+            (row.get("drop_off_address") or "").strip().lower() or None,
+            trip_datetime.strftime("%Y-%m-%d %H:%M:%S"),
+            passenger_count,
+            trip_datetime.strftime("%Y-%m-%d"),
+            trip_datetime.hour,
+            day_of_week,
+            str(day_of_week in ("Saturday", "Sunday")),
+            get_time_of_day(trip_datetime.hour),
+            None,
+            passenger_count,
+        ))
+    return cleaned
+
+
+def clean_rider_rows(rows: List[Dict[str, Any]]) -> List[Tuple]:
+    """Clean a chunk of checked-in rider rows; ages are joined in afterwards"""
+    cleaned = []
+    for row in rows:
+        trip_id, user_id = to_int(row.get("trip_id")), to_int(row.get("user_id"))
+        if trip_id is not None and user_id is not None:
+            cleaned.append((trip_id, user_id, None))
+    return cleaned
+
+
+def clean_demographic_rows(rows: List[Dict[str, Any]]) -> List[Tuple]:
+    """Clean a chunk of demographic rows; missing ages become null"""
+    cleaned = []
+    for row in rows:
+        user_id = to_int(row.get("user_id"))
+        if user_id is not None:
+            cleaned.append((user_id, to_float(row.get("age"))))
+    return cleaned
+
+
+def iter_sheet_chunks(worksheet, columns: Dict[str, str], chunk_size: int) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Stream a worksheet as chunks of rows keyed by database column name
+
+    Args:
+        worksheet: A read-only openpyxl worksheet
+        columns: Mapping of header text to database column
+        chunk_size: Rows per chunk
+
+    Raises:
+        ValueError: If an expected header is missing
+    """
+    rows = worksheet.iter_rows(values_only=True)
+    header = [str(cell).strip() if cell is not None else "" for cell in next(rows, ())]
+    missing = [name for name in columns if name not in header]
+    if missing:
+        raise ValueError(f"Sheet '{worksheet.title}' is missing columns: {', '.join(missing)}")
+    positions = [(header.index(name), column) for name, column in columns.items()]
+
+    while True:
+        chunk = [
+            {column: row[index] if index < len(row) else None for index, column in positions}
+            for row in islice(rows, chunk_size)
+        ]
+        if not chunk:
+            return
+        yield chunk
+
+
+def clean_chunks(chunks: Iterable[List[Dict[str, Any]]], clean: Callable[[List[Dict[str, Any]]], List[Tuple]],
+                 executor: Optional[ProcessPoolExecutor], max_pending: int) -> Iterator[List[Tuple]]:
+    """
+    Clean chunks in order, in worker processes when an executor is given
+
+    At most max_pending chunks are in flight at once, so memory stays bounded
+    no matter how large the sheet is.
+    """
+    if executor is None:
+        for chunk in chunks:
+            yield clean(chunk)
+        return
+
+    pending = deque()
+    for chunk in chunks:
+        pending.append(executor.submit(clean, chunk))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def create_table(cursor: sqlite3.Cursor, name: str, columns: Sequence[Tuple[str, str]]):
+    """Create a table from (column, type) pairs"""
+    cursor.execute(f"DROP TABLE IF EXISTS {name}")
+    cursor.execute(f"CREATE TABLE {name} ({', '.join(f'{column} {kind}' for column, kind in columns)})")
+
+
+def load_sheet(cursor: sqlite3.Cursor, worksheet, table: str, table_columns: Sequence[Tuple[str, str]],
+               sheet_columns: Dict[str, str], clean: Callable[[List[Dict[str, Any]]], List[Tuple]],
+               chunk_size: int, executor: Optional[ProcessPoolExecutor], max_pending: int) -> int:
+    """Stream one sheet into a freshly created table and return the row count"""
+    create_table(cursor, table, table_columns)
+    insert_sql = f"INSERT INTO {table} VALUES ({', '.join('?' for _ in table_columns)})"
+    loaded = 0
+    chunks = iter_sheet_chunks(worksheet, sheet_columns, chunk_size)
+    for cleaned in clean_chunks(chunks, clean, executor, max_pending):
+        cursor.executemany(insert_sql, cleaned)
+        loaded += len(cleaned)
+    return loaded
+
+
+def load_xlsx(conn: sqlite3.Connection, xlsx_path: str, chunk_size: int = 5000, workers: int = 1) -> Dict[str, int]:
+    """
+    Load the raw workbook into the demographics, riders and trips tables
+
+    Args:
+        conn: Open database connection; the caller commits
+        xlsx_path: Path to FetiiAI_Data_Austin.xlsx
+        chunk_size: Rows cleaned and inserted per batch
+        workers: Worker processes used for cleaning (1 cleans in-process)
+
+    Returns:
+        Number of rows loaded per table
+    """
+    cursor = conn.cursor()
+    workbook = load_workbook(xlsx_path, read_only=True, data_only=True)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    max_pending = workers * 2
+    counts = {}
+
+    try:
+        print("Loading demographics data from workbook...")
+        counts["demographics"] = load_sheet(
+            cursor, workbook[DEMOGRAPHICS_SHEET], "demographics", DEMOGRAPHICS_TABLE,
+            DEMOGRAPHIC_COLUMNS, clean_demographic_rows, chunk_size, executor, max_pending
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_demographics_user_id ON demographics(user_id)")
+
+        print("Loading riders data from workbook...")
+        counts["riders"] = load_sheet(
+            cursor, workbook[RIDERS_SHEET], "riders", RIDERS_TABLE,
+            RIDER_COLUMNS, clean_rider_rows, chunk_size, executor, max_pending
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_riders_trip_id ON riders(trip_id)")
+        cursor.execute(
+            "UPDATE riders SET age = (SELECT d.age FROM demographics d WHERE d.user_id = riders.user_id)"
+        )
+
+        print("Loading trips data from workbook...")
+        counts["trips"] = load_sheet(
+            cursor, workbook[TRIPS_SHEET], "trips", TRIPS_TABLE,
+            TRIP_COLUMNS, clean_trip_rows, chunk_size, executor, max_pending
+        )
+        # Derived from the riders sheet, so computed in SQL once both are loaded
+        cursor.execute('''
+            UPDATE trips SET group_size_from_checked = (
+                SELECT COUNT(*) FROM riders r WHERE r.trip_id = trips.trip_id
+            )
+        ''')
+        cursor.execute(
+            "UPDATE trips SET group_size = CAST(group_size_from_checked AS INTEGER) WHERE group_size IS NULL"
+        )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        workbook.close()
+
+    print(f"Workbook loaded: {counts['trips']} trips, {counts['riders']} riders, "
+          f"{counts['demographics']} demographics rows")
+    return counts
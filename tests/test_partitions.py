@@ -0,0 +1,88 @@
+"""
+Regression tests for partition routing: partitioned queries must return the
+same answers as the unpartitioned database
+"""
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from partitions import PartitionRouter, get_date_bounds, partition_database  # noqa: E402
+
+# 3 trips in August, 7 in September; every trip has 2 riders
+TRIPS = [(trip_id, f"2025-08-{20 + trip_id:02d}") for trip_id in range(1, 4)] + \
+        [(trip_id, f"2025-09-{trip_id:02d}") for trip_id in range(4, 11)]
+
+QUERIES = [
+    "SELECT COUNT(*) FROM trips t, riders r WHERE t.trip_id = r.trip_id",
+    "SELECT SUM(CASE WHEN date >= '2025-09-01' THEN 1 ELSE 0 END), COUNT(*) FROM trips",
+    "SELECT COUNT(*) FROM trips WHERE NOT (date >= '2025-09-01')",
+    "SELECT COUNT(*) FROM trips WHERE date >= '2025-09-01' OR trip_id = 1",
+    "SELECT COUNT(*) FROM trips WHERE date >= '2025-09-01'",
+    "SELECT COUNT(*) FROM trips t JOIN riders r ON r.trip_id = t.trip_id WHERE t.date < '2025-09-01'",
+    "SELECT COUNT(*) FROM trips a JOIN trips b ON a.trip_id = b.trip_id - 3 WHERE a.date LIKE '2025-08%'",
+    "SELECT COUNT(*) FROM trips WHERE trip_id IN (SELECT trip_id FROM riders) AND date >= '2025-09-01'",
+]
+
+
+def _build(path: Path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE trips (trip_id INTEGER PRIMARY KEY, date TEXT)")
+    conn.execute("CREATE TABLE riders (trip_id INTEGER, user_id INTEGER)")
+    conn.executemany("INSERT INTO trips VALUES (?, ?)", TRIPS)
+    conn.executemany(
+        "INSERT INTO riders VALUES (?, ?)",
+        [(trip_id, trip_id * 10 + seat) for trip_id, _ in TRIPS for seat in range(2)]
+    )
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture(scope="module")
+def databases(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("partitions")
+    full, partitioned = directory / "full.db", directory / "partitioned.db"
+    _build(full)
+    _build(partitioned)
+    partition_database(str(partitioned))
+    return full, partitioned
+
+
+@pytest.mark.parametrize("sql", QUERIES)
+def test_routed_query_matches_unpartitioned(databases, sql):
+    full, partitioned = databases
+    router = PartitionRouter(str(partitioned))
+    conn = router.connect()
+    expected = sqlite3.connect(full).execute(sql).fetchall()
+    assert conn.execute(router.prepare(conn, sql)).fetchall() == expected
+
+
+def test_unrouted_connection_reads_partitions(databases):
+    _, partitioned = databases
+    conn = PartitionRouter(str(partitioned)).connect()
+    assert conn.execute(QUERIES[0]).fetchone() == (20,)
+
+
+def test_main_tables_are_refused(databases):
+    _, partitioned = databases
+    router = PartitionRouter(str(partitioned))
+    with pytest.raises(sqlite3.OperationalError):
+        router.prepare(router.connect(), "SELECT COUNT(*) FROM main.trips")
+
+
+@pytest.mark.parametrize("sql, bounds", [
+    ("SELECT * FROM trips WHERE date >= '2025-09-01' AND hour > 20", ("2025-09-01", None)),
+    ("SELECT * FROM trips WHERE (date BETWEEN '2025-09-01' AND '2025-09-07') LIMIT 5", ("2025-09-01", "2025-09-07")),
+    ("SELECT * FROM trips WHERE strftime('%Y-%m', date) = '2025-09'", ("2025-09", "2025-09-31")),
+    ("SELECT SUM(CASE WHEN date >= '2025-09-01' THEN 1 ELSE 0 END) FROM trips", None),
+    ("SELECT * FROM trips WHERE NOT (date >= '2025-09-01')", None),
+    ("SELECT * FROM trips WHERE date >= '2025-09-01' OR hour = 3", None),
+    ("SELECT * FROM trips WHERE (date >= '2025-09-01' OR hour = 3)", None),
+    ("SELECT * FROM trips WHERE hour IN (SELECT 1) AND date >= '2025-09-01'", None),
+    ("SELECT * FROM trips t JOIN riders r ON t.date >= '2025-09-01'", None),
+])
+def test_get_date_bounds(sql, bounds):
+    assert get_date_bounds(sql) == bounds